@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""Compares two result files written by ``benchmarks/hotpath.py``.
+
+Run as::
+
+    python benchmarks/compare.py OLD.json NEW.json [--threshold PERCENT]
+
+Prints the change of every measurement present in both files, flagging those
+slower by more than the threshold (10% by default). Exits with status 1 if any
+measurement regressed.
+"""
+
+import json
+import sys
+
+
+def load(path):
+    with open(path) as f:
+        report = json.load(f)
+
+    return dict(((r['phase'], r['store'], r['serializer'], r['size']),
+                 r['us']) for r in report['results'])
+
+
+def main(argv):
+    threshold = 10.0
+    if '--threshold' in argv:
+        i = argv.index('--threshold')
+        threshold = float(argv[i + 1])
+        del argv[i:i + 2]
+
+    old, new = load(argv[0]), load(argv[1])
+    regressed = False
+
+    print('%-19s %-10s %-10s %8s %10s %10s %8s' % (
+        'phase', 'store', 'serializer', 'size', 'old us', 'new us', 'change'))
+
+    for key in sorted(set(old) & set(new), key=lambda k: tuple(
+            '' if v is None else str(v) for v in k)):
+        phase, store, serializer, size = key
+        change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+        flag = ''
+        if change > threshold:
+            flag = ' !'
+            regressed = True
+
+        print('%-19s %-10s %-10s %8s %10.2f %10.2f %+7.1f%%%s' % (
+            phase, store or '-', serializer or '-',
+            size if size is not None else '-', old[key], new[key], change,
+            flag))
+
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
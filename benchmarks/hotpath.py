@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""Times each phase of loading and saving a session in isolation.
+
+Run from the repository root::
+
+    PYTHONPATH=. python benchmarks/hotpath.py [--json] [--quick] [--output FILE]
+
+Phases not depending on the store or serializer (cookie handling, session ids
+in both key formats and generating random ids) are measured once, store and
+serialization phases for every combination of store, serializer and payload
+size. Timings are the best of several runs, in microseconds per call.
+
+The JSON output includes the Python version and the current commit, results of
+two runs can be compared using ``benchmarks/compare.py``.
+"""
+
+from datetime import datetime, timedelta
+import json
+import os
+import platform
+from random import SystemRandom
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import timeit
+
+from itsdangerous import Signer
+from simplekv import KeyValueStore
+from simplekv.fs import FilesystemStore
+from simplekv.memory import DictStore
+
+from flask_kvsession import SessionID
+from flask_kvsession.idgen import BufferedSystemRandom
+from flask_kvsession.serializers import dump_payload, load_payload, serializers
+
+
+SIZES = [0, 1024, 16 * 1024, 64 * 1024]
+SECRET_KEY = 'benchmark-secret-key'
+
+
+class SQLiteStore(KeyValueStore):
+    """A minimal store keeping values in an SQLite table."""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS kv '
+                        '(key TEXT PRIMARY KEY, value BLOB)')
+
+    def _get(self, key):
+        row = self.db.execute('SELECT value FROM kv WHERE key = ?',
+                              (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return bytes(row[0])
+
+    def _put(self, key, data):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO kv VALUES (?, ?)',
+                            (key, sqlite3.Binary(data)))
+        return key
+
+    def _delete(self, key):
+        with self.db:
+            self.db.execute('DELETE FROM kv WHERE key = ?', (key,))
+
+    def _has_key(self, key):
+        return self.db.execute('SELECT 1 FROM kv WHERE key = ?',
+                               (key,)).fetchone() is not None
+
+    def iter_keys(self, prefix=u''):
+        for row in self.db.execute('SELECT key FROM kv'):
+            if row[0].startswith(prefix):
+                yield row[0]
+
+    def close(self):
+        self.db.close()
+
+
+def make_session(size):
+    """Return a session whose pickled form is roughly ``size`` bytes."""
+    session = {'_permanent': True}
+    i = 0
+    while sum(len(k) + len(v) + 8 for k, v in session.items()
+              if k != '_permanent') < size:
+        session['key_%04d' % i] = '%064x' % (i * 2654435761)
+        i += 1
+    return session
+
+
+def bench(func, repeat=5):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(number=number, repeat=repeat)) / number * 1e6
+
+
+def commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_cookie_phases(repeat):
+    signer = Signer(SECRET_KEY)
+    sid = SessionID(0x1234567890abcdef)
+    sid_s = sid.serialize()
+    compact_s = sid.serialize(compact=True)
+    cookie = signer.sign(sid_s.encode('ascii'))
+    lifetime = timedelta(days=31)
+    system = SystemRandom()
+    buffered = BufferedSystemRandom()
+
+    return [
+        ('unsign', bench(lambda: Signer(SECRET_KEY).unsign(cookie), repeat)),
+        ('serialize', bench(sid.serialize, repeat)),
+        ('serialize_compact', bench(lambda: sid.serialize(compact=True),
+                                    repeat)),
+        ('unserialize', bench(lambda: SessionID.unserialize(sid_s), repeat)),
+        ('unserialize_compact', bench(
+            lambda: SessionID.unserialize(compact_s), repeat)),
+        ('expiry', bench(lambda: sid.has_expired(lifetime), repeat)),
+        ('sign', bench(lambda: Signer(SECRET_KEY).sign(sid_s.encode('ascii')),
+                       repeat)),
+        ('new_id_system', bench(lambda: system.getrandbits(64), repeat)),
+        ('new_id_buffered', bench(lambda: buffered.getrandbits(64), repeat)),
+    ]
+
+
+def run_store_phases(stores, sizes, repeat):
+    results = []
+    key = SessionID(0x1234567890abcdef).serialize()
+
+    for size in sizes:
+        session = make_session(size)
+
+        for name in sorted(serializers):
+            serializer = serializers[name]
+            data = dump_payload(serializer, session)
+
+            results.append(('serialize', None, name, size, len(data), bench(
+                lambda: dump_payload(serializer, session), repeat)))
+            results.append(('deserialize', None, name, size, len(data),
+                            bench(lambda: load_payload(data), repeat)))
+
+            for store_name, store in stores:
+                store.put(key, data)
+                results.append(('get', store_name, name, size, len(data),
+                                bench(lambda: store.get(key), repeat)))
+                results.append(('put', store_name, name, size, len(data),
+                                bench(lambda: store.put(key, data), repeat)))
+    return results
+
+
+def run(sizes=SIZES, repeat=5):
+    tmp = tempfile.mkdtemp()
+
+    try:
+        os.mkdir(os.path.join(tmp, 'fs'))
+        sqlite = SQLiteStore(os.path.join(tmp, 'sessions.db'))
+        stores = [
+            ('dict', DictStore()),
+            ('filesystem', FilesystemStore(os.path.join(tmp, 'fs'))),
+            ('sqlite', sqlite),
+        ]
+
+        results = []
+        for phase, us in run_cookie_phases(repeat):
+            results.append({'phase': phase, 'store': None, 'serializer': None,
+                            'size': None, 'bytes': None, 'us': us})
+
+        for phase, store, serializer, size, nbytes, us in run_store_phases(
+                stores, sizes, repeat):
+            results.append({'phase': phase, 'store': store,
+                            'serializer': serializer, 'size': size,
+                            'bytes': nbytes, 'us': us})
+        sqlite.close()
+    finally:
+        shutil.rmtree(tmp)
+
+    return {
+        'python': platform.python_version(),
+        'commit': commit(),
+        'date': datetime.utcnow().isoformat(),
+        'results': results,
+    }
+
+
+def main(argv):
+    if '--quick' in argv:
+        report = run(sizes=[0, 16 * 1024], repeat=1)
+    else:
+        report = run()
+
+    if '--output' in argv:
+        with open(argv[argv.index('--output') + 1], 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if '--json' in argv:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return
+
+    print('%-19s %-10s %-10s %8s %8s %10s' % ('phase', 'store', 'serializer',
+                                              'size', 'bytes', 'us'))
+    for r in report['results']:
+        print('%-19s %-10s %-10s %8s %8s %10.2f' % (
+            r['phase'], r['store'] or '-', r['serializer'] or '-',
+            r['size'] if r['size'] is not None else '-',
+            r['bytes'] if r['bytes'] is not None else '-', r['us']))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""Measures the throughput of session id generation.
+
+Run from the repository root::
+
+    PYTHONPATH=. python benchmarks/idgen.py [--ids 200000] [--bits 64]
+        [--threads 1,4,16] [--json]
+
+Compares :class:`random.SystemRandom`, which reads from the operating system
+for every id, with :class:`~flask_kvsession.idgen.BufferedSystemRandom`, using
+a single source shared by all threads as the application does. Reports ids
+generated per second.
+"""
+
+import argparse
+import json
+from random import SystemRandom
+import sys
+from threading import Thread
+from timeit import default_timer
+
+from flask_kvsession.idgen import BufferedSystemRandom
+
+
+SOURCES = [
+    ('system', SystemRandom),
+    ('buffered', BufferedSystemRandom),
+]
+
+
+def run(source, ids, bits, threads):
+    per_thread = ids // threads
+
+    def generate():
+        getrandbits = source.getrandbits
+        for _ in range(per_thread):
+            getrandbits(bits)
+
+    workers = [Thread(target=generate) for _ in range(threads)]
+    start = default_timer()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return per_thread * threads / (default_timer() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ids', type=int, default=200000,
+                        help='number of ids per run')
+    parser.add_argument('--bits', type=int, default=64,
+                        help='bits per id')
+    parser.add_argument('--threads', default='1,4,16',
+                        help='comma-separated numbers of threads')
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    args = parser.parse_args(argv)
+
+    results = []
+    for threads in [int(n) for n in args.threads.split(',')]:
+        for name, cls in SOURCES:
+            results.append({'source': name, 'threads': threads,
+                            'ids_per_second': run(cls(), args.ids, args.bits,
+                                                  threads)})
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return
+
+    print('%-10s %8s %14s' % ('source', 'threads', 'ids/s'))
+    for r in results:
+        print('%-10s %8d %14.0f' % (r['source'], r['threads'],
+                                    r['ids_per_second']))
+
+
+if __name__ == '__main__':
+    main()
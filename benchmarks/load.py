@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+"""Simulates many concurrent users of an application using sessions.
+
+Run from the repository root::
+
+    PYTHONPATH=. python benchmarks/load.py [--users 1000] [--requests 20000]
+        [--threads 16] [--mix read=70,write=25,regenerate=3,destroy=2]
+        [--store dict|filesystem] [--config SESSION_SERIALIZER=json ...]
+        [--record FILE | --replay FILE] [--json]
+
+Every virtual user has its own test client and thus its own session cookie.
+Users are spread over a pool of threads, each user's requests are made in
+order. The sample application has the same routes as ``tests/conftest.py``.
+
+Reports throughput and latency percentiles per operation. ``--record`` saves
+the generated sequence of requests, ``--replay`` runs a saved or otherwise
+recorded trace: a file with one JSON object per line, containing ``user``
+(any hashable value) and ``op`` (``read``, ``write``, ``regenerate`` or
+``destroy``); writes may specify ``key`` and ``value``.
+"""
+
+import argparse
+import json
+import math
+import random
+import shutil
+import sys
+import tempfile
+from threading import Thread
+from timeit import default_timer
+
+from flask import Flask, session
+from simplekv.fs import FilesystemStore
+from simplekv.memory import DictStore
+
+from flask_kvsession import KVSessionExtension
+
+
+OPERATIONS = ('read', 'write', 'regenerate', 'destroy')
+
+
+def create_app(store, config=None):
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'devkey'
+    app.config.update(config or {})
+    app.kvsession = KVSessionExtension(store, app)
+
+    @app.route('/store-in-session/<key>/<value>/')
+    def store(key, value):
+        session[key] = value
+        return 'stored %r at %r' % (value, key)
+
+    @app.route('/dump-session/')
+    def dump():
+        return json.dumps(dict(session))
+
+    @app.route('/regenerate-session/')
+    def regenerate():
+        session.regenerate()
+        return 'session regenerated'
+
+    @app.route('/destroy-session/')
+    def destroy():
+        session.destroy()
+        return 'session destroyed'
+
+    return app
+
+
+def path_for(request):
+    op = request['op']
+
+    if op == 'read':
+        return '/dump-session/'
+    if op == 'write':
+        return '/store-in-session/%s/%s/' % (request.get('key', 'k'),
+                                             request.get('value', 'v'))
+    if op == 'regenerate':
+        return '/regenerate-session/'
+    if op == 'destroy':
+        return '/destroy-session/'
+    raise ValueError('Unknown operation: %r' % op)
+
+
+def parse_mix(mix):
+    weights = dict((op, 0) for op in OPERATIONS)
+    for part in mix.split(','):
+        op, _, weight = part.partition('=')
+        if op not in weights:
+            raise ValueError('Unknown operation: %r' % op)
+        weights[op] = float(weight)
+    return weights
+
+
+def generate(users, requests, mix, seed=0):
+    """Return a list of ``requests`` random requests by ``users`` users."""
+    rnd = random.Random(seed)
+    ops = [op for op in OPERATIONS if mix[op] > 0]
+    weights = [mix[op] for op in ops]
+    total = sum(weights)
+
+    trace = []
+    for _ in range(requests):
+        x = rnd.uniform(0, total)
+        for op, weight in zip(ops, weights):
+            x -= weight
+            if x <= 0:
+                break
+
+        request = {'user': rnd.randrange(users), 'op': op}
+        if op == 'write':
+            request['key'] = 'key_%d' % rnd.randrange(10)
+            request['value'] = '%016x' % rnd.getrandbits(64)
+        trace.append(request)
+    return trace
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    k = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[min(max(k, 0), len(values) - 1)]
+
+
+def run(app, trace, threads=16):
+    """Replay ``trace`` against ``app`` and return a report."""
+    # all requests of a user are made by the same thread, in order
+    users = sorted(set(r['user'] for r in trace), key=repr)
+    thread_of = dict((user, i % threads) for i, user in enumerate(users))
+    work = [[] for _ in range(threads)]
+    for request in trace:
+        work[thread_of[request['user']]].append(request)
+
+    results = [[] for _ in range(threads)]
+
+    def worker(requests, out):
+        clients = {}
+        for request in requests:
+            client = clients.get(request['user'])
+            if client is None:
+                client = clients[request['user']] = app.test_client()
+
+            path = path_for(request)
+            start = default_timer()
+            rv = client.get(path)
+            out.append((request['op'], default_timer() - start,
+                        rv.status_code))
+
+    pool = [Thread(target=worker, args=(work[i], results[i]))
+            for i in range(threads)]
+
+    start = default_timer()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = default_timer() - start
+
+    latencies = dict((op, []) for op in OPERATIONS)
+    errors = 0
+    for out in results:
+        for op, latency, status in out:
+            latencies[op].append(latency)
+            if status != 200:
+                errors += 1
+
+    operations = {}
+    for op, values in latencies.items():
+        if not values:
+            continue
+        values.sort()
+        operations[op] = {
+            'count': len(values),
+            'mean_ms': sum(values) / len(values) * 1e3,
+            'p50_ms': percentile(values, 50) * 1e3,
+            'p95_ms': percentile(values, 95) * 1e3,
+            'p99_ms': percentile(values, 99) * 1e3,
+        }
+
+    return {
+        'requests': len(trace),
+        'users': len(users),
+        'threads': threads,
+        'elapsed': elapsed,
+        'throughput': len(trace) / elapsed if elapsed else None,
+        'errors': errors,
+        'operations': operations,
+    }
+
+
+def parse_config(items):
+    config = {}
+    for item in items:
+        name, _, value = item.partition('=')
+        try:
+            config[name] = json.loads(value)
+        except ValueError:
+            config[name] = value
+    return config
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--mix', default='read=70,write=25,regenerate=3,'
+                                         'destroy=2')
+    parser.add_argument('--store', choices=['dict', 'filesystem'],
+                        default='dict')
+    parser.add_argument('--config', action='append', default=[],
+                        metavar='NAME=VALUE')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--record', metavar='FILE')
+    parser.add_argument('--replay', metavar='FILE')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.replay:
+        with open(args.replay) as f:
+            trace = [json.loads(line) for line in f if line.strip()]
+    else:
+        trace = generate(args.users, args.requests, parse_mix(args.mix),
+                         args.seed)
+
+    if args.record:
+        with open(args.record, 'w') as f:
+            for request in trace:
+                f.write(json.dumps(request) + '\n')
+
+    tmp = None
+    if args.store == 'filesystem':
+        tmp = tempfile.mkdtemp()
+        store = FilesystemStore(tmp)
+    else:
+        store = DictStore()
+
+    try:
+        app = create_app(store, parse_config(args.config))
+        report = run(app, trace, args.threads)
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp)
+
+    report['store'] = args.store
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return
+
+    print('%d requests by %d users in %.2fs: %.0f requests/s, %d errors' % (
+        report['requests'], report['users'], report['elapsed'],
+        report['throughput'], report['errors']))
+    print('%-12s %8s %9s %9s %9s %9s' % ('operation', 'count', 'mean ms',
+                                         'p50 ms', 'p95 ms', 'p99 ms'))
+    for op in OPERATIONS:
+        r = report['operations'].get(op)
+        if r is not None:
+            print('%-12s %8d %9.3f %9.3f %9.3f %9.3f' % (
+                op, r['count'], r['mean_ms'], r['p50_ms'], r['p95_ms'],
+                r['p99_ms']))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
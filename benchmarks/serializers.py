@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Compares speed and payload size of the available session serializers.
+
+Run from the repository root::
+
+    PYTHONPATH=. python benchmarks/serializers.py [--json]
+
+Timings are the best of several runs, in microseconds per call.
+"""
+
+from datetime import datetime
+import json
+import sys
+import timeit
+
+from flask_kvsession.serializers import dump_payload, serializers
+
+
+# resembles a typical session: a handful of flat values
+SESSION = {
+    '_permanent': True,
+    'user_id': 48151623,
+    'username': 'jdoe',
+    'locale': 'en_US',
+    'csrf_token': 'c2a4d0a7b6e44f3fa2f0b2d6e1c1a9b0',
+    'logged_in_at': datetime(2014, 3, 1, 12, 30, 15),
+    'last_seen': datetime(2014, 3, 1, 12, 45, 2, 5001),
+    'cart_items': 3,
+    'flash_count': 0,
+    'theme': 'dark',
+}
+
+
+def bench(func, number=10000, repeat=5):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def run():
+    results = []
+    for name in sorted(serializers):
+        serializer = serializers[name]
+        payload = serializer.dumps(SESSION)
+
+        results.append({
+            'serializer': name,
+            'dumps_us': bench(lambda: serializer.dumps(SESSION)) * 1e6,
+            'loads_us': bench(lambda: serializer.loads(payload)) * 1e6,
+            'size': len(dump_payload(serializer, SESSION)),
+        })
+    return results
+
+
+def main(argv):
+    results = run()
+
+    if '--json' in argv:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return
+
+    print('%-10s %10s %10s %8s' % ('serializer', 'dumps us', 'loads us',
+                                   'bytes'))
+    for r in results:
+        print('%-10s %10.2f %10.2f %8d' % (r['serializer'], r['dumps_us'],
+                                           r['loads_us'], r['size']))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -3,75 +3,69 @@ flask_kvsession is a drop-in replacement module for Flask sessions that uses a
 :class:`simplekv.KeyValueStore` as a backend for server-side sessions.
 """
 
-import calendar
+import atexit
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
-from datetime import datetime
-from random import SystemRandom
-import re
+from datetime import timedelta
+import hashlib
+import time
+from timeit import default_timer
 
-from flask import current_app
+from flask import current_app, request as current_request
 from flask.sessions import SessionMixin, SessionInterface
 from itsdangerous import Signer, BadSignature
 from werkzeug.datastructures import CallbackDict
 
+from .budget import SizeBudget
+from .cache import MissingCache, SessionCache
+from .cleanup import cleanup_store
+from .cookie import (cookie_timestamp, decode_cookie_value,
+                     encode_cookie_value, is_cookie_value)
+from .compression import (decompress_payload, get_compressor,
+                          PayloadCompression)
+from .expiryindex import ExpiryIndex
+from .idgen import BufferedSystemRandom
+from .local import LocalStore
+from .metrics import MultiCollector
+from .pipeline import execute, Operation
+from .redisstore import redis_store, touch as redis_touch
+from .serializers import (dump_payload, get_serializer, load_payload,
+                          TaggedJSONSerializer)
+from .sessionid import KEY_REGEX, session_key_regex, SessionID
+from .writebehind import WriteBehindQueue
 
-class SessionID(object):
-    """Helper class for parsing session ids.
 
-    Internally, Flask-KVSession stores session ids that are serialized as
-    ``KEY_CREATED``, where ``KEY`` is a random number (the sessions "true" id)
-    and ``CREATED`` a UNIX-timestamp of when the session was created.
-
-    :param id: An integer to be used as the session key.
-    :param created: A :class:`~datetime.datetime` instance or None. A value of
-                    None will result in :meth:`~datetime.datetime.utcnow()` to
-                    be used.
-    """
-
-    def __init__(self, id, created=None):
-        if None == created:
-            created = datetime.utcnow()
-
-        self.id = id
-        self.created = created
-
-    def has_expired(self, lifetime, now=None):
-        """Report if the session key has expired.
+class KVSession(CallbackDict, SessionMixin):
+    # modified is hardcoded as true in SessionMixin, override this
+    # upon modification, we set this manually through _on_update (see
+    # __init__)
+    _modified = False
 
-        :param lifetime: A :class:`datetime.timedelta` that specifies the
-                         maximum age this :class:`SessionID` should be checked
-                         against.
-        :param now: If specified, use this :class:`~datetime.datetime` instance
-                         instead of :meth:`~datetime.datetime.utcnow()` as the
-                         current time.
-        """
-        now = now or datetime.utcnow()
-        return now > self.created + lifetime
+    # set if ``modified`` was assigned, usually after changing a value in
+    # place. only then are keys not in dirty_keys checked for changes
+    explicitly_modified = False
 
-    def serialize(self):
-        """Serializes to the standard form of ``KEY_CREATED``"""
-        return '%x_%x' % (self.id, calendar.timegm(self.created.utctimetuple())
-                          )
+    # digest of the payload the session was loaded from, used to detect
+    # modifications that did not actually change anything
+    digest = None
 
-    @classmethod
-    def unserialize(cls, string):
-        """Unserializes from a string.
+    # UNIX timestamp of the last time the expiration of the session was
+    # extended, only used with sliding expiration
+    refreshed = None
 
-        :param string: A string created by :meth:`serialize`.
-        """
-        id_s, created_s = string.split('_')
-        return cls(int(id_s, 16),
-                   datetime.utcfromtimestamp(int(created_s, 16)))
+    # the session contents encoded for the cookie, for sessions kept in the
+    # cookie instead of the store (see flask_kvsession.cookie)
+    cookie_value = None
 
+    # set if the session was destroyed, the cookie has to be removed when
+    # saving
+    cookie_removed = False
 
-class KVSession(CallbackDict, SessionMixin):
-    # modified is hardcoded as true in SessionMixin, override this
-    # upon modification, we set this manually through _on_update (see
-    # __init__)
-    modified = False
+    # UNIX timestamp of the last write of the session, carried in the cookie
+    # for stores reading from replicas (see flask_kvsession.replicated)
+    written = None
     """Replacement session class.
 
     Instances of this class will replace the session (and thus be available
@@ -82,13 +76,69 @@ class KVSession(CallbackDict, SessionMixin):
 
     def __init__(self, initial=None):
         def _on_update(d):
-            d.modified = True
+            d._modified = True
+
+        # keys set or deleted since loading, allows stores supporting it to
+        # only write what has changed
+        self.dirty_keys = set()
+
+        # session ids to remove from the store when saving, with pipelining
+        self.pending_deletes = []
 
         CallbackDict.__init__(self, initial, _on_update)
 
+    @property
+    def modified(self):
+        return self._modified
+
+    @modified.setter
+    def modified(self, value):
+        self._modified = self.explicitly_modified = value
+
+    def __setitem__(self, key, value):
+        self.dirty_keys.add(key)
+        CallbackDict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.dirty_keys.add(key)
+        CallbackDict.__delitem__(self, key)
+
+    def clear(self):
+        self.dirty_keys.update(self.keys())
+        CallbackDict.clear(self)
+
+    def pop(self, key, *args):
+        self.dirty_keys.add(key)
+        return CallbackDict.pop(self, key, *args)
+
+    def popitem(self):
+        item = CallbackDict.popitem(self)
+        self.dirty_keys.add(item[0])
+        return item
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.dirty_keys.add(key)
+        return CallbackDict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        other = dict(*args, **kwargs)
+        self.dirty_keys.update(other)
+        CallbackDict.update(self, other)
+
+    def _remove_stored(self):
+        # with pipelining, the stored session is removed along with the next
+        # write when the session is saved
+        if current_app.config['SESSION_PIPELINE']:
+            self.pending_deletes.append(self.sid_s)
+        else:
+            current_app.session_interface.delete_session_data(current_app,
+                                                              self.sid_s)
+
     def destroy(self):
         """Destroys a session completely, by deleting all keys and removing it
-        from the internal store immediately.
+        from the internal store immediately (or, with ``SESSION_PIPELINE``,
+        when the session is saved).
 
         This allows removing a session for security reasons, e.g. a login
         stored in a session will cease to exist if the session is destroyed.
@@ -97,8 +147,12 @@ class KVSession(CallbackDict, SessionMixin):
             del self[k]
 
         if getattr(self, 'sid_s', None):
-            current_app.kvsession_store.delete(self.sid_s)
+            self._remove_stored()
             self.sid_s = None
+            self.cookie_removed = True
+        elif self.cookie_value is not None:
+            self.cookie_value = None
+            self.cookie_removed = True
 
         self.modified = False
         self.new = False
@@ -115,49 +169,390 @@ class KVSession(CallbackDict, SessionMixin):
 
         if getattr(self, 'sid_s', None):
             # delete old session
-            current_app.kvsession_store.delete(self.sid_s)
+            self._remove_stored()
 
             # remove sid_s, set modified
             self.sid_s = None
             self.modified = True
 
             # save_session() will take care of saving the session now
+        elif self.cookie_value is not None:
+            # the session is kept in the cookie, it is saved with a new
+            # creation time
+            self.cookie_value = None
+
+
+class LazyKVSession(KVSession):
+    """A session that is loaded from the store on first access.
+
+    Only the cookie signature and expiration are checked when the session is
+    opened. The stored data is fetched once the session contents are read or
+    changed for the first time; requests that never touch the session do not
+    cause any reads from the backend.
+
+    If the session turns out to be missing from the store, it silently
+    becomes a new, empty session (the same way a missing session is treated
+    by non-lazy loading).
+
+    :param loader: A callable returning a tuple of the session data as a
+                   dictionary and the digest of its payload, or raising
+                   :exc:`KeyError` if the session does not exist.
+    """
+
+    def __init__(self, loader=None):
+        KVSession.__init__(self)
+        self._loader = loader
+
+    @property
+    def loaded(self):
+        """``True`` once the session data has been retrieved."""
+        return self._loader is None
+
+    def _load(self):
+        loader, self._loader = self._loader, None
+
+        try:
+            values, self.digest = loader()
+        except KeyError:
+            self.sid_s = None
+            self.new = True
+        else:
+            # bypass the update callback, loading does not modify
+            dict.update(self, values)
+
+    def _loading(name):
+        method = getattr(KVSession, name)
+
+        def wrapper(self, *args, **kwargs):
+            if self._loader is not None:
+                self._load()
+            return method(self, *args, **kwargs)
+
+        wrapper.__name__ = name
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+
+    __contains__ = _loading('__contains__')
+    __delitem__ = _loading('__delitem__')
+    __eq__ = _loading('__eq__')
+    __getitem__ = _loading('__getitem__')
+    __iter__ = _loading('__iter__')
+    __len__ = _loading('__len__')
+    __ne__ = _loading('__ne__')
+    __repr__ = _loading('__repr__')
+    __setitem__ = _loading('__setitem__')
+    clear = _loading('clear')
+    copy = _loading('copy')
+    get = _loading('get')
+    items = _loading('items')
+    keys = _loading('keys')
+    pop = _loading('pop')
+    popitem = _loading('popitem')
+    setdefault = _loading('setdefault')
+    update = _loading('update')
+    values = _loading('values')
+    regenerate = _loading('regenerate')
+
+    if hasattr(dict, 'iteritems'):
+        has_key = _loading('has_key')
+        iteritems = _loading('iteritems')
+        iterkeys = _loading('iterkeys')
+        itervalues = _loading('itervalues')
+
+    del _loading
+
+    def destroy(self):
+        # no need to fetch data that is about to be removed
+        self._loader = None
+        KVSession.destroy(self)
+    destroy.__doc__ = KVSession.destroy.__doc__
 
 
 class KVSessionInterface(SessionInterface):
+    #: Used to load sessions that were stored without a serializer header
+    #: by earlier versions. New sessions are written using the serializer
+    #: configured through ``SESSION_SERIALIZER``.
     serialization_method = pickle
     session_class = KVSession
+    #: Serializes sessions kept in the cookie (see
+    #: :mod:`flask_kvsession.cookie`).
+    cookie_serializer = TaggedJSONSerializer()
+    lazy_session_class = LazyKVSession
+
+    def payload_digest(self, data):
+        """Return a digest of a serialized session, used to detect whether
+        saving a session would change the stored data."""
+        return hashlib.sha1(data).digest()
+
+    def _load_blob(self, app, data):
+        # returns the values, digest and uncompressed payload of a session
+        # stored as a single value
+        if app.kvsession_compression is not None:
+            data = app.kvsession_compression.decompress(data)
+        else:
+            data = decompress_payload(data)
+
+        values = load_payload(data, self.serialization_method)
+        return values, self.payload_digest(data), data
+
+    def _load_cached(self, data):
+        # deserializes a cached payload or dictionary of field payloads
+        if isinstance(data, dict):
+            return dict((key, load_payload(field, self.serialization_method))
+                        for key, field in data.items())
+        return load_payload(data, self.serialization_method)
+
+    def _lookup_cached(self, app, sid_s):
+        # returns the cached values and digest of a session or None, raises
+        # KeyError if the session is known not to exist
+        metrics = app.kvsession_metrics
+
+        if app.kvsession_cache is not None:
+            entry = app.kvsession_cache.lookup(sid_s)
+            if entry is not None:
+                if metrics is not None:
+                    metrics.increment('cache_hit')
+                data, digest = entry
+                return self._load_cached(data), digest
+
+        missing = app.kvsession_missing_cache
+        if missing is not None and missing.is_missing(sid_s):
+            if metrics is not None:
+                metrics.increment('missing_cache_hit')
+            raise KeyError(sid_s)
+
+        return None
+
+    def _not_found(self, app, sid_s):
+        # records a session found missing in the store
+        if app.kvsession_metrics is not None:
+            app.kvsession_metrics.increment('not_found')
+
+        if app.kvsession_missing_cache is not None:
+            app.kvsession_missing_cache.add(sid_s)
+
+    def _reader(self, app, written):
+        # stores reading from replicas route reads of recently written
+        # sessions to the primary
+        store = app.kvsession_store
+        if hasattr(store, 'reader'):
+            return store.reader(written)
+        return store
+
+    def load_session_data(self, app, sid_s, written=None):
+        """Return the stored contents of the session ``sid_s`` along with the
+        digest of the payload.
+
+        The session cache and the cache of missing sessions (if enabled) are
+        consulted first, on a miss the data is retrieved from the store and
+        deserialized.
+
+        :param written: UNIX timestamp of the last write of the session, if
+                        known from the cookie.
+        :raises KeyError: If the session does not exist in the store.
+        """
+        cache = app.kvsession_cache
+        metrics = app.kvsession_metrics
+
+        entry = self._lookup_cached(app, sid_s)
+        if entry is not None:
+            return entry
+
+        store = self._reader(app, written)
+        hash_support = getattr(store, 'hash_support', False)
+        if metrics is not None:
+            start = default_timer()
+
+        try:
+            if hash_support:
+                fields = store.get_fields(sid_s)
+            elif app.kvsession_write_behind is not None:
+                # writes still queued in this process take precedence
+                data = app.kvsession_write_behind.get(sid_s, store)
+            else:
+                data = store.get(sid_s)
+        except KeyError:
+            self._not_found(app, sid_s)
+            raise
+
+        if hash_support:
+            if metrics is not None:
+                now = default_timer()
+                metrics.observe('get', now - start,
+                                sum(len(data) for data in fields.values()))
+                start = now
+
+            # every key is stored in its own field
+            values = {}
+            digest = {}
+            for key, data in fields.items():
+                values[key] = load_payload(data, self.serialization_method)
+                digest[key] = (self.payload_digest(data), len(data))
+            size = sum(size for _, size in digest.values())
+        else:
+            if metrics is not None:
+                now = default_timer()
+                metrics.observe('get', now - start, len(data))
+                start = now
+
+            values, digest, data = self._load_blob(app, data)
+            size = len(data)
+
+        if metrics is not None:
+            metrics.observe('deserialize', default_timer() - start, size)
+
+        if cache is not None:
+            cache.put(sid_s, fields if hash_support else data, size, digest)
+
+        return values, digest
+
+    def delete_session_data(self, app, sid_s):
+        """Remove the session ``sid_s`` from the store, the cache and the
+        expiry index."""
+        metrics = app.kvsession_metrics
+        if metrics is not None:
+            start = default_timer()
+
+        if app.kvsession_write_behind is not None:
+            app.kvsession_write_behind.delete(sid_s)
+        else:
+            app.kvsession_store.delete(sid_s)
+
+        if metrics is not None:
+            metrics.observe('delete', default_timer() - start)
+
+        self._forget(app, sid_s)
+
+    def _forget(self, app, sid_s):
+        # drops a deleted session from the cache and the expiry index
+        if app.kvsession_cache is not None:
+            app.kvsession_cache.invalidate(sid_s)
+
+        # stale cookies of the session are answered without the store
+        if app.kvsession_missing_cache is not None:
+            app.kvsession_missing_cache.add(sid_s)
+
+        if app.kvsession_expiry_index is not None:
+            app.kvsession_expiry_index.remove(app.kvsession_store, sid_s)
+
+    def _write(self, app, session, store, method, *args):
+        # calls a store method writing the session. deletions pending from
+        # destroy() or regenerate() are executed in the same batch
+        deletes = session.pending_deletes
+        if not deletes:
+            return getattr(store, method)(*args)
+
+        session.pending_deletes = []
+        execute(store, [Operation('delete', (sid_s,)) for sid_s in deletes] +
+                [Operation(method, args)])
+
+        for sid_s in deletes:
+            self._forget(app, sid_s)
 
     def open_session(self, app, request):
+        tracer = app.kvsession_tracer
+        if tracer is None:
+            return self._open_session(app, request)
+
+        with tracer.span('open_session', request.environ):
+            return self._open_session(app, request)
+
+    def _session_id(self, app, request):
+        """Return the session id, the time of its last refresh (with sliding
+        expiration) and the time of its last write (for stores reading from
+        replicas) from the session cookie, or ``None`` if there is no valid
+        cookie or the session has expired."""
+        session_cookie = request.cookies.get(
+            app.config['SESSION_COOKIE_NAME'], None)
+
+        if not session_cookie:
+            return None
+
+        metrics = app.kvsession_metrics
+        refreshed = None
+        written = None
+
+        try:
+            if metrics is not None:
+                start = default_timer()
+
+            # restore the cookie, if it has been manipulated,
+            # we will find out here
+            try:
+                cookie_value = Signer(app.secret_key).unsign(
+                    session_cookie).decode('ascii')
+            except BadSignature:
+                if metrics is not None:
+                    metrics.increment('bad_signature')
+                raise
+
+            if metrics is not None:
+                metrics.observe('signature', default_timer() - start)
+
+            # the time of the last write and, with sliding expiration, the
+            # time of the last refresh are appended to the session id
+            cookie_value, _, written_s = cookie_value.partition('!')
+            if written_s:
+                written = int(written_s, 16)
+
+            sid_s, _, refreshed_s = cookie_value.partition(':')
+            if is_cookie_value(sid_s):
+                # the session is kept in the cookie
+                created = cookie_timestamp(sid_s)
+            else:
+                created = SessionID.unserialize(sid_s).timestamp
+
+            lifetime = app.permanent_session_lifetime.total_seconds()
+            if app.config['SESSION_SLIDING_EXPIRATION']:
+                if refreshed_s:
+                    refreshed = int(refreshed_s, 16)
+                else:
+                    refreshed = created
+
+                if time.time() - refreshed > lifetime:
+                    raise KeyError
+            elif time.time() > created + lifetime:
+                # we reach this point if a "non-permanent" session has
+                # expired, but is made permanent. silently ignore the
+                # error with a new session
+                raise KeyError
+        except (BadSignature, KeyError):
+            # the cookie was manipulated or the session has expired
+            return None
+
+        return sid_s, refreshed, written
+
+    def _open_session(self, app, request):
         key = app.secret_key
 
         if key is not None:
-            session_cookie = request.cookies.get(
-                app.config['SESSION_COOKIE_NAME'], None)
-
             s = None
+            cookie = self._session_id(app, request)
+
+            if cookie is not None:
+                sid_s, refreshed, written = cookie
 
-            if session_cookie:
                 try:
-                    # restore the cookie, if it has been manipulated,
-                    # we will find out here
-                    sid_s = Signer(app.secret_key).unsign(
-                        session_cookie).decode('ascii')
-                    sid = SessionID.unserialize(sid_s)
-
-                    if sid.has_expired(app.permanent_session_lifetime):
-                        # we reach this point if a "non-permanent" session has
-                        # expired, but is made permanent. silently ignore the
-                        # error with a new session
-                        raise KeyError
-
-                    # retrieve from store
-                    s = self.session_class(self.serialization_method.loads(
-                        current_app.kvsession_store.get(sid_s)))
-                    s.sid_s = sid_s
-                except (BadSignature, KeyError):
-                    # either the cookie was manipulated or we did not find the
-                    # session in the backend.
+                    if is_cookie_value(sid_s):
+                        # the contents are in the cookie, nothing to retrieve
+                        s = self._load_cookie_session(app, sid_s)
+                    else:
+                        if app.config['SESSION_LAZY_LOAD']:
+                            # defer retrieval until the session is accessed
+                            s = self.lazy_session_class(
+                                lambda: self.load_session_data(app, sid_s,
+                                                               written))
+                        else:
+                            # retrieve from cache or store
+                            values, digest = self.load_session_data(
+                                app, sid_s, written)
+                            s = self.session_class(values)
+                            s.digest = digest
+                        s.sid_s = sid_s
+                        s.written = written
+                    s.refreshed = refreshed
+                except KeyError:
+                    # we did not find the session in the backend
                     pass
 
             if s is None:
@@ -166,41 +561,428 @@ class KVSessionInterface(SessionInterface):
 
             return s
 
+    def _load_cookie_session(self, app, cookie_value):
+        metrics = app.kvsession_metrics
+        if metrics is not None:
+            start = default_timer()
+
+        data, _ = decode_cookie_value(cookie_value)
+        s = self.session_class(self.cookie_serializer.loads(data))
+        s.digest = self.payload_digest(data)
+        s.cookie_value = cookie_value
+
+        if metrics is not None:
+            metrics.observe('deserialize', default_timer() - start, len(data))
+        return s
+
+    def _store_in_cookie(self, app, session):
+        """Keep a session in the cookie if it is small enough.
+
+        :returns: ``None`` if the session has to be written to the store
+                  instead, otherwise whether the cookie needs updating.
+        """
+        threshold = app.config['SESSION_COOKIE_THRESHOLD']
+        if threshold is None:
+            return None
+
+        metrics = app.kvsession_metrics
+        if metrics is not None:
+            start = default_timer()
+
+        try:
+            # stops early for sessions that are too large anyway
+            data = self.cookie_serializer.dumps_limited(dict(session),
+                                                        threshold)
+        except (TypeError, ValueError):
+            # the contents cannot be represented as JSON
+            return None
+
+        if data is None:
+            return None
+
+        if metrics is not None:
+            metrics.observe('serialize', default_timer() - start, len(data))
+
+        digest = self.payload_digest(data)
+        if (session.cookie_value is not None and
+                app.config['SESSION_SKIP_UNCHANGED'] and
+                digest == session.digest):
+            if metrics is not None:
+                metrics.increment('write_skipped')
+            return False
+
+        if getattr(session, 'sid_s', None):
+            # the session shrank, it no longer needs to be stored
+            session._remove_stored()
+            session.sid_s = None
+
+        if session.cookie_value is not None:
+            created = cookie_timestamp(session.cookie_value)
+        else:
+            created = int(time.time())
+
+        session.cookie_value = encode_cookie_value(data, created)
+        session.digest = digest
+        return True
+
+    def _new_sid(self, app, session):
+        # create a new session id if requested (by setting sid_s to None)
+        # this makes it possible to avoid session fixation
+        if not getattr(session, 'sid_s', None):
+            key_bits = app.config['SESSION_KEY_BITS']
+            session.sid_s = SessionID(
+                app.config['SESSION_RANDOM_SOURCE'].getrandbits(
+                    key_bits)).serialize(
+                        app.config['SESSION_KEY_FORMAT'] == 'compact',
+                        key_bits)
+
+    def _ttl(self, app, store):
+        if getattr(store, 'ttl_support', False):
+            return app.permanent_session_lifetime.total_seconds()
+
+    def _observe_fields(self, metrics, start, fields):
+        now = default_timer()
+        metrics.observe('serialize', now - start,
+                        sum(len(data) for data in fields.values()))
+        return now
+
+    def _key_sizes(self, serializer, session):
+        # the share of each key in the serialized session
+        empty = len(dump_payload(serializer, {}))
+        return dict((key, len(dump_payload(serializer, {key: value})) - empty)
+                    for key, value in session.items())
+
+    def _store_fields(self, app, session, store, force):
+        serializer = app.kvsession_serializer
+        skip_unchanged = app.config['SESSION_SKIP_UNCHANGED']
+        ttl = self._ttl(app, store)
+        metrics = app.kvsession_metrics
+        budget = app.kvsession_size_budget
+
+        if metrics is not None:
+            start = default_timer()
+
+        def check(digest):
+            # returns the keys removed to fit the hard limit
+            sizes = dict((key, size) for key, (_, size) in digest.items())
+            removed = budget.check(session, sum(sizes.values()),
+                                   lambda: sizes, metrics)
+            for key in removed:
+                fields.pop(key, None)
+                del digest[key]
+            return removed
+
+        if (not force and getattr(session, 'sid_s', None) and
+                isinstance(session.digest, dict)):
+            # the session exists in the store, only write changed keys.
+            # values changed in place (followed by setting ``modified``) are
+            # not in dirty_keys, only then is every key compared to its
+            # digest
+            digest = dict(session.digest)
+            fields = {}
+            deleted = []
+
+            if session.explicitly_modified:
+                keys = set(session) | set(session.digest)
+            else:
+                keys = session.dirty_keys
+
+            for key in keys:
+                if key in session:
+                    data = dump_payload(serializer, session[key])
+                    field_digest = (self.payload_digest(data), len(data))
+
+                    if (digest.get(key) == field_digest and
+                            (skip_unchanged or
+                             key not in session.dirty_keys)):
+                        continue
+
+                    fields[key] = data
+                    digest[key] = field_digest
+                elif key in digest:
+                    deleted.append(key)
+                    del digest[key]
+
+            if skip_unchanged and not fields and not deleted:
+                if metrics is not None:
+                    metrics.observe('serialize', default_timer() - start)
+                    metrics.increment('write_skipped')
+                return False
+
+            deleted.extend(key for key in check(digest)
+                           if key in session.digest)
+
+            if metrics is not None:
+                start = self._observe_fields(metrics, start, fields)
+            self._write(app, session, store, 'update_fields', session.sid_s,
+                        fields, deleted, ttl)
+        else:
+            self._new_sid(app, session)
+
+            digest = {}
+            fields = {}
+            deleted = None
+            for key, value in session.items():
+                data = dump_payload(serializer, value)
+                fields[key] = data
+                digest[key] = (self.payload_digest(data), len(data))
+            check(digest)
+
+            if metrics is not None:
+                start = self._observe_fields(metrics, start, fields)
+            self._write(app, session, store, 'put_fields', session.sid_s,
+                        fields, ttl)
+
+        if metrics is not None:
+            metrics.observe('put', default_timer() - start,
+                            sum(len(data) for data in fields.values()))
+
+        size = sum(size for _, size in digest.values())
+        if app.kvsession_cache is not None:
+            if deleted is None:
+                app.kvsession_cache.put(session.sid_s, fields, size, digest)
+            else:
+                # fields not written are unchanged in the cached entry
+                app.kvsession_cache.update_fields(session.sid_s, fields,
+                                                  deleted, size, digest)
+        if app.kvsession_missing_cache is not None:
+            app.kvsession_missing_cache.invalidate(session.sid_s)
+
+        budget.record(size)
+        session.digest = digest
+        return True
+
+    def store_session_data(self, app, session, force=False):
+        """Write a modified session to the store, assigning a new session id
+        first if it does not have one.
+
+        :param force: If ``True``, the whole session is written, even if it
+                      is unchanged.
+        :returns: ``False`` if writing was skipped, because the session
+                  contents are identical to what is stored already.
+        """
+        store = app.kvsession_store
+        is_new = not getattr(session, 'sid_s', None)
+
+        if getattr(store, 'hash_support', False):
+            written = self._store_fields(app, session, store, force)
+        else:
+            written = self._store_blob(app, session, store, force)
+
+        if written and is_new and app.kvsession_expiry_index is not None:
+            app.kvsession_expiry_index.add(store, session.sid_s)
+
+        if written and hasattr(store, 'reader'):
+            # later requests, served by any process, read the session from
+            # the primary until replicas have caught up
+            session.written = int(time.time())
+
+        return written
+
+    def _serialize_blob(self, app, session, force):
+        # returns the values, serialized data, digest and data to store of a
+        # session stored as a single value, or None if it is unchanged
+        metrics = app.kvsession_metrics
+        if metrics is not None:
+            start = default_timer()
+
+        values = dict(session)
+        data = dump_payload(app.kvsession_serializer, values)
+        digest = self.payload_digest(data)
+
+        if (not force and app.config['SESSION_SKIP_UNCHANGED'] and
+                getattr(session, 'sid_s', None) and
+                digest == session.digest):
+            # values were assigned, but the session is the same as the
+            # stored one. neither store nor cookie need updating
+            if metrics is not None:
+                metrics.observe('serialize', default_timer() - start,
+                                len(data))
+                metrics.increment('write_skipped')
+            return None
+
+        budget = app.kvsession_size_budget
+        serializer = app.kvsession_serializer
+        removed = budget.check(session, len(data),
+                               lambda: self._key_sizes(serializer, session),
+                               metrics)
+        while removed:
+            # keys were removed to fit the hard limit, the estimate may be
+            # off. the limits were already reported on the first check
+            values = dict(session)
+            data = dump_payload(serializer, values)
+            digest = self.payload_digest(data)
+            removed = budget.check(
+                session, len(data),
+                lambda: self._key_sizes(serializer, session), metrics,
+                report=False)
+        budget.record(len(data))
+
+        self._new_sid(app, session)
+
+        if app.kvsession_compression is not None:
+            stored = app.kvsession_compression.compress(data)
+        else:
+            stored = data
+
+        if metrics is not None:
+            metrics.observe('serialize', default_timer() - start, len(stored))
+
+        return values, data, digest, stored
+
+    def _blob_stored(self, app, session, values, data, digest):
+        if app.kvsession_cache is not None:
+            app.kvsession_cache.put(session.sid_s, data, len(data), digest)
+        if app.kvsession_missing_cache is not None:
+            app.kvsession_missing_cache.invalidate(session.sid_s)
+
+        session.digest = digest
+
+    def _store_blob(self, app, session, store, force):
+        blob = self._serialize_blob(app, session, force)
+        if blob is None:
+            return False
+
+        values, data, digest, stored = blob
+        metrics = app.kvsession_metrics
+        if metrics is not None:
+            start = default_timer()
+
+        ttl = self._ttl(app, store)
+        if app.kvsession_write_behind is not None:
+            self._delete_pending(app, session)
+            app.kvsession_write_behind.put(session.sid_s, stored, ttl)
+        elif ttl is not None:
+            # TTL is supported
+            self._write(app, session, store, 'put', session.sid_s, stored, ttl)
+        else:
+            self._write(app, session, store, 'put', session.sid_s, stored)
+
+        if metrics is not None:
+            metrics.observe('put', default_timer() - start, len(stored))
+
+        self._blob_stored(app, session, values, data, digest)
+        return True
+
+    def touch_session_data(self, app, session):
+        """Extend the time-to-live of a stored session without changing it.
+
+        Stores providing a ``touch(key, ttl_secs)`` method are asked to update
+        the time-to-live, as is redis for a
+        :class:`~simplekv.memory.redisstore.RedisStore`. Other stores
+        supporting time-to-live have the session rewritten. Nothing needs to
+        be done for stores without time-to-live support."""
+        store = app.kvsession_store
+        ttl = self._ttl(app, store)
+
+        if ttl is None:
+            return
+
+        redis = redis_store(store)
+        if hasattr(store, 'touch'):
+            store.touch(session.sid_s, ttl)
+        elif redis is not None:
+            redis_touch(redis, session.sid_s, ttl)
+        else:
+            self.store_session_data(app, session, force=True)
+
     def save_session(self, app, session, response):
-        # we only save modified sessions
+        tracer = app.kvsession_tracer
+        if tracer is None:
+            return self._save_session(app, session, response)
+
+        environ = current_request.environ
+        try:
+            with tracer.span('save_session', environ):
+                self._save_session(app, session, response)
+        finally:
+            tracer.finish(environ)
+
+    def _needs_refresh(self, app, session, written):
+        # with sliding expiration, extend the lifetime, but not more often
+        # than necessary
+        if (not app.config['SESSION_SLIDING_EXPIRATION'] or
+                not (getattr(session, 'sid_s', None) or
+                     session.cookie_value)):
+            return False
+
+        interval = app.config['SESSION_REFRESH_INTERVAL']
+        if isinstance(interval, timedelta):
+            interval = interval.total_seconds()
+
+        return (written or
+                int(time.time()) - (session.refreshed or 0) >= interval)
+
+    def _set_cookie(self, app, session, response):
+        # the session is stored now, so it is no longer new
+        session.new = False
+        cookie_value = session.cookie_value or session.sid_s
+
+        if app.config['SESSION_SLIDING_EXPIRATION']:
+            session.refreshed = int(time.time())
+            cookie_value += ':%x' % session.refreshed
+
+        written = session.written
+        if (written is not None and session.cookie_value is None and
+                time.time() - written <
+                getattr(app.kvsession_store, 'marker_ttl', 0)):
+            cookie_value += '!%x' % written
+
+        metrics = app.kvsession_metrics
+        if metrics is not None:
+            start = default_timer()
+
+        # save sid_s in cookie
+        cookie_data = Signer(app.secret_key).sign(
+            cookie_value.encode('ascii'))
+
+        response.set_cookie(key=app.config['SESSION_COOKIE_NAME'],
+                            value=cookie_data,
+                            expires=self.get_expiration_time(app, session),
+                            path=self.get_cookie_path(app),
+                            domain=self.get_cookie_domain(app),
+                            secure=app.config['SESSION_COOKIE_SECURE'],
+                            httponly=app.config['SESSION_COOKIE_HTTPONLY'])
+
+        if metrics is not None:
+            metrics.observe('set_cookie', default_timer() - start,
+                            len(cookie_data))
+
+    def _delete_pending(self, app, session):
+        deletes = session.pending_deletes
+        if deletes:
+            session.pending_deletes = []
+            for sid_s in deletes:
+                self.delete_session_data(app, sid_s)
+
+    def _save_session(self, app, session, response):
+        # we only save modified sessions. lazy sessions that were never
+        # accessed cannot have been modified either
+        written = False
         if session.modified:
-            # create a new session id if requested (by setting sid_s to None)
-            # this makes it possible to avoid session fixation
-            if not getattr(session, 'sid_s', None):
-                session.sid_s = SessionID(
-                    current_app.config['SESSION_RANDOM_SOURCE'].getrandbits(
-                        app.config['SESSION_KEY_BITS'])).serialize()
-
-            # save the session, now its no longer new (or modified)
-            data = self.serialization_method.dumps(dict(session))
-            store = current_app.kvsession_store
-
-            if getattr(store, 'ttl_support', False):
-                # TTL is supported
-                ttl = current_app.permanent_session_lifetime.total_seconds()
-                store.put(session.sid_s, data, ttl)
-            else:
-                store.put(session.sid_s, data)
+            written = self._store_in_cookie(app, session)
+            if written is None:
+                # too large to be kept in the cookie
+                session.cookie_value = None
+                written = self.store_session_data(app, session)
 
-            session.new = False
+            session.dirty_keys.clear()
             session.modified = False
 
-            # save sid_s in cookie
-            cookie_data = Signer(app.secret_key).sign(
-                session.sid_s.encode('ascii'))
+        # deletions not sent along with a write
+        self._delete_pending(app, session)
+
+        refresh = self._needs_refresh(app, session, written)
+        if refresh and not written and getattr(session, 'sid_s', None):
+            self.touch_session_data(app, session)
 
-            response.set_cookie(key=app.config['SESSION_COOKIE_NAME'],
-                                value=cookie_data,
-                                expires=self.get_expiration_time(app, session),
-                                path=self.get_cookie_path(app),
-                                domain=self.get_cookie_domain(app),
-                                secure=app.config['SESSION_COOKIE_SECURE'],
-                                httponly=app.config['SESSION_COOKIE_HTTPONLY'])
+        if written or refresh:
+            self._set_cookie(app, session, response)
+        elif session.cookie_removed:
+            # a destroyed session kept in the cookie
+            response.delete_cookie(app.config['SESSION_COOKIE_NAME'],
+                                   path=self.get_cookie_path(app),
+                                   domain=self.get_cookie_domain(app))
 
 
 class KVSessionExtension(object):
@@ -210,16 +992,25 @@ class KVSessionExtension(object):
                             `simplekv.KeyValueStore` interface that session
                             data will be store in.
     :param app: The app to activate. If not `None`, this is essentially the
-                same as calling :meth:`init_app` later."""
-    key_regex = re.compile('^[0-9a-f]+_[0-9a-f]+$')
+                same as calling :meth:`init_app` later.
+    :param store_factory: A callable returning a new store, used instead of
+                          ``session_kvstore`` to create stores per process
+                          (or thread, see ``SESSION_STORE_PER_THREAD``). See
+                          :class:`~flask_kvsession.local.LocalStore`."""
+    #: Matches the keys of sessions to clean up. Unless overridden, keys of
+    #: ``SESSION_KEY_BITS`` random bits are matched (see
+    #: :func:`~flask_kvsession.sessionid.session_key_regex`).
+    key_regex = KEY_REGEX
 
-    def __init__(self, session_kvstore=None, app=None):
+    def __init__(self, session_kvstore=None, app=None, store_factory=None):
         self.default_kvstore = session_kvstore
+        self.default_store_factory = store_factory
 
-        if app and session_kvstore:
+        if app and (session_kvstore or store_factory):
             self.init_app(app)
 
-    def cleanup_sessions(self, app=None):
+    def cleanup_sessions(self, app=None, batch_size=1000, workers=1,
+                         rate_limit=None, use_index=True):
         """Removes all expired session from the store.
 
         Periodically, this function can be called to remove sessions from
@@ -227,44 +1018,177 @@ class KVSessionExtension(object):
         automatically unless the backend supports time-to-live and has been
         configured appropriately (see :class:`~simplekv.TimeToLiveMixin`).
 
-        This function retrieves all session keys, checks they are older than
-        :attr:`flask.Flask.permanent_session_lifetime` and if so, removes them.
+        This function iterates over all session keys, checks they are older
+        than :attr:`flask.Flask.permanent_session_lifetime` and if so, removes
+        them. Keys are examined in batches of ``batch_size``, the expired keys
+        of each batch are removed together (using the store's
+        ``delete_many`` method, if available).
+
+        If ``SESSION_EXPIRY_INDEX`` is enabled, only the index buckets of
+        expired sessions are visited instead (see
+        :class:`~flask_kvsession.expiryindex.ExpiryIndex`).
 
         Note that no distinction is made between non-permanent and permanent
         sessions.
 
         :param app: The app whose sessions should be cleaned up. If ``None``,
-                    uses :py:data:`~flask.current_app`."""
+                    uses :py:data:`~flask.current_app`.
+        :param batch_size: Number of keys examined at once.
+        :param workers: Number of threads processing batches in parallel.
+                        Not used when cleaning up through the index.
+        :param rate_limit: Maximum number of sessions deleted per second.
+                           ``None`` means no limit.
+        :param use_index: If ``False``, scan all keys even if an expiry index
+                          is available. Useful to catch sessions missing from
+                          the index.
+        :returns: A :class:`~flask_kvsession.cleanup.CleanupResult`."""
 
         if not app:
             app = current_app
-        for key in app.kvsession_store.keys():
-            m = self.key_regex.match(key)
-            now = datetime.utcnow()
-            if m:
-                # read id
-                sid = SessionID.unserialize(key)
-
-                # remove if expired
-                if sid.has_expired(app.permanent_session_lifetime, now):
-                    app.kvsession_store.delete(key)
-
-    def init_app(self, app, session_kvstore=None):
+
+        if use_index and app.kvsession_expiry_index is not None:
+            return app.kvsession_expiry_index.expire(
+                app.kvsession_store,
+                app.permanent_session_lifetime.total_seconds(),
+                batch_size=batch_size,
+                rate_limit=rate_limit)
+
+        return cleanup_store(
+            app.kvsession_store,
+            app.permanent_session_lifetime.total_seconds(),
+            app.kvsession_key_regex,
+            batch_size=batch_size,
+            workers=workers,
+            rate_limit=rate_limit)
+
+    def init_app(self, app, session_kvstore=None, store_factory=None):
         """Initialize application and KVSession.
 
         This will replace the session management of the application with
         Flask-KVSession's.
 
-        :param app: The :class:`~flask.Flask` app to be initialized."""
+        :param app: The :class:`~flask.Flask` app to be initialized.
+        :param session_kvstore: Overrides the store passed on construction.
+        :param store_factory: Overrides the store factory passed on
+                              construction."""
         app.config.setdefault('SESSION_KEY_BITS', 64)
-        app.config.setdefault('SESSION_RANDOM_SOURCE', SystemRandom())
+        app.config.setdefault('SESSION_KEY_FORMAT', 'hex')
+        app.config.setdefault('SESSION_RANDOM_SOURCE',
+                              BufferedSystemRandom())
+        app.config.setdefault('SESSION_CACHE_MAX_ENTRIES', 0)
+        app.config.setdefault('SESSION_CACHE_MAX_BYTES', None)
+        app.config.setdefault('SESSION_CACHE_TTL', 60)
+        app.config.setdefault('SESSION_MISSING_CACHE_MAX_ENTRIES', 0)
+        app.config.setdefault('SESSION_MISSING_CACHE_TTL', 10)
+        app.config.setdefault('SESSION_LAZY_LOAD', False)
+        app.config.setdefault('SESSION_SERIALIZER', None)
+        app.config.setdefault('SESSION_COMPRESSION', None)
+        app.config.setdefault('SESSION_COMPRESSION_THRESHOLD', 1024)
+        app.config.setdefault('SESSION_SKIP_UNCHANGED', True)
+        app.config.setdefault('SESSION_SLIDING_EXPIRATION', False)
+        app.config.setdefault('SESSION_REFRESH_INTERVAL', 60)
+        app.config.setdefault('SESSION_EXPIRY_INDEX', False)
+        app.config.setdefault('SESSION_EXPIRY_INDEX_BUCKET', 3600)
+        app.config.setdefault('SESSION_WRITE_BEHIND', False)
+        app.config.setdefault('SESSION_WRITE_BEHIND_WORKERS', 2)
+        app.config.setdefault('SESSION_WRITE_BEHIND_QUEUE_SIZE', 1000)
+        app.config.setdefault('SESSION_WRITE_BEHIND_OVERFLOW', 'block')
+        app.config.setdefault('SESSION_STORE_PER_THREAD', False)
+        app.config.setdefault('SESSION_METRICS', None)
+        app.config.setdefault('SESSION_TRACER', None)
+        app.config.setdefault('SESSION_SIZE_SOFT_LIMIT', None)
+        app.config.setdefault('SESSION_SIZE_HARD_LIMIT', None)
+        app.config.setdefault('SESSION_SIZE_LIMIT_POLICY', 'raise')
+        app.config.setdefault('SESSION_PIPELINE', False)
+        app.config.setdefault('SESSION_COOKIE_THRESHOLD', None)
 
-        if not session_kvstore and not self.default_kvstore:
-            raise ValueError('Must supply session_kvstore either on '
-                             'construction or init_app().')
+        if not session_kvstore and not store_factory:
+            session_kvstore = self.default_kvstore
+            store_factory = self.default_store_factory
+
+        if not session_kvstore and not store_factory:
+            raise ValueError('Must supply session_kvstore or store_factory '
+                             'either on construction or init_app().')
 
         # set store on app, either use default
         # or supplied argument
-        app.kvsession_store = session_kvstore or self.default_kvstore
+        if session_kvstore:
+            app.kvsession_store = session_kvstore
+        else:
+            app.kvsession_store = LocalStore(
+                store_factory, app.config['SESSION_STORE_PER_THREAD'])
+            atexit.register(app.kvsession_store.close)
+        # the tracer receives the same measurements as the collector
+        app.kvsession_tracer = app.config['SESSION_TRACER']
+        collectors = [c for c in (app.config['SESSION_METRICS'],
+                                  app.kvsession_tracer) if c is not None]
+        if len(collectors) > 1:
+            app.kvsession_metrics = MultiCollector(collectors)
+        elif collectors:
+            app.kvsession_metrics = collectors[0]
+        else:
+            app.kvsession_metrics = None
+        serializer = app.config['SESSION_SERIALIZER']
+        if serializer is None and app.config['SESSION_COMPRESSION']:
+            # compression flags the header, earlier versions cannot read
+            # compressed sessions anyway
+            serializer = 'pickle'
+        app.kvsession_serializer = get_serializer(serializer)
+        app.kvsession_size_budget = SizeBudget(
+            app.config['SESSION_SIZE_SOFT_LIMIT'],
+            app.config['SESSION_SIZE_HARD_LIMIT'],
+            app.config['SESSION_SIZE_LIMIT_POLICY'])
+
+        if app.config['SESSION_COMPRESSION']:
+            app.kvsession_compression = PayloadCompression(
+                get_compressor(app.config['SESSION_COMPRESSION']),
+                app.config['SESSION_COMPRESSION_THRESHOLD'])
+        else:
+            app.kvsession_compression = None
+
+        if self.key_regex is KEY_REGEX:
+            app.kvsession_key_regex = session_key_regex(
+                app.config['SESSION_KEY_BITS'])
+        else:
+            app.kvsession_key_regex = self.key_regex
+
+        if app.config['SESSION_EXPIRY_INDEX']:
+            app.kvsession_expiry_index = ExpiryIndex(
+                app.config['SESSION_EXPIRY_INDEX_BUCKET'],
+                key_regex=app.kvsession_key_regex)
+        else:
+            app.kvsession_expiry_index = None
+
+        # an in-process cache is only created if explicitly enabled
+        if app.config['SESSION_CACHE_MAX_ENTRIES']:
+            app.kvsession_cache = SessionCache(
+                app.config['SESSION_CACHE_MAX_ENTRIES'],
+                app.config['SESSION_CACHE_MAX_BYTES'],
+                app.config['SESSION_CACHE_TTL'])
+        else:
+            app.kvsession_cache = None
+
+        if app.config['SESSION_MISSING_CACHE_MAX_ENTRIES']:
+            app.kvsession_missing_cache = MissingCache(
+                app.config['SESSION_MISSING_CACHE_MAX_ENTRIES'],
+                app.config['SESSION_MISSING_CACHE_TTL'])
+        else:
+            app.kvsession_missing_cache = None
+
+        # a previous queue must not be left with unwritten sessions
+        if getattr(app, 'kvsession_write_behind', None) is not None:
+            app.kvsession_write_behind.close()
+
+        # sessions in hash stores are always written synchronously
+        if (app.config['SESSION_WRITE_BEHIND'] and
+                not getattr(app.kvsession_store, 'hash_support', False)):
+            app.kvsession_write_behind = WriteBehindQueue(
+                app.kvsession_store,
+                app.config['SESSION_WRITE_BEHIND_WORKERS'],
+                app.config['SESSION_WRITE_BEHIND_QUEUE_SIZE'],
+                app.config['SESSION_WRITE_BEHIND_OVERFLOW'])
+            atexit.register(app.kvsession_write_behind.close)
+        else:
+            app.kvsession_write_behind = None
 
         app.session_interface = KVSessionInterface()
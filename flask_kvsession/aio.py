@@ -0,0 +1,469 @@
+"""
+Sessions for applications running on asyncio, such as Quart, whose session
+interfaces are coroutines.
+
+Requires Python 3.7 or later. Stores are accessed through an asynchronous
+protocol, any object with these coroutine methods:
+
+``get(key)``
+    Return the value of ``key``, raise :exc:`KeyError` if it does not exist.
+
+``put(key, data, ttl_secs=None)``
+    Store ``data`` under ``key``. ``ttl_secs`` is only passed if the store has
+    a true ``ttl_support`` attribute.
+
+``delete(key)``
+    Remove ``key``, if it exists.
+
+``iter_keys(prefix='')``
+    An asynchronous iterator over all keys starting with ``prefix``.
+
+Optionally, ``delete_many(keys)`` removes several keys at once and
+``touch(key, ttl_secs)`` extends the time-to-live of a key.
+
+:class:`ExecutorStore` turns any :class:`simplekv.KeyValueStore` into an
+asynchronous store by running its methods on a thread pool,
+:class:`AsyncDictStore` keeps data in memory.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+import time
+from timeit import default_timer
+
+from . import KVSession, KVSessionExtension, KVSessionInterface
+from .cleanup import _is_dict_store, CleanupResult
+from .redisstore import redis_store, touch as redis_touch
+from .sessionid import key_timestamp
+
+
+class AsyncDictStore(object):
+    """An asynchronous store keeping data in a dictionary.
+
+    :param d: The dictionary to use, a new one is created if ``None``.
+    """
+
+    ttl_support = False
+
+    def __init__(self, d=None):
+        self.d = {} if d is None else d
+
+    async def get(self, key):
+        return self.d[key]
+
+    async def put(self, key, data, ttl_secs=None):
+        self.d[key] = data
+        return key
+
+    async def delete(self, key):
+        self.d.pop(key, None)
+
+    async def iter_keys(self, prefix=u''):
+        # a copy, keys may be deleted while iterating
+        for key in list(self.d):
+            if key.startswith(prefix):
+                yield key
+
+
+class ExecutorStore(object):
+    """Makes a synchronous store asynchronous by running its methods on an
+    executor.
+
+    Unless an ``executor`` is passed, a
+    :class:`~concurrent.futures.ThreadPoolExecutor` with ``max_workers``
+    threads is created, which limits the number of store operations running
+    at the same time. Keys are listed in batches of ``batch_size``.
+
+    :param store: A :class:`simplekv.KeyValueStore`.
+    :param max_workers: Number of threads of the executor.
+    :param executor: An executor to use instead of creating one.
+    :param batch_size: Number of keys retrieved per call when listing keys.
+    """
+
+    def __init__(self, store, max_workers=4, executor=None, batch_size=1000):
+        self.store = store
+        self.batch_size = batch_size
+        self._own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers)
+
+        if hasattr(store, 'touch'):
+            self.touch = self._touch
+        elif redis_store(store) is not None:
+            self.touch = self._redis_touch
+
+    @property
+    def ttl_support(self):
+        return getattr(self.store, 'ttl_support', False)
+
+    def _run(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(
+            self.executor, partial(func, *args))
+
+    async def get(self, key):
+        return await self._run(self.store.get, key)
+
+    async def put(self, key, data, ttl_secs=None):
+        if ttl_secs is not None:
+            return await self._run(self.store.put, key, data, ttl_secs)
+        return await self._run(self.store.put, key, data)
+
+    async def delete(self, key):
+        await self._run(self.store.delete, key)
+
+    def _delete_many(self, keys):
+        if hasattr(self.store, 'delete_many'):
+            self.store.delete_many(keys)
+        else:
+            for key in keys:
+                self.store.delete(key)
+
+    async def delete_many(self, keys):
+        """Delete several keys in a single call on the executor."""
+        await self._run(self._delete_many, keys)
+
+    async def _touch(self, key, ttl_secs):
+        await self._run(self.store.touch, key, ttl_secs)
+
+    async def _redis_touch(self, key, ttl_secs):
+        await self._run(redis_touch, redis_store(self.store), key, ttl_secs)
+
+    async def iter_keys(self, prefix=u''):
+        if _is_dict_store(self.store):
+            # dictionaries cannot be iterated while deleting from them
+            keys = iter(await self._run(self.store.keys, prefix))
+        else:
+            keys = await self._run(self.store.iter_keys, prefix)
+
+        while True:
+            batch = await self._run(list, islice(keys, self.batch_size))
+            if not batch:
+                return
+            for key in batch:
+                yield key
+
+    def close(self):
+        """Shut down the executor, if it was created by this store."""
+        if self._own_executor:
+            self.executor.shutdown()
+
+
+async def delete_many(store, keys):
+    """Delete several keys, using the store's ``delete_many`` method if it
+    has one, otherwise concurrently."""
+    if hasattr(store, 'delete_many'):
+        await store.delete_many(keys)
+    else:
+        await asyncio.gather(*[store.delete(key) for key in keys])
+
+
+async def cleanup_store(store, lifetime, key_regex, now=None, batch_size=1000,
+                        concurrency=4):
+    """Delete all sessions from an asynchronous ``store`` older than
+    ``lifetime``.
+
+    Expired keys are collected in batches of ``batch_size``. Each batch is
+    deleted by a task of its own while listing continues, with up to
+    ``concurrency`` batches in flight.
+
+    :param store: An asynchronous store.
+    :param lifetime: Maximum age of a session in seconds.
+    :param key_regex: Compiled regular expression matching session keys;
+                      other keys are left alone.
+    :param now: UNIX timestamp to check against, defaults to the current time.
+    :param batch_size: Number of keys deleted at once.
+    :param concurrency: Maximum number of batches being deleted at once.
+    :returns: A :class:`~flask_kvsession.cleanup.CleanupResult`.
+    """
+    start = default_timer()
+    cutoff = int(now if now is not None else time.time()) - lifetime
+    match = key_regex.match
+    # created here, as it must belong to the running loop
+    slots = asyncio.Semaphore(concurrency)
+    tasks = []
+
+    async def delete(batch):
+        try:
+            await delete_many(store, batch)
+        finally:
+            slots.release()
+        return len(batch)
+
+    async def flush(batch):
+        # waits for a free slot, so keys are not listed faster than they
+        # can be deleted
+        await slots.acquire()
+        tasks.append(asyncio.ensure_future(delete(batch)))
+
+    scanned = 0
+    batch = []
+    try:
+        async for key in store.iter_keys():
+            scanned += 1
+            if match(key) and key_timestamp(key) < cutoff:
+                batch.append(key)
+                if len(batch) >= batch_size:
+                    await flush(batch)
+                    batch = []
+
+        if batch:
+            await flush(batch)
+    finally:
+        deleted = sum(await asyncio.gather(*tasks))
+
+    return CleanupResult(scanned, deleted, default_timer() - start)
+
+
+class AsyncKVSession(KVSession):
+    """A session whose removal from the store is deferred until it is saved.
+
+    :meth:`destroy` and :meth:`regenerate` cannot wait for the store, the
+    session ids to delete are recorded in ``pending_deletes`` instead.
+    """
+
+    def _remove_stored(self):
+        self.pending_deletes.append(self.sid_s)
+
+
+class AsyncKVSessionInterface(KVSessionInterface):
+    """A session interface whose methods are coroutines, awaiting an
+    asynchronous store.
+
+    Deletions pending from :meth:`AsyncKVSession.destroy` and
+    :meth:`AsyncKVSession.regenerate` run concurrently with writing the
+    session when it is saved.
+    """
+
+    session_class = AsyncKVSession
+
+    async def load_session_data(self, app, sid_s):
+        """Return the stored contents of the session ``sid_s`` along with the
+        digest of the payload.
+
+        :raises KeyError: If the session does not exist in the store.
+        """
+        cache = app.kvsession_cache
+        metrics = app.kvsession_metrics
+
+        entry = self._lookup_cached(app, sid_s)
+        if entry is not None:
+            return entry
+
+        if metrics is not None:
+            start = default_timer()
+
+        try:
+            data = await app.kvsession_store.get(sid_s)
+        except KeyError:
+            self._not_found(app, sid_s)
+            raise
+
+        if metrics is not None:
+            now = default_timer()
+            metrics.observe('get', now - start, len(data))
+            start = now
+
+        values, digest, data = self._load_blob(app, data)
+
+        if metrics is not None:
+            metrics.observe('deserialize', default_timer() - start,
+                            len(data))
+
+        if cache is not None:
+            cache.put(sid_s, data, len(data), digest)
+
+        return values, digest
+
+    async def delete_session_data(self, app, sid_s):
+        """Remove the session ``sid_s`` from the store and the caches."""
+        metrics = app.kvsession_metrics
+        if metrics is not None:
+            start = default_timer()
+
+        await app.kvsession_store.delete(sid_s)
+
+        if metrics is not None:
+            metrics.observe('delete', default_timer() - start)
+
+        self._forget(app, sid_s)
+
+    async def open_session(self, app, request):
+        if app.secret_key is None:
+            return None
+
+        s = None
+        cookie = self._session_id(app, request)
+
+        if cookie is not None:
+            sid_s, refreshed, _ = cookie
+
+            try:
+                values, digest = await self.load_session_data(app, sid_s)
+            except KeyError:
+                # we did not find the session in the backend
+                pass
+            else:
+                s = self.session_class(values)
+                s.digest = digest
+                s.sid_s = sid_s
+                s.refreshed = refreshed
+
+        if s is None:
+            s = self.session_class()  # create an empty session
+            s.new = True
+
+        return s
+
+    async def store_session_data(self, app, session, force=False):
+        """Write a modified session to the store, assigning a new session id
+        first if it does not have one.
+
+        :param force: If ``True``, the whole session is written, even if it
+                      is unchanged.
+        :returns: ``False`` if writing was skipped, because the session
+                  contents are identical to what is stored already.
+        """
+        blob = self._serialize_blob(app, session, force)
+        if blob is None:
+            return False
+
+        values, data, digest, stored = blob
+        store = app.kvsession_store
+        metrics = app.kvsession_metrics
+        if metrics is not None:
+            start = default_timer()
+
+        ttl = self._ttl(app, store)
+        if ttl is not None:
+            await store.put(session.sid_s, stored, ttl)
+        else:
+            await store.put(session.sid_s, stored)
+
+        if metrics is not None:
+            metrics.observe('put', default_timer() - start, len(stored))
+
+        self._blob_stored(app, session, values, data, digest)
+        return True
+
+    async def touch_session_data(self, app, session):
+        """Extend the time-to-live of a stored session without changing it.
+        See :meth:`flask_kvsession.KVSessionInterface.touch_session_data`."""
+        store = app.kvsession_store
+        ttl = self._ttl(app, store)
+
+        if ttl is None:
+            return
+
+        if hasattr(store, 'touch'):
+            await store.touch(session.sid_s, ttl)
+        else:
+            await self.store_session_data(app, session, force=True)
+
+    async def _store_modified(self, app, session):
+        if not session.modified:
+            return False
+
+        written = await self.store_session_data(app, session)
+
+        session.dirty_keys.clear()
+        session.modified = False
+        return written
+
+    async def save_session(self, app, session, response):
+        deletes = getattr(session, 'pending_deletes', None) or []
+        if deletes:
+            session.pending_deletes = []
+
+        results = await asyncio.gather(
+            self._store_modified(app, session),
+            *[self.delete_session_data(app, sid_s) for sid_s in deletes])
+        written = results[0]
+
+        refresh = self._needs_refresh(app, session, written)
+        if refresh and not written:
+            await self.touch_session_data(app, session)
+
+        if written or refresh:
+            self._set_cookie(app, session, response)
+
+
+def awaits_session_interface(app):
+    """Return ``True`` if ``app`` dispatches requests in a coroutine, like
+    Quart does, and therefore awaits ``open_session`` and ``save_session``."""
+    return asyncio.iscoroutinefunction(
+        getattr(app, 'full_dispatch_request', None))
+
+
+class AsyncKVSessionExtension(KVSessionExtension):
+    """Activates asynchronous sessions for an application.
+
+    Configuration is the same as for
+    :class:`~flask_kvsession.KVSessionExtension`, except that lazy loading,
+    write-behind, the expiry index, sessions kept in the cookie, tracing and
+    stores with per-field operations are not supported.
+
+    Only apps awaiting their session interface, such as Quart apps, can be
+    activated. Flask calls the session interface synchronously and is
+    rejected.
+
+    :param session_kvstore: An asynchronous store, see
+                            :mod:`flask_kvsession.aio`.
+    :param app: The app to activate. If not `None`, this is essentially the
+                same as calling :meth:`init_app` later.
+    """
+
+    #: Options that cannot be used with asynchronous sessions.
+    unsupported_options = ('SESSION_LAZY_LOAD', 'SESSION_WRITE_BEHIND',
+                           'SESSION_EXPIRY_INDEX', 'SESSION_COOKIE_THRESHOLD',
+                           'SESSION_TRACER')
+
+    def __init__(self, session_kvstore=None, app=None):
+        #: The app last passed to :meth:`init_app`.
+        self.app = None
+        KVSessionExtension.__init__(self, session_kvstore, app)
+
+    async def cleanup_sessions(self, app=None, batch_size=1000,
+                               concurrency=4):
+        """Removes all expired session from the store, see
+        :func:`cleanup_store`.
+
+        :param app: The app whose sessions should be cleaned up. If ``None``,
+                    uses the app last passed to :meth:`init_app`.
+        :param batch_size: Number of keys deleted at once.
+        :param concurrency: Maximum number of batches being deleted at once.
+        :returns: A :class:`~flask_kvsession.cleanup.CleanupResult`."""
+        if not app:
+            app = self.app
+
+        return await cleanup_store(
+            app.kvsession_store,
+            app.permanent_session_lifetime.total_seconds(),
+            app.kvsession_key_regex,
+            batch_size=batch_size,
+            concurrency=concurrency)
+
+    def init_app(self, app, session_kvstore=None):
+        """Initialize application and asynchronous sessions.
+
+        :param app: The app to be initialized.
+        :param session_kvstore: Overrides the store passed on construction.
+        :raises ValueError: If ``app`` does not await its session interface
+                            or uses an unsupported option."""
+        if not awaits_session_interface(app):
+            raise ValueError('%r calls its session interface synchronously, '
+                             'use an asyncio framework such as Quart' % app)
+
+        for option in self.unsupported_options:
+            if app.config.get(option):
+                raise ValueError('%s is not supported by asynchronous '
+                                 'sessions' % option)
+
+        store = session_kvstore or self.default_kvstore
+        if getattr(store, 'hash_support', False):
+            raise ValueError('Stores with per-field operations are not '
+                             'supported by asynchronous sessions')
+
+        KVSessionExtension.init_app(self, app, session_kvstore)
+        app.session_interface = AsyncKVSessionInterface()
+        self.app = app
@@ -0,0 +1,150 @@
+"""
+Limits on the size of stored sessions.
+"""
+
+import logging
+from threading import Lock
+
+import six
+
+from .metrics import Histogram, SIZE_BUCKETS
+
+
+log = logging.getLogger(__name__)
+
+
+class SessionTooLarge(ValueError):
+    """Raised when a session exceeds the hard size limit.
+
+    :param size: The serialized size of the session.
+    :param limit: The hard limit.
+    :param largest: A list of ``(key, size)`` tuples of the largest keys.
+    """
+
+    def __init__(self, size, limit, largest):
+        super(SessionTooLarge, self).__init__(
+            'Session of %d bytes exceeds the limit of %d bytes, largest '
+            'keys: %s' % (size, limit, _describe(largest)))
+        self.size = size
+        self.limit = limit
+        self.largest = largest
+
+
+def _describe(largest):
+    return ', '.join('%s (%d bytes)' % item for item in largest)
+
+
+class SizeBudget(object):
+    """Checks the serialized size of sessions before they are written.
+
+    Sessions larger than ``soft_limit`` bytes are logged as a warning,
+    naming their largest keys. Sessions larger than ``hard_limit`` bytes
+    either raise :exc:`SessionTooLarge` (policy ``'raise'``) or have their
+    largest keys removed until they fit (policy ``'truncate'``). String keys
+    starting with an underscore, used by Flask and extensions for internal
+    state, are never removed.
+
+    The sizes of all written sessions are counted in :attr:`histogram`.
+
+    :param soft_limit: Size in bytes above which sessions are reported, or
+                       ``None``.
+    :param hard_limit: Maximum size in bytes, or ``None``.
+    :param policy: ``'raise'`` or ``'truncate'``.
+    :param top: Number of keys to name when reporting a session.
+    """
+
+    RAISE = 'raise'
+    TRUNCATE = 'truncate'
+
+    def __init__(self, soft_limit=None, hard_limit=None, policy=RAISE, top=5):
+        if policy not in (self.RAISE, self.TRUNCATE):
+            raise ValueError('Invalid size limit policy: %r' % policy)
+
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.policy = policy
+        self.top = top
+
+        #: A :class:`~flask_kvsession.metrics.Histogram` of session sizes.
+        self.histogram = Histogram(SIZE_BUCKETS)
+        #: Number of sessions exceeding the soft limit.
+        self.soft_exceeded = 0
+        #: Number of sessions exceeding the hard limit.
+        self.hard_exceeded = 0
+
+        self._lock = Lock()
+
+    def record(self, size):
+        """Count a written session of ``size`` bytes."""
+        with self._lock:
+            self.histogram.observe(size)
+
+    def check(self, session, size, key_sizes, metrics=None, report=True):
+        """Check a session about to be written.
+
+        :param session: The session, keys are removed from it when
+                        truncating.
+        :param size: The serialized size of the session.
+        :param key_sizes: A callable returning a dictionary of the
+                          serialized size of every key, only called if a
+                          limit is exceeded.
+        :param metrics: A collector (see :mod:`flask_kvsession.metrics`)
+                        receiving the events ``size_soft_limit`` and
+                        ``size_hard_limit``.
+        :param report: If ``False``, exceeded limits are neither logged nor
+                       counted, for checking a session again after
+                       truncating it.
+        :returns: A list of the removed keys.
+        :raises SessionTooLarge: If the session exceeds the hard limit and
+                                 cannot or may not be truncated.
+        """
+        soft = (report and self.soft_limit is not None and
+                size > self.soft_limit)
+        hard = self.hard_limit is not None and size > self.hard_limit
+
+        if not soft and not hard:
+            return []
+
+        sizes = key_sizes()
+        largest = sorted(sizes.items(), key=lambda item: item[1],
+                         reverse=True)
+
+        if soft:
+            with self._lock:
+                self.soft_exceeded += 1
+            if metrics is not None:
+                metrics.increment('size_soft_limit')
+            log.warning('Session of %d bytes exceeds the soft limit of %d '
+                        'bytes, largest keys: %s', size, self.soft_limit,
+                        _describe(largest[:self.top]))
+
+        if not hard:
+            return []
+
+        if report:
+            with self._lock:
+                self.hard_exceeded += 1
+            if metrics is not None:
+                metrics.increment('size_hard_limit')
+
+        if self.policy == self.RAISE:
+            raise SessionTooLarge(size, self.hard_limit, largest[:self.top])
+
+        removed = []
+        for key, key_size in largest:
+            if size <= self.hard_limit:
+                break
+            if isinstance(key, six.string_types) and key.startswith('_'):
+                continue
+
+            del session[key]
+            removed.append(key)
+            size -= key_size
+
+        if size > self.hard_limit:
+            raise SessionTooLarge(size, self.hard_limit, largest[:self.top])
+
+        log.warning('Removed keys %s from session exceeding the hard limit '
+                    'of %d bytes', ', '.join('%s' % key for key in removed),
+                    self.hard_limit)
+        return removed
@@ -0,0 +1,243 @@
+"""
+In-process caching of serialized session data.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+class SessionCache(object):
+    """A bounded, thread-safe LRU cache of serialized sessions.
+
+    Entries are keyed by the serialized session id (``sid_s``) and evicted
+    when they are the least recently used and either limit is exceeded, or
+    once they are older than ``ttl``. The cache is local to the process, other
+    workers writing the same session are only noticed after the entry expires.
+
+    Entries hold the payloads read from or written to the store, for stores
+    with per-field operations a dictionary of field payloads. Every hit is
+    deserialized anew, so a session changing a nested value in place (without
+    the change being saved) cannot alter the cached entry. Deserializing is
+    cheaper than copying the deserialized values.
+
+    :param max_entries: Maximum number of sessions to keep.
+    :param max_bytes: Maximum sum of the serialized sizes of all cached
+                      sessions. ``None`` means no limit.
+    :param ttl: Number of seconds an entry stays valid. ``None`` means entries
+                are only evicted by the size limits.
+    :param clock: A function returning the current time in seconds.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=None, ttl=None,
+                 clock=time.time):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, sid_s):
+        return sid_s in self._entries
+
+    def get(self, sid_s):
+        """Return the cached session data for ``sid_s`` or ``None`` if it is
+        not cached (or has expired)."""
+        entry = self.lookup(sid_s)
+        return entry[0] if entry is not None else None
+
+    def lookup(self, sid_s):
+        """Like :meth:`get`, but returns a tuple of the session data and the
+        digest passed to :meth:`put`."""
+        with self._lock:
+            entry = self._entries.pop(sid_s, None)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires, size, data, digest = entry
+            if expires is not None and expires <= self.clock():
+                self.size -= size
+                self.misses += 1
+                return None
+
+            # reinsert to mark as most recently used
+            self._entries[sid_s] = entry
+            self.hits += 1
+            return data, digest
+
+    def put(self, sid_s, data, size, digest=None):
+        """Cache session data.
+
+        :param sid_s: The serialized session id.
+        :param data: The serialized session, or a dictionary of serialized
+                     fields. Must not be changed afterwards.
+        :param size: Size of the serialized session in bytes, counted towards
+                     ``max_bytes``.
+        :param digest: The digest of the serialized session, returned along
+                       with the data by :meth:`lookup`.
+        """
+        if self.max_bytes is not None and size > self.max_bytes:
+            # would evict everything else and still not fit
+            self.invalidate(sid_s)
+            return
+
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+
+        with self._lock:
+            old = self._entries.pop(sid_s, None)
+            if old is not None:
+                self.size -= old[1]
+
+            self._entries[sid_s] = (expires, size, data, digest)
+            self.size += size
+
+            while (len(self._entries) > self.max_entries or
+                   (self.max_bytes is not None and
+                    self.size > self.max_bytes)):
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted[1]
+
+    def update_fields(self, sid_s, fields, deleted, size, digest=None):
+        """Merge changed fields into a cached dictionary of fields, if
+        ``sid_s`` is cached.
+
+        :param fields: A dictionary of changed fields.
+        :param deleted: A list of deleted fields.
+        :param size: The new size of the whole session.
+        :param digest: The new digest of the whole session.
+        """
+        with self._lock:
+            entry = self._entries.get(sid_s)
+            if entry is None:
+                return
+
+            expires, old_size, data, _ = entry
+            data = dict(data)
+            data.update(fields)
+            for key in deleted:
+                data.pop(key, None)
+
+            self._entries[sid_s] = (expires, size, data, digest)
+            self.size += size - old_size
+
+            while self.max_bytes is not None and self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted[1]
+
+    def invalidate(self, sid_s):
+        """Remove ``sid_s`` from the cache, if present."""
+        with self._lock:
+            entry = self._entries.pop(sid_s, None)
+            if entry is not None:
+                self.size -= entry[1]
+
+    def clear(self):
+        """Remove all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return a dictionary with the current hit and miss counters, as well
+        as the number of entries and bytes cached."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'bytes': self.size,
+        }
+
+
+class MissingCache(object):
+    """A bounded, thread-safe cache of session ids known not to exist.
+
+    Requests carrying the cookie of a deleted or expired session would read
+    from the store every time only to find nothing. Once a session id is
+    recorded here, it is reported missing without asking the store until the
+    entry is older than ``ttl`` or evicted, oldest first, to stay within
+    ``max_entries``. Entries must be invalidated whenever a session is written
+    under the id.
+
+    :param max_entries: Maximum number of session ids to keep.
+    :param ttl: Number of seconds an entry stays valid.
+    :param clock: A function returning the current time in seconds.
+    """
+
+    def __init__(self, max_entries=1024, ttl=10, clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, sid_s):
+        return sid_s in self._entries
+
+    def is_missing(self, sid_s):
+        """Return ``True`` if ``sid_s`` is known not to exist."""
+        with self._lock:
+            expires = self._entries.get(sid_s)
+
+            if expires is None:
+                self.misses += 1
+                return False
+
+            if expires <= self.clock():
+                del self._entries[sid_s]
+                self.misses += 1
+                return False
+
+            self.hits += 1
+            return True
+
+    def add(self, sid_s):
+        """Record that ``sid_s`` does not exist."""
+        expires = self.clock() + self.ttl
+
+        with self._lock:
+            self._entries.pop(sid_s, None)
+            self._entries[sid_s] = expires
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, sid_s):
+        """Remove ``sid_s`` from the cache, if present."""
+        with self._lock:
+            self._entries.pop(sid_s, None)
+
+    def clear(self):
+        """Remove all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return a dictionary with the current hit and miss counters, as well
+        as the number of entries cached."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+        }
@@ -0,0 +1,211 @@
+"""
+Removal of expired sessions from stores without time-to-live support.
+"""
+
+from collections import namedtuple
+from itertools import islice
+from threading import Lock, Thread
+from timeit import default_timer
+import time
+
+from simplekv.decorator import StoreDecorator
+from simplekv.memory import DictStore
+
+from .local import LocalStore
+from .replicated import ReplicatedStore
+from .sessionid import key_timestamp
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+
+CleanupResult = namedtuple('CleanupResult', 'scanned deleted elapsed')
+"""Summary of a cleanup run: number of keys ``scanned``, number of sessions
+``deleted`` and the ``elapsed`` time in seconds."""
+
+
+class RateLimiter(object):
+    """Limits the number of operations per second, shared among threads.
+
+    :param rate: Maximum operations per second.
+    """
+
+    def __init__(self, rate, clock=default_timer, sleep=time.sleep):
+        self.rate = float(rate)
+        self.clock = clock
+        self.sleep = sleep
+        self._next = clock()
+        self._lock = Lock()
+
+    def acquire(self, n=1):
+        """Block until ``n`` more operations are allowed."""
+        with self._lock:
+            now = self.clock()
+            start = max(self._next, now)
+            self._next = start + n / self.rate
+
+        if start > now:
+            self.sleep(start - now)
+
+
+def delete_many(store, keys):
+    """Delete several keys, using the store's ``delete_many`` method if it
+    has one."""
+    if hasattr(store, 'delete_many'):
+        store.delete_many(keys)
+    else:
+        for key in keys:
+            store.delete(key)
+
+
+def _is_dict_store(store):
+    # look through wrappers such as TieredStore or LocalStore
+    while True:
+        if isinstance(store, StoreDecorator):
+            store = store._dstore
+        elif isinstance(store, ReplicatedStore):
+            store = store.primary
+        elif isinstance(store, LocalStore):
+            store = store.store
+        else:
+            return isinstance(store, DictStore)
+
+
+def _batches(iterable, size):
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def cleanup_store(store, lifetime, key_regex, now=None, batch_size=1000,
+                  workers=1, rate_limit=None):
+    """Delete all sessions from ``store`` older than ``lifetime``.
+
+    Keys are consumed as a stream and examined in batches. The creation time
+    is read directly from the key, expired keys of a batch are deleted
+    together. Stores consisting of several shards (see
+    :class:`~flask_kvsession.sharded.ShardedStore`) have all shards cleaned up
+    in parallel.
+
+    :param store: The store to clean up.
+    :param lifetime: Maximum age of a session in seconds.
+    :param key_regex: Compiled regular expression matching session keys;
+                      other keys are left alone.
+    :param now: UNIX timestamp to check against, defaults to the current time.
+    :param batch_size: Number of keys examined (and at most deleted) at once.
+    :param workers: Number of threads processing batches.
+    :param rate_limit: Maximum number of deletions per second, ``None`` for
+                       no limit.
+    :returns: A :class:`CleanupResult`.
+    """
+    shards = getattr(store, 'shard_stores', None)
+    if shards is not None:
+        return _cleanup_shards(shards, lifetime, key_regex, now, batch_size,
+                               workers, rate_limit)
+
+    start = default_timer()
+    cutoff = int(now if now is not None else time.time()) - lifetime
+    limiter = RateLimiter(rate_limit) if rate_limit else None
+    match = key_regex.match
+
+    def process(batch):
+        expired = [key for key in batch
+                   if match(key) and key_timestamp(key) < cutoff]
+
+        if expired:
+            if limiter is not None:
+                limiter.acquire(len(expired))
+            delete_many(store, expired)
+        return len(expired)
+
+    if _is_dict_store(store):
+        # dictionaries cannot be iterated while deleting from them
+        keys = store.keys()
+    else:
+        keys = store.iter_keys()
+
+    batches = _batches(keys, batch_size)
+    scanned = 0
+    deleted = 0
+
+    if workers <= 1:
+        for batch in batches:
+            scanned += len(batch)
+            deleted += process(batch)
+    else:
+        # bounded, so keys are not read faster than they can be processed
+        queue = Queue(workers * 2)
+        results = []
+        errors = []
+
+        def work():
+            while True:
+                batch = queue.get()
+                if batch is None:
+                    return
+                try:
+                    results.append(process(batch))
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [Thread(target=work) for _ in range(workers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        try:
+            for batch in batches:
+                if errors:
+                    break
+                scanned += len(batch)
+                queue.put(batch)
+        finally:
+            for _ in threads:
+                queue.put(None)
+            for t in threads:
+                t.join()
+
+        if errors:
+            raise errors[0]
+        deleted = sum(results)
+
+    return CleanupResult(scanned, deleted, default_timer() - start)
+
+
+def _cleanup_shards(shards, lifetime, key_regex, now, batch_size, workers,
+                    rate_limit):
+    # every shard is cleaned up by its own thread, the rate limit is split
+    # evenly among them
+    start = default_timer()
+    now = now if now is not None else time.time()
+    if rate_limit:
+        rate_limit = float(rate_limit) / len(shards)
+
+    results = []
+    errors = []
+
+    def work(shard):
+        try:
+            results.append(cleanup_store(shard, lifetime, key_regex, now,
+                                         batch_size, workers, rate_limit))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [Thread(target=work, args=(shard,)) for shard in shards]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+
+    if errors:
+        raise errors[0]
+
+    return CleanupResult(sum(r.scanned for r in results),
+                         sum(r.deleted for r in results),
+                         default_timer() - start)
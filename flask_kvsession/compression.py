@@ -0,0 +1,242 @@
+"""
+Optional compression of stored session payloads.
+
+Compressed payloads are marked by setting one of the upper bits of the
+payload header (see :mod:`flask_kvsession.serializers`), which identifies the
+compressor used. Payloads without such a flag are returned unchanged by
+:func:`decompress_payload`, so compression can be enabled or disabled at any
+time.
+"""
+
+from threading import Lock
+from timeit import default_timer
+import zlib
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class Compressor(object):
+    """Base class for compressors.
+
+    Subclasses must set :attr:`name` and :attr:`flag` and implement
+    :meth:`compress` and :meth:`decompress`."""
+
+    #: The name used to select the compressor via ``SESSION_COMPRESSION``.
+    name = None
+
+    #: Bits or-ed into the payload header. Must be one of ``0x10``, ``0x20``,
+    #: ..., ``0x70``.
+    flag = None
+
+    def compress(self, data):
+        raise NotImplementedError
+
+    def decompress(self, data):
+        raise NotImplementedError
+
+
+class ZlibCompressor(Compressor):
+    """Uses :mod:`zlib`, which is always available.
+
+    :param level: Compression level, from 1 (fastest) to 9 (smallest)."""
+    name = 'zlib'
+    flag = 0x10
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class LZ4Compressor(Compressor):
+    """Uses `lz4 <https://pypi.org/project/lz4/>`_, if installed. Much faster
+    than zlib, at the cost of a lower compression ratio."""
+    name = 'lz4'
+    flag = 0x20
+
+    def compress(self, data):
+        return lz4_frame.compress(data)
+
+    def decompress(self, data):
+        return lz4_frame.decompress(data)
+
+
+class ZstdCompressor(Compressor):
+    """Uses `zstandard <https://pypi.org/project/zstandard/>`_, if installed.
+
+    :param level: Compression level, from 1 to 22."""
+    name = 'zstd'
+    flag = 0x30
+
+    def __init__(self, level=3):
+        self.level = level
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def decompress(self, data):
+        return zstandard.ZstdDecompressor().decompress(data)
+
+
+#: All known compressors, by name.
+compressors = {}
+
+_compressors_by_flag = {}
+
+
+def register_compressor(compressor):
+    """Make a compressor available by name and enable decompression of
+    payloads flagged with it.
+
+    :param compressor: A :class:`Compressor` instance.
+    """
+    if _compressors_by_flag.get(compressor.flag, compressor).name != \
+            compressor.name:
+        raise ValueError('Flag %#x already in use by compressor %r' % (
+            compressor.flag, _compressors_by_flag[compressor.flag].name))
+
+    compressors[compressor.name] = compressor
+    _compressors_by_flag[compressor.flag] = compressor
+
+
+def get_compressor(name_or_compressor):
+    """Look up a compressor by name.
+
+    :param name_or_compressor: Either the name of a registered compressor or a
+                               :class:`Compressor` instance, which is returned
+                               unchanged.
+    :raises ValueError: If no compressor with that name is available.
+    """
+    if isinstance(name_or_compressor, Compressor):
+        return name_or_compressor
+
+    try:
+        return compressors[name_or_compressor]
+    except KeyError:
+        raise ValueError('Unknown compressor %r, available are: %s' % (
+            name_or_compressor, ', '.join(sorted(compressors))))
+
+
+def _split_header(payload):
+    header = ord(payload[:1])
+    tag = header & 0x0f
+
+    # only payloads with a valid serializer tag can be flagged, anything else
+    # is a legacy payload
+    if not 0 < tag < 8:
+        return None, header
+    return _compressors_by_flag.get(header & 0xf0), tag
+
+
+def decompress_payload(payload):
+    """Return ``payload`` with compression undone, if it is flagged as
+    compressed, otherwise return it unchanged."""
+    compressor, tag = _split_header(payload)
+
+    if compressor is None:
+        return payload
+    return (bytes(bytearray([tag])) +
+            compressor.decompress(payload[1:]))
+
+
+class PayloadCompression(object):
+    """Compresses payloads above a size threshold and keeps statistics.
+
+    Payloads that do not shrink when compressed are stored uncompressed.
+
+    :param compressor: The :class:`Compressor` to use.
+    :param threshold: Payloads smaller than this many bytes are never
+                      compressed.
+    """
+
+    def __init__(self, compressor, threshold=1024):
+        self.compressor = compressor
+        self.threshold = threshold
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        """Reset all counters to zero."""
+        #: Number of payloads stored compressed.
+        self.compressed = 0
+        #: Number of payloads decompressed.
+        self.decompressed = 0
+        #: Total bytes saved by compression.
+        self.bytes_saved = 0
+        #: Total seconds spent compressing, including payloads that did not
+        #: shrink.
+        self.compress_time = 0.0
+        #: Total seconds spent decompressing.
+        self.decompress_time = 0.0
+
+    def compress(self, payload):
+        """Compress a payload created by
+        :func:`~flask_kvsession.serializers.dump_payload`, if it is larger than
+        the threshold."""
+        if len(payload) < self.threshold:
+            return payload
+
+        start = default_timer()
+        body = self.compressor.compress(payload[1:])
+        elapsed = default_timer() - start
+
+        saved = len(payload) - 1 - len(body)
+
+        with self._lock:
+            self.compress_time += elapsed
+            if saved > 0:
+                self.compressed += 1
+                self.bytes_saved += saved
+
+        if saved <= 0:
+            return payload
+        return (bytes(bytearray([ord(payload[:1]) | self.compressor.flag])) +
+                body)
+
+    def decompress(self, payload):
+        """Like :func:`decompress_payload`, but records timings."""
+        compressor, tag = _split_header(payload)
+
+        if compressor is None:
+            return payload
+
+        start = default_timer()
+        body = compressor.decompress(payload[1:])
+        elapsed = default_timer() - start
+
+        with self._lock:
+            self.decompressed += 1
+            self.decompress_time += elapsed
+
+        return bytes(bytearray([tag])) + body
+
+    def stats(self):
+        """Return a dictionary with the current counters."""
+        return {
+            'compressed': self.compressed,
+            'decompressed': self.decompressed,
+            'bytes_saved': self.bytes_saved,
+            'compress_time': self.compress_time,
+            'decompress_time': self.decompress_time,
+        }
+
+
+register_compressor(ZlibCompressor())
+
+if lz4_frame is not None:
+    register_compressor(LZ4Compressor())
+
+if zstandard is not None:
+    register_compressor(ZstdCompressor())
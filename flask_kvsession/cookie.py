@@ -0,0 +1,55 @@
+"""
+Sessions kept in the cookie instead of the store.
+
+With ``SESSION_COOKIE_THRESHOLD`` set, sessions whose serialized contents do
+not exceed the threshold are not written to the store at all. Their contents
+are put into the signed session cookie instead, in place of the session id.
+Once a session grows beyond the threshold, it is written to the store and the
+cookie carries its id again; sessions shrinking below the threshold move back
+into the cookie.
+
+A cookie value holding a session starts with :data:`COOKIE_MARKER`, followed
+by the hexadecimal creation timestamp of the session, a dot and the
+serialized contents encoded as URL-safe base64, e.g.
+``~5f5e1000.eyJsb2NhbGUiOiJkZSJ9``. Session ids never start with the marker.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+
+#: Prefix of cookie values carrying the session contents.
+COOKIE_MARKER = '~'
+
+
+def is_cookie_value(value):
+    """Return ``True`` if ``value`` holds the session contents rather than a
+    session id."""
+    return value.startswith(COOKIE_MARKER)
+
+
+def encode_cookie_value(data, created):
+    """Return the cookie value for the serialized session ``data``, created
+    at the UNIX timestamp ``created``."""
+    encoded = urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+    return '%s%x.%s' % (COOKIE_MARKER, created, encoded)
+
+
+def decode_cookie_value(value):
+    """Return the serialized session data and the creation timestamp of a
+    value created by :func:`encode_cookie_value`.
+
+    :raises ValueError: If ``value`` is malformed.
+    """
+    if not is_cookie_value(value):
+        raise ValueError('Not a cookie session: %r' % value)
+
+    created_s, _, encoded = value[len(COOKIE_MARKER):].partition('.')
+    encoded = encoded.encode('ascii')
+    data = urlsafe_b64decode(encoded + b'=' * (-len(encoded) % 4))
+    return data, int(created_s, 16)
+
+
+def cookie_timestamp(value):
+    """Return the creation timestamp of a value created by
+    :func:`encode_cookie_value`, without decoding the session data."""
+    return int(value[len(COOKIE_MARKER):].partition('.')[0], 16)
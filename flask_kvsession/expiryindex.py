@@ -0,0 +1,191 @@
+"""
+An index of sessions by creation time, kept in the session store itself.
+
+Session keys are grouped into buckets spanning a fixed number of seconds,
+listing the sessions created during that time. Expired sessions can then be
+found by reading old buckets instead of enumerating every session in the
+store.
+"""
+
+from timeit import default_timer
+import time
+
+from .cleanup import CleanupResult, delete_many, RateLimiter
+from .sessionid import KEY_REGEX, key_timestamp
+
+
+class ExpiryIndex(object):
+    """Maintains buckets of session keys in a store.
+
+    On stores supporting per-field operations (see
+    :mod:`flask_kvsession.hashstore`), each bucket is a single record and
+    sessions are added to and removed from it atomically. On other stores,
+    every session gets an empty marker key named after its bucket, so adding
+    a session is a single write regardless of the size of its bucket. The
+    markers of all expired buckets are found by listing the keys with the
+    index prefix once per cleanup. Markers of deleted sessions are left in
+    place until then.
+
+    :param bucket_size: Number of seconds covered by each bucket.
+    :param prefix: Prefix of the keys used for index records. Must not match
+                   :attr:`~flask_kvsession.KVSessionExtension.key_regex`.
+    :param key_regex: Compiled regular expression matching session keys,
+                      listed keys not matching it are never deleted.
+    """
+
+    def __init__(self, bucket_size=3600, prefix='kvsession_index_',
+                 key_regex=KEY_REGEX):
+        self.bucket_size = int(bucket_size)
+        self.prefix = prefix
+        self.key_regex = key_regex
+        self.head_key = prefix + 'head'
+
+        # last head seen by this process, saves reading it on every add
+        self._head = None
+
+    def bucket_of(self, sid_s):
+        """Return the bucket number of a session key."""
+        return key_timestamp(sid_s) // self.bucket_size
+
+    def bucket_key(self, bucket):
+        """Return the store key of a bucket."""
+        return '%s%x' % (self.prefix, bucket)
+
+    def _read_head(self, store):
+        try:
+            return int(store.get(self.head_key), 16)
+        except KeyError:
+            return None
+
+    def marker_prefix(self, bucket):
+        """Return the prefix of the marker keys of a bucket, on stores without
+        per-field operations."""
+        return '%s%x_' % (self.prefix, bucket)
+
+    def _read_bucket(self, store, bucket):
+        # returns the session keys listed in a bucket
+        if getattr(store, 'hash_support', False):
+            try:
+                return list(store.get_fields(self.bucket_key(bucket)))
+            except KeyError:
+                return []
+
+        prefix = self.marker_prefix(bucket)
+        return [key[len(prefix):] for key in store.iter_keys(prefix)]
+
+    def _read_markers(self, store, head, end):
+        # returns the buckets from head to end with the session keys listed
+        # in them, from a single listing of the index. many stores scan all
+        # of their keys to list a prefix, doing so per bucket is too slow
+        buckets = {}
+        for key in store.iter_keys(self.prefix):
+            bucket_s, sep, sid_s = key[len(self.prefix):].partition('_')
+            if not sep:
+                # the head
+                continue
+
+            try:
+                bucket = int(bucket_s, 16)
+            except ValueError:
+                continue
+            if head <= bucket < end:
+                buckets.setdefault(bucket, []).append(sid_s)
+        return sorted(buckets.items())
+
+    def add(self, store, sid_s):
+        """Add a newly created session to its bucket."""
+        bucket = self.bucket_of(sid_s)
+
+        if getattr(store, 'hash_support', False):
+            store.update_fields(self.bucket_key(bucket), {sid_s: b''})
+        else:
+            store.put(self.marker_prefix(bucket) + sid_s, b'')
+
+        # the head points to the oldest bucket that may be in use
+        if self._head is not None and bucket >= self._head:
+            return
+
+        head = self._read_head(store)
+        if head is None or bucket < head:
+            store.put(self.head_key, ('%x' % bucket).encode('ascii'))
+            head = bucket
+        self._head = head
+
+    def remove(self, store, sid_s):
+        """Remove a deleted session from its bucket.
+
+        Only done on stores supporting per-field operations. Elsewhere, the
+        marker stays until the bucket expires, deleting the session again then
+        is harmless."""
+        if getattr(store, 'hash_support', False):
+            store.update_fields(self.bucket_key(self.bucket_of(sid_s)), {},
+                                [sid_s])
+
+    def expire(self, store, lifetime, now=None, batch_size=1000,
+               rate_limit=None):
+        """Delete all sessions in buckets that have expired completely.
+
+        Sessions are removed up to ``bucket_size`` seconds after they expire,
+        as a bucket is only dropped once its youngest possible session has
+        expired.
+
+        :param store: The store holding sessions and index.
+        :param lifetime: Maximum age of a session in seconds.
+        :param now: UNIX timestamp to check against, defaults to the current
+                    time.
+        :param batch_size: Maximum number of sessions deleted at once.
+        :param rate_limit: Maximum number of deletions per second, ``None``
+                           for no limit.
+        :returns: A :class:`~flask_kvsession.cleanup.CleanupResult`, counting
+                  the sessions listed in the visited buckets as scanned and
+                  those still present in the store as deleted.
+        """
+        start = default_timer()
+        cutoff = int(now if now is not None else time.time()) - lifetime
+        limiter = RateLimiter(rate_limit) if rate_limit else None
+
+        head = self._read_head(store)
+        # buckets before this one only contain expired sessions
+        end = int(cutoff // self.bucket_size)
+
+        scanned = 0
+        deleted = 0
+
+        if head is not None and head < end:
+            hash_support = getattr(store, 'hash_support', False)
+
+            if hash_support:
+                buckets = ((bucket, self._read_bucket(store, bucket))
+                           for bucket in range(head, end))
+            else:
+                buckets = self._read_markers(store, head, end)
+
+            for bucket, sids in buckets:
+                if not sids:
+                    continue
+
+                scanned += len(sids)
+                for i in range(0, len(sids), batch_size):
+                    batch = sids[i:i + batch_size]
+
+                    # destroyed sessions may still be listed
+                    existing = [sid_s for sid_s in batch
+                                if self.key_regex.match(sid_s) and
+                                sid_s in store]
+                    if existing:
+                        if limiter is not None:
+                            limiter.acquire(len(existing))
+                        delete_many(store, existing)
+                        deleted += len(existing)
+
+                    if not hash_support:
+                        prefix = self.marker_prefix(bucket)
+                        delete_many(store, [prefix + sid_s
+                                            for sid_s in batch])
+
+                if hash_support:
+                    store.delete(self.bucket_key(bucket))
+
+            store.put(self.head_key, ('%x' % end).encode('ascii'))
+
+        return CleanupResult(scanned, deleted, default_timer() - start)
@@ -0,0 +1,160 @@
+"""
+Stores that can save sessions as individual fields.
+
+A store signals support by setting ``hash_support`` to ``True`` (similar to
+``ttl_support`` on :class:`~simplekv.TimeToLiveMixin`) and implementing
+:meth:`~HashStoreMixin.get_fields`, :meth:`~HashStoreMixin.put_fields` and
+:meth:`~HashStoreMixin.update_fields`. Flask-KVSession stores each session key
+as a separate field in such stores and only writes the fields that changed
+during a request.
+"""
+
+from simplekv.memory import DictStore
+from simplekv.memory.redisstore import RedisStore
+
+from .redisstore import batch_delete, batch_put, expire, touch
+
+
+class HashStoreMixin(object):
+    """Interface for stores supporting per-field operations.
+
+    Field names are strings, field values are bytes. A key without any
+    fields does not exist."""
+
+    hash_support = True
+    """Indicates that the store supports per-field operations. Test for
+    support using::
+
+      getattr(store, 'hash_support', False)
+    """
+
+    def get_fields(self, key):
+        """Return all fields of ``key`` as a dictionary.
+
+        :raises KeyError: If the key does not exist.
+        """
+        self._check_valid_key(key)
+        return self._get_fields(key)
+
+    def put_fields(self, key, fields, ttl_secs=None):
+        """Replace all fields of ``key``.
+
+        :param fields: A dictionary of field names to values.
+        :param ttl_secs: Time-to-live of the key, only used if the store
+                         supports it.
+        """
+        self._check_valid_key(key)
+        return self._put_fields(key, fields, ttl_secs)
+
+    def update_fields(self, key, fields, deleted=(), ttl_secs=None):
+        """Set and remove individual fields of ``key``, leaving all others
+        untouched. The key is created if it does not exist.
+
+        :param fields: A dictionary of field names to values to set.
+        :param deleted: An iterable of field names to remove.
+        :param ttl_secs: Time-to-live of the key, only used if the store
+                         supports it.
+        """
+        self._check_valid_key(key)
+        return self._update_fields(key, fields, deleted, ttl_secs)
+
+    def _get_fields(self, key):
+        raise NotImplementedError
+
+    def _put_fields(self, key, fields, ttl_secs):
+        raise NotImplementedError
+
+    def _update_fields(self, key, fields, deleted, ttl_secs):
+        raise NotImplementedError
+
+
+class DictHashStore(HashStoreMixin, DictStore):
+    """An in-memory hash store, mainly useful for testing.
+
+    Regular values and hashes share the same dictionary ``d``, hashes are
+    stored as dictionaries."""
+
+    def _get_fields(self, key):
+        return dict(self.d[key])
+
+    def _put_fields(self, key, fields, ttl_secs):
+        if fields:
+            self.d[key] = dict(fields)
+        else:
+            self.d.pop(key, None)
+
+    def _update_fields(self, key, fields, deleted, ttl_secs):
+        h = dict(self.d.get(key, {}))
+        h.update(fields)
+
+        for field in deleted:
+            h.pop(field, None)
+
+        self._put_fields(key, h, ttl_secs)
+
+
+class RedisHashStore(HashStoreMixin, RedisStore):
+    """Stores sessions as redis hashes.
+
+    :param redis: An instance of :py:class:`redis.StrictRedis`.
+    """
+
+    def delete_many(self, keys):
+        """Delete several keys at once."""
+        for key in keys:
+            self._check_valid_key(key)
+        if keys:
+            self.redis.delete(*keys)
+
+    def touch(self, key, ttl_secs):
+        """Set the time-to-live of ``key`` without modifying it."""
+        touch(self, key, ttl_secs)
+
+    def _get_fields(self, key):
+        fields = self.redis.hgetall(key)
+
+        if not fields:
+            raise KeyError(key)
+        return dict((k.decode('utf8'), v) for k, v in fields.items())
+
+    def _put_fields(self, key, fields, ttl_secs):
+        pipe = self.redis.pipeline()
+        self._batch_put_fields(pipe, key, fields, ttl_secs)
+        pipe.execute()
+
+    def _update_fields(self, key, fields, deleted, ttl_secs):
+        pipe = self.redis.pipeline()
+        self._batch_update_fields(pipe, key, fields, deleted, ttl_secs)
+        pipe.execute()
+
+    def execute_batch(self, operations):
+        """Execute a list of :class:`~flask_kvsession.pipeline.Operation` in
+        a single round trip."""
+        pipe = self.redis.pipeline()
+        for method, args in operations:
+            getattr(self, '_batch_' + method)(pipe, *args)
+        pipe.execute()
+
+    def _batch_put(self, pipe, key, data, ttl_secs=None):
+        batch_put(self, pipe, key, data, ttl_secs)
+
+    def _batch_delete(self, pipe, key):
+        batch_delete(self, pipe, key)
+
+    def _batch_put_fields(self, pipe, key, fields, ttl_secs=None):
+        self._check_valid_key(key)
+        pipe.delete(key)
+
+        if fields:
+            pipe.hset(key, mapping=fields)
+            expire(self, pipe, key, ttl_secs)
+
+    def _batch_update_fields(self, pipe, key, fields, deleted=(),
+                             ttl_secs=None):
+        self._check_valid_key(key)
+
+        if fields:
+            pipe.hset(key, mapping=fields)
+        if deleted:
+            pipe.hdel(key, *deleted)
+        expire(self, pipe, key, ttl_secs)
@@ -0,0 +1,93 @@
+"""
+Sources of random session ids.
+
+New session ids are drawn from ``SESSION_RANDOM_SOURCE``, which can be any
+object with a ``getrandbits(k)`` method returning a random non-negative
+integer of ``k`` bits, such as :class:`random.SystemRandom`. The source must
+be safe to use from several threads, and must be unpredictable, as anyone
+guessing a session id can take over the session.
+
+:class:`random.SystemRandom` reads from the operating system for every id.
+:class:`BufferedSystemRandom`, the default, reads larger blocks at once.
+"""
+
+import binascii
+import os
+import weakref
+
+try:
+    _from_bytes = int.from_bytes
+except AttributeError:
+    def _to_int(data):
+        return int(binascii.hexlify(data), 16)
+else:
+    def _to_int(data):
+        return _from_bytes(data, 'big')
+
+
+# sources to reset in a forked child
+_sources = weakref.WeakSet()
+
+
+def _after_fork():
+    for source in list(_sources):
+        source._reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+    _check_pid = False
+else:
+    _check_pid = True
+
+
+class BufferedSystemRandom(object):
+    """Random numbers generated from blocks of :func:`os.urandom` bytes.
+
+    About ``buffer_size`` random bytes are read at once and turned into a
+    pool of numbers of the requested size, so the operating system is asked
+    for randomness once every few hundred ids instead of for every id.
+    Every number is handed out once.
+
+    Numbers are taken from the pool without locking, as removing an item
+    from a list is atomic. A process created by forking discards the pools
+    it inherited, parent and child would hand out the same numbers
+    otherwise.
+
+    :param buffer_size: Number of random bytes read at once.
+    """
+
+    def __init__(self, buffer_size=4096):
+        self.buffer_size = buffer_size
+        self._reset()
+        _sources.add(self)
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._pools = {}
+
+    def _refill(self, k):
+        if k <= 0:
+            raise ValueError('Number of bits must be greater than zero')
+
+        n = (k + 7) // 8
+        shift = n * 8 - k
+        size = n * max(1, self.buffer_size // n)
+        data = os.urandom(size)
+
+        # concurrent refills each create a pool, numbers of a replaced one
+        # are never used
+        pool = [_to_int(data[i:i + n]) >> shift for i in range(0, size, n)]
+        value = pool.pop()
+        self._pools[k] = pool
+        return value
+
+    def getrandbits(self, k):
+        """Return a random integer of ``k`` bits."""
+        if _check_pid and self._pid != os.getpid():
+            self._reset()
+
+        try:
+            return self._pools[k].pop()
+        except (KeyError, IndexError):
+            return self._refill(k)
@@ -0,0 +1,128 @@
+"""
+Stores created lazily per process and, optionally, per thread.
+"""
+
+import os
+from threading import current_thread, enumerate as threads, local, Lock
+
+
+def close_store(store):
+    """Close ``store`` if it has a ``close`` method."""
+    close = getattr(store, 'close', None)
+    if close is not None:
+        close()
+
+
+class LocalStore(object):
+    """A store proxy creating the actual stores on demand.
+
+    Connections and connection pools usually must not be shared between
+    processes, and may be contended when shared between many threads. A
+    ``LocalStore`` calls ``factory`` to create a store the first time it is
+    used in a process. After a fork, stores inherited from the parent are
+    abandoned (not closed, as the parent still uses them) and new ones are
+    created in the child.
+
+    With ``per_thread`` enabled, every thread gets its own store. Stores of
+    threads that have ended are kept in a pool and handed to new threads.
+
+    All other attributes are looked up on the current store, so a
+    ``LocalStore`` can be used in place of any store.
+
+    :param factory: A callable returning a new store.
+    :param per_thread: Whether to create a store per thread instead of per
+                       process.
+    :param closer: A callable closing a store, called by :meth:`close`.
+                   Defaults to :func:`close_store`.
+    """
+
+    def __init__(self, factory, per_thread=False, closer=close_store):
+        self.factory = factory
+        self.per_thread = per_thread
+        self.closer = closer
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # a lock inherited while held by another thread would never be
+        # released, so everything is created anew
+        self._lock = Lock()
+        self._local = local()
+        self._shared = None
+        self._owners = {}
+        self._pool = []
+
+        #: All stores created in this process.
+        self.stores = []
+
+    def _create(self):
+        store = self.factory()
+        self.stores.append(store)
+        return store
+
+    def _checkout(self):
+        ident = current_thread().ident
+
+        with self._lock:
+            store = self._owners.get(ident)
+            if store is not None:
+                # thread identifiers are reused after a thread has ended
+                return store
+
+            alive = set(t.ident for t in threads())
+            for owner in list(self._owners):
+                if owner not in alive:
+                    self._pool.append(self._owners.pop(owner))
+
+            store = self._pool.pop() if self._pool else self._create()
+            self._owners[ident] = store
+            return store
+
+    @property
+    def store(self):
+        """The store to be used by the current process or thread."""
+        if self._pid != os.getpid():
+            self._reset()
+
+        if self.per_thread:
+            store = getattr(self._local, 'store', None)
+            if store is None:
+                store = self._local.store = self._checkout()
+            return store
+
+        store = self._shared
+        if store is None:
+            with self._lock:
+                if self._shared is None:
+                    self._shared = self._create()
+                store = self._shared
+        return store
+
+    def close(self):
+        """Close all stores created by this process. New stores are created
+        if the proxy is used again."""
+        if self._pid != os.getpid():
+            return
+
+        with self._lock:
+            stores = self.stores
+            self._shared = None
+            self._local = local()
+            self._owners = {}
+            self._pool = []
+            self.stores = []
+
+        for store in stores:
+            self.closer(store)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            # not initialized yet, or private to the store
+            raise AttributeError(name)
+        return getattr(self.store, name)
+
+    def __contains__(self, key):
+        return key in self.store
+
+    def __iter__(self):
+        return iter(self.store)
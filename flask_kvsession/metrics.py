@@ -0,0 +1,166 @@
+"""
+Collection of timings and sizes of session operations.
+
+Setting ``SESSION_METRICS`` to a collector makes
+:class:`~flask_kvsession.KVSessionInterface` report every phase of loading and
+saving a session to it. A collector is any object with two methods:
+
+``observe(phase, seconds, size=None)``
+    Called after each phase with its duration and, where applicable, the
+    number of bytes handled. Phases are ``signature`` (verifying the cookie),
+    ``get``, ``deserialize``, ``serialize``, ``put``, ``delete`` and
+    ``set_cookie``.
+
+``increment(event)``
+    Called for events without a duration: ``cache_hit``,
+    ``missing_cache_hit``, ``not_found``, ``bad_signature``,
+    ``write_skipped``, ``size_soft_limit`` and ``size_hard_limit``.
+
+:class:`MetricsCollector` keeps counters and histograms in memory.
+"""
+
+from bisect import bisect_left
+from threading import Lock
+
+
+#: Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+#: Upper bounds of the size histogram buckets, in bytes.
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Histogram(object):
+    """Counts observations in buckets with fixed upper bounds.
+
+    :param buckets: Sorted upper bounds of the buckets. A last bucket without
+                    upper bound is added implicitly.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Return a list of ``(upper bound, count)`` tuples, counting all
+        observations less than or equal to the bound. The last bound is
+        ``float('inf')``."""
+        result = []
+        total = 0
+        for bound, n in zip(self.buckets + (float('inf'),), self.counts):
+            total += n
+            result.append((bound, total))
+        return result
+
+
+class MetricsCollector(object):
+    """Keeps a latency histogram and a size histogram per phase, and event
+    counters, all of which can be exported in the Prometheus text format.
+
+    :param prefix: Prefix of the exported metric names.
+    :param latency_buckets: Upper bounds of the latency buckets, in seconds.
+    :param size_buckets: Upper bounds of the size buckets, in bytes.
+    """
+
+    def __init__(self, prefix='kvsession', latency_buckets=LATENCY_BUCKETS,
+                 size_buckets=SIZE_BUCKETS):
+        self.prefix = prefix
+        self.latency_buckets = latency_buckets
+        self.size_buckets = size_buckets
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        """Discard all collected data."""
+        with self._lock:
+            self.latencies = {}
+            self.sizes = {}
+            self.events = {}
+
+    def observe(self, phase, seconds, size=None):
+        with self._lock:
+            h = self.latencies.get(phase)
+            if h is None:
+                h = self.latencies[phase] = Histogram(self.latency_buckets)
+            h.observe(seconds)
+
+            if size is not None:
+                h = self.sizes.get(phase)
+                if h is None:
+                    h = self.sizes[phase] = Histogram(self.size_buckets)
+                h.observe(size)
+
+    def increment(self, event):
+        with self._lock:
+            self.events[event] = self.events.get(event, 0) + 1
+
+    def stats(self):
+        """Return a dictionary of phases to their number of observations,
+        total and mean duration, and of events to their counts."""
+        with self._lock:
+            phases = {}
+            for phase, h in self.latencies.items():
+                phases[phase] = {
+                    'count': h.count,
+                    'seconds': h.sum,
+                    'mean': h.sum / h.count if h.count else 0.0,
+                }
+            return {'phases': phases, 'events': dict(self.events)}
+
+    def _histogram(self, lines, name, help, histograms):
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s histogram' % name)
+
+        for phase in sorted(histograms):
+            h = histograms[phase]
+            for bound, n in h.cumulative():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('%s_bucket{phase="%s",le="%s"} %d' % (
+                    name, phase, le, n))
+            lines.append('%s_sum{phase="%s"} %r' % (name, phase, h.sum))
+            lines.append('%s_count{phase="%s"} %d' % (name, phase, h.count))
+
+    def prometheus(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+
+        with self._lock:
+            self._histogram(lines, '%s_phase_seconds' % self.prefix,
+                            'Duration of session phases.', self.latencies)
+            self._histogram(lines, '%s_phase_bytes' % self.prefix,
+                            'Bytes handled by session phases.', self.sizes)
+
+            name = '%s_events_total' % self.prefix
+            lines.append('# HELP %s Session events.' % name)
+            lines.append('# TYPE %s counter' % name)
+            for event in sorted(self.events):
+                lines.append('%s{event="%s"} %d' % (name, event,
+                                                    self.events[event]))
+
+        return '\n'.join(lines) + '\n'
+
+
+class MultiCollector(object):
+    """Passes everything on to several collectors.
+
+    :param collectors: A list of collectors.
+    """
+
+    def __init__(self, collectors):
+        self.collectors = list(collectors)
+
+    def observe(self, phase, seconds, size=None):
+        for collector in self.collectors:
+            collector.observe(phase, seconds, size)
+
+    def increment(self, event):
+        for collector in self.collectors:
+            collector.increment(event)
@@ -0,0 +1,40 @@
+"""
+Store operations executed together.
+
+With ``SESSION_PIPELINE`` enabled, sessions removed by
+:meth:`~flask_kvsession.KVSession.destroy` and
+:meth:`~flask_kvsession.KVSession.regenerate` are not deleted right away. The
+deletions are collected during the request and executed along with writing
+the session when it is saved, so a login regenerating the session id costs a
+single round trip to the backend.
+
+A store executes a batch of operations together by implementing
+``execute_batch(operations)``, which must execute a list of
+:class:`Operation` in order, for example in a single round trip.
+:class:`~flask_kvsession.hashstore.RedisHashStore` does, and batches for a
+:class:`~simplekv.memory.redisstore.RedisStore` are sent through a redis
+pipeline (see :mod:`flask_kvsession.redisstore`). Other stores have the
+operations executed one after the other.
+"""
+
+from collections import namedtuple
+
+from .redisstore import execute_batch as execute_redis_batch, redis_store
+
+
+Operation = namedtuple('Operation', 'method args')
+"""A call of the store method named ``method`` (such as ``put`` or
+``delete``) with the positional arguments ``args``."""
+
+
+def execute(store, operations):
+    """Execute ``operations`` on ``store`` in order, as a single batch if the
+    store supports it."""
+    redis = redis_store(store)
+    if hasattr(store, 'execute_batch'):
+        store.execute_batch(operations)
+    elif redis is not None:
+        execute_redis_batch(redis, operations)
+    else:
+        for method, args in operations:
+            getattr(store, method)(*args)
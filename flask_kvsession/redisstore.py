@@ -0,0 +1,96 @@
+"""
+Support for :class:`simplekv.memory.redisstore.RedisStore`.
+
+simplekv's store has no way to extend the time-to-live of a key without
+rewriting it, nor to execute several operations at once. Flask-KVSession uses
+the redis client of the store directly instead, so sliding expiration (see
+``SESSION_SLIDING_EXPIRATION``) costs a single ``PEXPIRE`` and pipelined
+deletions (see ``SESSION_PIPELINE``) are sent along with the write in a single
+round trip.
+"""
+
+from simplekv import FOREVER, NOT_SET
+from simplekv.decorator import StoreDecorator
+from simplekv.memory.redisstore import RedisStore
+
+from .local import LocalStore
+
+
+def redis_store(store):
+    """Return the :class:`~simplekv.memory.redisstore.RedisStore` (or
+    subclass) behind ``store`` or ``None``.
+
+    :class:`~flask_kvsession.local.LocalStore` proxies, the primary of a
+    :class:`~flask_kvsession.replicated.ReplicatedStore` and decorators are
+    looked through. Decorators implementing writes themselves, such as
+    :class:`~flask_kvsession.tiered.TieredStore` or key transforming
+    decorators, are not, as using the redis client would bypass them.
+    """
+    # imported here, the replicated module uses this one
+    from .replicated import ReplicatedStore
+
+    while True:
+        if isinstance(store, LocalStore):
+            store = store.store
+        elif isinstance(store, ReplicatedStore):
+            store = store.primary
+        elif (isinstance(store, StoreDecorator) and
+              not hasattr(type(store), 'put')):
+            store = store._dstore
+        elif isinstance(store, RedisStore):
+            return store
+        else:
+            return None
+
+
+def is_redis_store(store):
+    """Return ``True`` if ``store`` is a
+    :class:`~simplekv.memory.redisstore.RedisStore` (or a subclass), or a
+    proxy of one (see :func:`redis_store`)."""
+    return redis_store(store) is not None
+
+
+def expire(store, redis, key, ttl_secs):
+    """Set the time-to-live of ``key`` through ``redis``, a client or
+    pipeline, validating ``ttl_secs`` like ``store`` does."""
+    ttl_secs = store._valid_ttl(ttl_secs)
+
+    if ttl_secs not in (NOT_SET, FOREVER):
+        redis.pexpire(key, int(ttl_secs * 1000))
+
+
+def batch_put(store, pipe, key, data, ttl_secs=None):
+    """Queue writing ``data`` to ``key`` on the redis pipeline ``pipe``."""
+    store._check_valid_key(key)
+    ttl_secs = store._valid_ttl(ttl_secs)
+
+    if ttl_secs in (NOT_SET, FOREVER):
+        pipe.set(key, data)
+    else:
+        pipe.psetex(key, int(ttl_secs * 1000), data)
+
+
+def batch_delete(store, pipe, key):
+    """Queue deleting ``key`` on the redis pipeline ``pipe``."""
+    store._check_valid_key(key)
+    pipe.delete(key)
+
+
+_BATCH = {'put': batch_put, 'delete': batch_delete}
+
+
+def execute_batch(store, operations):
+    """Execute a list of :class:`~flask_kvsession.pipeline.Operation`
+    (``put`` or ``delete``) on the redis store ``store`` in a single round
+    trip."""
+    pipe = store.redis.pipeline()
+    for method, args in operations:
+        _BATCH[method](store, pipe, *args)
+    pipe.execute()
+
+
+def touch(store, key, ttl_secs):
+    """Set the time-to-live of ``key`` in the redis store ``store`` without
+    modifying it."""
+    store._check_valid_key(key)
+    expire(store, store.redis, key, ttl_secs)
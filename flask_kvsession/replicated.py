@@ -0,0 +1,181 @@
+"""
+Reading sessions from replicas of a primary store.
+"""
+
+from io import BytesIO
+from itertools import count
+from timeit import default_timer
+import time
+
+from .redisstore import redis_store, touch as redis_touch
+
+
+class ReplicatedStore(object):
+    """Sends writes to a primary store and reads to its replicas.
+
+    Replication is left to the backend, the replicas are expected to follow
+    the primary with some lag. To let a client see its own changes,
+    :class:`~flask_kvsession.KVSessionInterface` records the time a session
+    was written in its cookie. For ``marker_ttl`` seconds after that, any
+    process reads the session from the primary (see :meth:`reader`). A key
+    missing on a replica is looked up on the primary as well. A replica
+    raising an :exc:`IOError` is skipped in favour of the primary.
+
+    Deletions, key listings and thus cleanup go to the primary. The store
+    supports time-to-live and per-field operations (see
+    :mod:`flask_kvsession.hashstore`) if the primary does.
+
+    :param primary: The store receiving all writes.
+    :param replicas: A list of stores replicating ``primary``.
+    :param selection: ``'round-robin'`` to spread reads evenly, or
+                      ``'least-latency'`` to prefer the replica that
+                      answered fastest recently. The latter still sends every
+                      ``probe_interval``-th read round-robin, to keep the
+                      latency of all replicas up to date.
+    :param marker_ttl: Seconds after a write during which the key is read
+                       from the primary.
+    :param probe_interval: See ``selection``.
+    :param clock: A function returning the current time in seconds.
+    """
+
+    ROUND_ROBIN = 'round-robin'
+    LEAST_LATENCY = 'least-latency'
+
+    #: Weight of the latest measurement in the moving latency average.
+    latency_decay = 0.2
+
+    def __init__(self, primary, replicas, selection=ROUND_ROBIN,
+                 marker_ttl=5, probe_interval=16, clock=time.time):
+        if selection not in (self.ROUND_ROBIN, self.LEAST_LATENCY):
+            raise ValueError('Invalid replica selection: %r' % selection)
+        if not replicas:
+            raise ValueError('At least one replica is required')
+
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.selection = selection
+        self.marker_ttl = marker_ttl
+        self.probe_interval = probe_interval
+        self.clock = clock
+
+        #: Moving average of read latencies per replica, in seconds.
+        self.latencies = [0.0] * len(self.replicas)
+        #: Number of reads per replica.
+        self.replica_reads = [0] * len(self.replicas)
+        #: Number of reads sent to the primary.
+        self.primary_reads = 0
+
+        self._counter = count()
+
+    def reader(self, written):
+        """Return the store to read a key from that was last written at the
+        UNIX timestamp ``written``: the primary if that was less than
+        ``marker_ttl`` seconds ago, this store otherwise."""
+        if written is not None and self.clock() - written < self.marker_ttl:
+            self.primary_reads += 1
+            return self.primary
+        return self
+
+    def _select(self):
+        n = next(self._counter)
+
+        if (self.selection == self.LEAST_LATENCY and
+                n % self.probe_interval):
+            latencies = self.latencies
+            return latencies.index(min(latencies))
+        return n % len(self.replicas)
+
+    def _read(self, method, key):
+        i = self._select()
+        start = default_timer()
+
+        try:
+            value = getattr(self.replicas[i], method)(key)
+        except (KeyError, IOError):
+            # not replicated yet or replica unavailable
+            pass
+        else:
+            elapsed = default_timer() - start
+            self.replica_reads[i] += 1
+            self.latencies[i] += (elapsed -
+                                  self.latencies[i]) * self.latency_decay
+            return value
+
+        self.primary_reads += 1
+        return getattr(self.primary, method)(key)
+
+    @property
+    def ttl_support(self):
+        return getattr(self.primary, 'ttl_support', False)
+
+    @property
+    def hash_support(self):
+        return getattr(self.primary, 'hash_support', False)
+
+    def get(self, key):
+        return self._read('get', key)
+
+    def get_file(self, key, file):
+        file.write(self.get(key))
+
+    def open(self, key):
+        return BytesIO(self.get(key))
+
+    def get_fields(self, key):
+        return self._read('get_fields', key)
+
+    def put(self, key, data, ttl_secs=None):
+        if ttl_secs is None:
+            return self.primary.put(key, data)
+        return self.primary.put(key, data, ttl_secs)
+
+    def put_file(self, key, file, ttl_secs=None):
+        return self.put(key, file.read(), ttl_secs)
+
+    def put_fields(self, key, fields, ttl_secs=None):
+        return self.primary.put_fields(key, fields, ttl_secs)
+
+    def update_fields(self, key, fields, deleted=(), ttl_secs=None):
+        return self.primary.update_fields(key, fields, deleted, ttl_secs)
+
+    def touch(self, key, ttl_secs):
+        """Set the time-to-live of ``key`` on the primary, rewriting it if
+        the primary has no ``touch`` method and is not a redis store."""
+        redis = redis_store(self.primary)
+        if hasattr(self.primary, 'touch'):
+            self.primary.touch(key, ttl_secs)
+        elif redis is not None:
+            redis_touch(redis, key, ttl_secs)
+        else:
+            self.put(key, self.primary.get(key), ttl_secs)
+
+    def delete(self, key):
+        return self.primary.delete(key)
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        if hasattr(self.primary, 'delete_many'):
+            self.primary.delete_many(keys)
+        else:
+            for key in keys:
+                self.primary.delete(key)
+
+    def __contains__(self, key):
+        return key in self.primary
+
+    def iter_keys(self, prefix=u''):
+        return self.primary.iter_keys(prefix)
+
+    def __iter__(self):
+        return self.iter_keys()
+
+    def keys(self, prefix=u''):
+        return list(self.iter_keys(prefix))
+
+    def stats(self):
+        """Return a dictionary with read counts and latencies."""
+        return {
+            'primary_reads': self.primary_reads,
+            'replica_reads': list(self.replica_reads),
+            'latencies': list(self.latencies),
+        }
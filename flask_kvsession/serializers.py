@@ -0,0 +1,287 @@
+"""
+Serializers turn session dictionaries into bytes for storage and back.
+
+Every payload written by Flask-KVSession starts with a single byte identifying
+the serializer that produced it. This allows a store to contain sessions
+written with different serializers, e.g. while migrating from one to another.
+Payloads without a known header (written by older versions) are passed to a
+fallback, usually :mod:`pickle`.
+
+Versions before 0.7 cannot read payloads with a header. Unless a serializer is
+chosen, sessions are therefore written by :class:`LegacySerializer`, without a
+header.
+"""
+
+from base64 import b64decode, b64encode
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from datetime import datetime
+import json
+
+import six
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Serializer(object):
+    """Base class for serializers.
+
+    Subclasses must set :attr:`name` and :attr:`tag` and implement
+    :meth:`dumps` and :meth:`loads`."""
+
+    #: The name used to select the serializer via ``SESSION_SERIALIZER``.
+    name = None
+
+    #: A single byte prefixed to every payload. Must be between ``b'\x01'``
+    #: and ``b'\x07'``, other values may be mistaken for legacy payloads.
+    tag = None
+
+    def dumps(self, value):
+        """Serialize ``value`` to bytes (without the header)."""
+        raise NotImplementedError
+
+    def loads(self, data):
+        """Deserialize bytes created by :meth:`dumps`."""
+        raise NotImplementedError
+
+
+class PickleSerializer(Serializer):
+    """Uses :mod:`pickle` with the highest protocol available.
+
+    Supports almost any Python object, but payloads are tied to Python and
+    must never be loaded from untrusted sources."""
+    name = 'pickle'
+    tag = b'\x01'
+
+    def __init__(self, protocol=pickle.HIGHEST_PROTOCOL):
+        self.protocol = protocol
+
+    def dumps(self, value):
+        return pickle.dumps(value, self.protocol)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class LegacySerializer(Serializer):
+    """Writes :mod:`pickle` payloads without a header, like versions before
+    0.7 did, so they can still read sessions written by this version. Used
+    if ``SESSION_SERIALIZER`` is ``None``."""
+    name = None
+    tag = b''
+
+    def dumps(self, value):
+        return pickle.dumps(value)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class TaggedJSONSerializer(Serializer):
+    """Compact JSON that additionally supports tuples, bytes and
+    :class:`~datetime.datetime` instances.
+
+    Values JSON cannot represent are stored as single-key objects whose key
+    starts with a space, e.g. ``{" t": [1, 2]}`` for the tuple ``(1, 2)``.
+    Timezone-aware datetimes are not supported. Dictionary keys must be
+    strings."""
+    name = 'json'
+    tag = b'\x02'
+
+    TAG_TUPLE = ' t'
+    TAG_BYTES = ' b'
+    TAG_DATETIME = ' d'
+    TAG_DICT = ' m'
+
+    TAGS = frozenset((TAG_TUPLE, TAG_BYTES, TAG_DATETIME, TAG_DICT))
+
+    def _tag(self, value):
+        if isinstance(value, dict):
+            for k in value:
+                if not isinstance(k, six.string_types):
+                    raise TypeError('Cannot serialize non-string key %r'
+                                    % (k,))
+            tagged = dict((k, self._tag(v)) for k, v in value.items())
+
+            # escape dictionaries that could be mistaken for tagged values
+            if len(value) == 1 and next(iter(value)) in self.TAGS:
+                return {self.TAG_DICT: list(tagged.items())}
+            return tagged
+        if isinstance(value, list):
+            return [self._tag(v) for v in value]
+        if isinstance(value, tuple):
+            return {self.TAG_TUPLE: [self._tag(v) for v in value]}
+        if isinstance(value, bytes):
+            return {self.TAG_BYTES: b64encode(value).decode('ascii')}
+        if isinstance(value, datetime):
+            if value.tzinfo is not None:
+                raise TypeError('Cannot serialize timezone-aware datetime %r'
+                                % value)
+            return {self.TAG_DATETIME: [
+                value.year, value.month, value.day, value.hour,
+                value.minute, value.second, value.microsecond
+            ]}
+        return value
+
+    def _untag(self, obj):
+        if len(obj) == 1:
+            key, value = next(iter(obj.items()))
+
+            if key == self.TAG_TUPLE:
+                return tuple(value)
+            if key == self.TAG_BYTES:
+                return b64decode(value.encode('ascii'))
+            if key == self.TAG_DATETIME:
+                return datetime(*value)
+            if key == self.TAG_DICT:
+                return dict(value)
+        return obj
+
+    def dumps(self, value):
+        return json.dumps(self._tag(value),
+                          separators=(',', ':')).encode('utf8')
+
+    def dumps_limited(self, value, limit):
+        """Serialize the dictionary ``value`` like :meth:`dumps`, but return
+        ``None`` as soon as the output exceeds ``limit`` bytes, without
+        serializing the remaining keys."""
+        if len(value) == 1 and next(iter(value)) in self.TAGS:
+            # escaped as a whole
+            data = self.dumps(value)
+            return data if len(data) <= limit else None
+
+        # braces and commas
+        size = max(len(value) + 1, 2)
+        parts = []
+        for key, item in value.items():
+            if not isinstance(key, six.string_types):
+                raise TypeError('Cannot serialize non-string key %r' % (key,))
+
+            part = ('%s:%s' % (json.dumps(key), json.dumps(
+                self._tag(item), separators=(',', ':')))).encode('utf8')
+            size += len(part)
+            if size > limit:
+                return None
+            parts.append(part)
+
+        return b'{' + b','.join(parts) + b'}'
+
+    def loads(self, data):
+        return json.loads(data.decode('utf8'), object_hook=self._untag)
+
+
+class MsgpackSerializer(Serializer):
+    """Uses `msgpack <https://msgpack.org>`_, if installed.
+
+    Tuples and :class:`~datetime.datetime` instances are stored as extension
+    types."""
+    name = 'msgpack'
+    tag = b'\x03'
+
+    EXT_TUPLE = 1
+    EXT_DATETIME = 2
+
+    def _default(self, obj):
+        if isinstance(obj, tuple):
+            return msgpack.ExtType(self.EXT_TUPLE, self.dumps(list(obj)))
+        if isinstance(obj, datetime):
+            if obj.tzinfo is not None:
+                raise TypeError('Cannot serialize timezone-aware datetime %r'
+                                % obj)
+            return msgpack.ExtType(self.EXT_DATETIME, self.dumps([
+                obj.year, obj.month, obj.day, obj.hour, obj.minute,
+                obj.second, obj.microsecond
+            ]))
+        # subclasses of dict and list are rejected due to strict_types
+        if isinstance(obj, dict):
+            return dict(obj)
+        if isinstance(obj, list):
+            return list(obj)
+        raise TypeError('Cannot serialize %r' % (obj,))
+
+    def _ext_hook(self, code, data):
+        if code == self.EXT_TUPLE:
+            return tuple(self.loads(data))
+        if code == self.EXT_DATETIME:
+            return datetime(*self.loads(data))
+        return msgpack.ExtType(code, data)
+
+    def dumps(self, value):
+        return msgpack.packb(value, use_bin_type=True, strict_types=True,
+                             default=self._default)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False, ext_hook=self._ext_hook)
+
+
+#: All known serializers, by name.
+serializers = {}
+
+_serializers_by_tag = {}
+
+
+def register_serializer(serializer):
+    """Make a serializer available by name and enable decoding of payloads
+    carrying its tag.
+
+    :param serializer: A :class:`Serializer` instance.
+    """
+    if _serializers_by_tag.get(serializer.tag, serializer).name != \
+            serializer.name:
+        raise ValueError('Tag %r already in use by serializer %r' % (
+            serializer.tag, _serializers_by_tag[serializer.tag].name))
+
+    serializers[serializer.name] = serializer
+    _serializers_by_tag[serializer.tag] = serializer
+
+
+def get_serializer(name_or_serializer):
+    """Look up a serializer by name.
+
+    :param name_or_serializer: Either the name of a registered serializer, a
+                               :class:`Serializer` instance, which is returned
+                               unchanged, or ``None`` for the
+                               :class:`LegacySerializer`.
+    :raises ValueError: If no serializer with that name is available.
+    """
+    if name_or_serializer is None:
+        return LegacySerializer()
+    if isinstance(name_or_serializer, Serializer):
+        return name_or_serializer
+
+    try:
+        return serializers[name_or_serializer]
+    except KeyError:
+        raise ValueError('Unknown serializer %r, available are: %s' % (
+            name_or_serializer, ', '.join(sorted(serializers))))
+
+
+def dump_payload(serializer, value):
+    """Serialize ``value`` and prefix the serializer tag."""
+    return serializer.tag + serializer.dumps(value)
+
+
+def load_payload(data, fallback=pickle):
+    """Deserialize a payload created by :func:`dump_payload`.
+
+    :param data: The payload.
+    :param fallback: An object with a ``loads`` method, used for data without
+                     a known header.
+    """
+    serializer = _serializers_by_tag.get(data[:1])
+
+    if serializer is None:
+        return fallback.loads(data)
+    return serializer.loads(data[1:])
+
+
+register_serializer(PickleSerializer())
+register_serializer(TaggedJSONSerializer())
+
+if msgpack is not None:
+    register_serializer(MsgpackSerializer())
@@ -0,0 +1,171 @@
+"""
+Session ids and the keys they are stored under.
+
+Session keys come in two formats:
+
+``KEY_CREATED``
+    The random id and the UNIX timestamp of creation, both in hexadecimal,
+    e.g. ``1234567890abcdef_5f5e1000``.
+
+``zKEYCREATED``
+    The compact format: a ``z`` followed by the random id, zero-padded to
+    ``SESSION_KEY_BITS``, and the timestamp (4 bytes), both base64url-encoded
+    without padding, e.g. ``zEjRWeJCrze8X14QAA``. The timestamp always takes
+    the last six characters. Compact keys have a fixed length, so that
+    :func:`session_key_regex` does not match other keys starting with ``z``.
+
+Both formats are always readable, ``SESSION_KEY_FORMAT`` chooses the format of
+new keys.
+"""
+
+import base64
+import binascii
+import calendar
+from datetime import datetime, timedelta
+import re
+import struct
+import time
+
+
+COMPACT_PREFIX = 'z'
+
+# length of a base64url-encoded 4 byte timestamp without padding
+_TIMESTAMP_LENGTH = 6
+
+_B64_CHARS = '[A-Za-z0-9_-]'
+
+# base64url characters whose lowest 2 or 4 bits are zero, the only ones that
+# can end an encoding of a number of bytes not divisible by 3
+_B64_LAST = {2: '[AEIMQUYcgkosw048]', 4: '[AQgw]'}
+
+
+def _b64_pattern(size):
+    # matches exactly the base64url encodings of size bytes without padding
+    length = (size * 4 + 2) // 3
+    unused = length * 6 - size * 8
+    if not unused:
+        return '%s{%d}' % (_B64_CHARS, length)
+    return '%s{%d}%s' % (_B64_CHARS, length - 1, _B64_LAST[unused])
+
+
+def session_key_regex(key_bits=64):
+    """Return a compiled regular expression matching session keys in either
+    format, with compact keys of ``key_bits`` random bits."""
+    return re.compile('^(?:[0-9a-f]+_[0-9a-f]+|%s%s%s)$' % (
+        COMPACT_PREFIX, _b64_pattern((key_bits + 7) // 8), _b64_pattern(4)))
+
+
+#: Matches keys in either format, with the default ``SESSION_KEY_BITS``.
+KEY_REGEX = session_key_regex()
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(s):
+    return base64.urlsafe_b64decode((s + '=' * (-len(s) % 4)).encode('ascii'))
+
+
+def _timestamp(dt):
+    return calendar.timegm(dt.utctimetuple())
+
+
+def key_timestamp(sid_s):
+    """Return the creation time of a session key as a UNIX timestamp,
+    without parsing the rest of the key."""
+    if sid_s.startswith(COMPACT_PREFIX):
+        return struct.unpack(
+            '>I', _b64decode(sid_s[-_TIMESTAMP_LENGTH:]))[0]
+    return int(sid_s.rpartition('_')[2], 16)
+
+
+def key_id_part(sid_s):
+    """Return the part of a session key holding the random id."""
+    if sid_s.startswith(COMPACT_PREFIX):
+        return sid_s[:-_TIMESTAMP_LENGTH]
+    return sid_s.partition('_')[0]
+
+
+class SessionID(object):
+    """Helper class for parsing session ids.
+
+    Internally, Flask-KVSession stores session ids that are serialized as
+    ``KEY_CREATED``, where ``KEY`` is a random number (the sessions "true" id)
+    and ``CREATED`` a UNIX-timestamp of when the session was created.
+
+    :param id: An integer to be used as the session key.
+    :param created: A :class:`~datetime.datetime` instance, a UNIX timestamp
+                    or None. A value of None will result in the current time
+                    being used.
+    """
+
+    __slots__ = ('id', 'timestamp')
+
+    def __init__(self, id, created=None):
+        if created is None:
+            created = time.time()
+        elif isinstance(created, datetime):
+            created = _timestamp(created)
+
+        self.id = id
+        #: The creation time as an integer UNIX timestamp.
+        self.timestamp = int(created)
+
+    @property
+    def created(self):
+        """The creation time as a naive UTC :class:`~datetime.datetime`."""
+        return datetime.utcfromtimestamp(self.timestamp)
+
+    @created.setter
+    def created(self, value):
+        self.timestamp = _timestamp(value)
+
+    def has_expired(self, lifetime, now=None):
+        """Report if the session key has expired.
+
+        :param lifetime: A :class:`datetime.timedelta` or a number of seconds
+                         that specifies the maximum age this
+                         :class:`SessionID` should be checked against.
+        :param now: If specified, use this :class:`~datetime.datetime`
+                    instance or UNIX timestamp instead of the current time.
+        """
+        if isinstance(lifetime, timedelta):
+            lifetime = lifetime.total_seconds()
+
+        if now is None:
+            now = time.time()
+        elif isinstance(now, datetime):
+            now = _timestamp(now) + now.microsecond / 1e6
+
+        return now > self.timestamp + lifetime
+
+    def serialize(self, compact=False, key_bits=64):
+        """Serializes to the standard form of ``KEY_CREATED``, or the compact
+        form if ``compact`` is ``True``.
+
+        :param key_bits: The number of random bits of the id, the compact
+                         form is zero-padded to this size."""
+        if not compact:
+            return '%x_%x' % (self.id, self.timestamp)
+
+        id_hex = '%x' % self.id
+        id_hex = id_hex.zfill(max(len(id_hex) + len(id_hex) % 2,
+                                  (key_bits + 7) // 8 * 2))
+
+        return (COMPACT_PREFIX + _b64encode(binascii.unhexlify(id_hex)) +
+                _b64encode(struct.pack('>I', self.timestamp)))
+
+    @classmethod
+    def unserialize(cls, string):
+        """Unserializes from a string.
+
+        :param string: A string created by :meth:`serialize`, in either
+                       format.
+        """
+        if string.startswith(COMPACT_PREFIX):
+            id_b = _b64decode(string[1:-_TIMESTAMP_LENGTH])
+            return cls(int(binascii.hexlify(id_b), 16), key_timestamp(string))
+
+        id_s, created_s = string.split('_')
+        return cls(int(id_s, 16), int(created_s, 16))
@@ -0,0 +1,322 @@
+"""
+Distribution of sessions across several stores using consistent hashing.
+"""
+
+from bisect import bisect
+from collections import Counter
+import hashlib
+from io import BytesIO
+from itertools import chain
+import struct
+from threading import Lock
+
+from .redisstore import redis_store, touch as redis_touch
+from .sessionid import KEY_REGEX, key_id_part
+
+
+def _remaining_ttl(store, key):
+    # the remaining time-to-live of a key in seconds, if the store is backed
+    # by Redis, otherwise None
+    redis = getattr(store, 'redis', None)
+    if redis is None:
+        return None
+
+    ttl = redis.pttl(key)
+    if ttl is None or ttl < 0:
+        return None
+    return max(1, (ttl + 999) // 1000)
+
+
+def _hash(s):
+    return struct.unpack('>Q', hashlib.md5(s.encode('utf8')).digest()[:8])[0]
+
+
+class ShardedStore(object):
+    """Routes every key to one of several stores.
+
+    Keys are placed on a hash ring on which every shard occupies a number of
+    points proportional to its weight. For session keys, only the random id
+    part is hashed, other keys (such as those of the expiry index) are hashed
+    as a whole. Adding a shard only moves the keys falling onto its new
+    points, roughly ``1 / len(shards)`` of all keys.
+
+    The store supports time-to-live and per-field operations (see
+    :mod:`flask_kvsession.hashstore`) if all shards do.
+    :meth:`~flask_kvsession.KVSessionExtension.cleanup_sessions` cleans up
+    all shards in parallel.
+
+    :param shards: A dictionary of shard names to stores. Names determine the
+                   placement on the ring and must stay the same across
+                   processes and restarts.
+    :param weights: An optional dictionary of shard names to weights, which
+                    default to 1.
+    :param replicas: Number of points per shard of weight 1.
+    :param key_regex: Compiled regular expression matching session keys,
+                      see :func:`~flask_kvsession.sessionid.session_key_regex`.
+    """
+
+    def __init__(self, shards, weights=None, replicas=100,
+                 key_regex=KEY_REGEX):
+        self.replicas = replicas
+        self.key_regex = key_regex
+        self.shards = {}
+        self.weights = {}
+
+        #: Number of operations per shard and kind (``get``, ``put``,
+        #: ``delete``), as a dictionary of :class:`~collections.Counter`
+        #: instances.
+        self.counters = {}
+
+        self._ring = ((), ())
+        # the ring before the shard currently being added, keys not moved
+        # yet are read from their previous owner
+        self._previous_ring = None
+        self._lock = Lock()
+
+        weights = weights or {}
+        for name, store in shards.items():
+            self._add(name, store, weights.get(name, 1))
+        self._build_ring()
+
+    def _add(self, name, store, weight):
+        if name in self.shards:
+            raise ValueError('Shard %r already exists' % name)
+        if weight <= 0:
+            raise ValueError('Weight of shard %r must be positive' % name)
+
+        self.shards[name] = store
+        self.weights[name] = weight
+        self.counters[name] = Counter()
+
+    def _build_ring(self):
+        self._ring = self._make_ring()
+
+    def _make_ring(self):
+        points = []
+        for name, weight in self.weights.items():
+            for i in range(max(1, int(self.replicas * weight))):
+                points.append((_hash('%s-%d' % (name, i)), name))
+        points.sort()
+
+        # swapped in as a whole, readers never see a partial ring
+        return (tuple(p[0] for p in points),
+                tuple(p[1] for p in points))
+
+    def _owner(self, ring, key):
+        hashes, names = ring
+        if not hashes:
+            raise ValueError('No shards configured')
+
+        if self.key_regex.match(key):
+            key = key_id_part(key)
+        i = bisect(hashes, _hash(key))
+        return names[i % len(names)]
+
+    def shard_for(self, key):
+        """Return the name of the shard ``key`` belongs to."""
+        return self._owner(self._ring, key)
+
+    def _route(self, key, op):
+        name = self.shard_for(key)
+        self.counters[name][op] += 1
+        return self.shards[name]
+
+    def _previous_owner(self, key):
+        # the store key belonged to before the shard being added, if it is a
+        # different one
+        ring = self._previous_ring
+        if ring is None:
+            return None
+
+        name = self._owner(ring, key)
+        if name == self.shard_for(key):
+            return None
+        return self.shards[name]
+
+    def _read(self, key, method):
+        try:
+            return getattr(self._route(key, 'get'), method)(key)
+        except KeyError:
+            # not moved to the shard being added yet
+            previous = self._previous_owner(key)
+            if previous is None:
+                raise
+            return getattr(previous, method)(key)
+
+    def _move(self, key, old_store, store, ttl_secs):
+        # copies a key to the shard it belongs to now, unless it was written
+        # there already. returns False if the key no longer exists
+        if key not in store:
+            ttl = _remaining_ttl(old_store, key) or ttl_secs
+            try:
+                if getattr(old_store, 'hash_support', False):
+                    store.put_fields(key, old_store.get_fields(key), ttl)
+                elif ttl is None:
+                    store.put(key, old_store.get(key))
+                else:
+                    store.put(key, old_store.get(key), ttl)
+            except KeyError:
+                # expired or deleted in the meantime
+                return False
+
+        old_store.delete(key)
+        return True
+
+    def add_shard(self, name, store, weight=1, ttl_secs=None):
+        """Add a shard and move the keys that now belong to it.
+
+        Moved keys are copied to the new shard, unless it holds a newer
+        version written in the meantime, then deleted from their old one.
+        Until a key is moved, it is read from its old shard. The remaining
+        time-to-live of keys on Redis stores is kept, others have it set to
+        ``ttl_secs``.
+
+        :raises ValueError: If ``store`` supports time-to-live, but
+                            ``ttl_secs`` is not given and the time-to-live of
+                            keys cannot be read from all existing shards.
+        :returns: The number of keys moved.
+        """
+        if (ttl_secs is None and getattr(store, 'ttl_support', False) and
+                not all(hasattr(s, 'redis') for s in self.shards.values())):
+            raise ValueError('ttl_secs is required to move keys to a store '
+                             'supporting time-to-live')
+
+        with self._lock:
+            self._add(name, store, weight)
+            self._previous_ring = self._ring
+            self._build_ring()
+
+        moved = 0
+        try:
+            for old_name, old_store in list(self.shards.items()):
+                if old_name == name:
+                    continue
+
+                for key in list(old_store.iter_keys()):
+                    if self.shard_for(key) != name:
+                        continue
+
+                    if self._move(key, old_store, store, ttl_secs):
+                        moved += 1
+        finally:
+            self._previous_ring = None
+
+        return moved
+
+    @property
+    def shard_stores(self):
+        """A list of all shard stores."""
+        return list(self.shards.values())
+
+    @property
+    def ttl_support(self):
+        return all(getattr(s, 'ttl_support', False)
+                   for s in self.shards.values())
+
+    @property
+    def hash_support(self):
+        return all(getattr(s, 'hash_support', False)
+                   for s in self.shards.values())
+
+    def get(self, key):
+        return self._read(key, 'get')
+
+    def get_file(self, key, file):
+        file.write(self.get(key))
+
+    def open(self, key):
+        return BytesIO(self.get(key))
+
+    def put(self, key, data, ttl_secs=None):
+        store = self._route(key, 'put')
+        if ttl_secs is None:
+            return store.put(key, data)
+        return store.put(key, data, ttl_secs)
+
+    def put_file(self, key, file, ttl_secs=None):
+        return self.put(key, file.read(), ttl_secs)
+
+    def delete(self, key):
+        previous = self._previous_owner(key)
+        if previous is not None:
+            # must not be read from its old shard after deleting
+            previous.delete(key)
+        return self._route(key, 'delete').delete(key)
+
+    def delete_many(self, keys):
+        """Delete several keys, grouped by shard."""
+        groups = {}
+        for key in keys:
+            groups.setdefault(self.shard_for(key), []).append(key)
+
+        for name, group in groups.items():
+            store = self.shards[name]
+            self.counters[name]['delete'] += len(group)
+
+            if hasattr(store, 'delete_many'):
+                store.delete_many(group)
+            else:
+                for key in group:
+                    store.delete(key)
+
+        if self._previous_ring is not None:
+            for key in keys:
+                previous = self._previous_owner(key)
+                if previous is not None:
+                    previous.delete(key)
+
+    def touch(self, key, ttl_secs):
+        """Set the time-to-live of ``key``, rewriting it on shards without a
+        ``touch`` method that are not redis stores."""
+        store = self._route(key, 'put')
+
+        previous = self._previous_owner(key)
+        if previous is not None and key not in store:
+            self._move(key, previous, store, ttl_secs)
+
+        redis = redis_store(store)
+        if hasattr(store, 'touch'):
+            store.touch(key, ttl_secs)
+        elif redis is not None:
+            redis_touch(redis, key, ttl_secs)
+        else:
+            store.put(key, store.get(key), ttl_secs)
+
+    def get_fields(self, key):
+        return self._read(key, 'get_fields')
+
+    def put_fields(self, key, fields, ttl_secs=None):
+        return self._route(key, 'put').put_fields(key, fields, ttl_secs)
+
+    def update_fields(self, key, fields, deleted=(), ttl_secs=None):
+        store = self._route(key, 'put')
+
+        previous = self._previous_owner(key)
+        if previous is not None and key not in store:
+            # the other fields have not been moved yet
+            self._move(key, previous, store, ttl_secs)
+
+        return store.update_fields(key, fields, deleted, ttl_secs)
+
+    def __contains__(self, key):
+        if key in self._route(key, 'get'):
+            return True
+
+        previous = self._previous_owner(key)
+        return previous is not None and key in previous
+
+    def iter_keys(self, prefix=u''):
+        return chain.from_iterable(s.iter_keys(prefix)
+                                   for s in self.shard_stores)
+
+    def __iter__(self):
+        return self.iter_keys()
+
+    def keys(self, prefix=u''):
+        return list(self.iter_keys(prefix))
+
+    def stats(self):
+        """Return a dictionary of shard names to dictionaries of operation
+        counts."""
+        return dict((name, dict(counter))
+                    for name, counter in self.counters.items())
@@ -0,0 +1,227 @@
+"""
+A two-tier store: a bounded in-process cache (L1) in front of a store shared
+by all workers (L2).
+"""
+
+from binascii import hexlify
+from collections import OrderedDict
+from io import BytesIO
+import os
+from threading import Lock
+import time
+
+from simplekv.decorator import StoreDecorator
+
+from .redisstore import redis_store, touch as redis_touch
+
+
+class TieredStore(StoreDecorator):
+    """Caches values of a shared store in process memory.
+
+    Writes go through to the shared store. Next to every value, a short
+    random version stamp is written under ``version_prefix + key``. Reading a
+    cached value only fetches the stamp from the shared store and compares it
+    to the cached one, so changes made by other workers are noticed without
+    transferring the value again.
+
+    With a ``max_age`` greater than zero, cached values are served without
+    asking the shared store at all if they were validated less than
+    ``max_age`` seconds ago. Changes by other workers, including deletions and
+    expiry, may then go unnoticed for that long.
+
+    Per-field operations (see :mod:`flask_kvsession.hashstore`) and other
+    methods not listed here are passed to the shared store directly.
+
+    :param store: The shared store.
+    :param max_entries: Maximum number of values kept in memory.
+    :param max_age: Number of seconds a validated value is trusted.
+    :param version_prefix: Prefix of the keys holding version stamps.
+    :param clock: A function returning the current time in seconds.
+    """
+
+    def __init__(self, store, max_entries=1024, max_age=0,
+                 version_prefix='kvsession_version_', clock=time.time):
+        super(TieredStore, self).__init__(store)
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.version_prefix = version_prefix
+        self.clock = clock
+
+        #: Reads served from memory.
+        self.hits = 0
+        #: Reads of values not cached in memory.
+        self.misses = 0
+        #: Reads of cached values that had been changed by another worker.
+        self.stale = 0
+
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def _version_key(self, key):
+        return self.version_prefix + key
+
+    def _cache(self, key, data, version):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (data, version, self.clock())
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _evict(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def get(self, key):
+        """Return the value of ``key``, from memory if it is current.
+
+        :raises KeyError: If the key does not exist in the shared store.
+        """
+        entry = self._cached(key)
+
+        if entry is not None:
+            data, version, validated = entry
+
+            if self.max_age and validated + self.max_age > self.clock():
+                self.hits += 1
+                return data
+
+            try:
+                current = self._dstore.get(self._version_key(key))
+            except KeyError:
+                current = None
+
+            if current == version:
+                self.hits += 1
+                self._cache(key, data, version)
+                return data
+
+            self.stale += 1
+        else:
+            self.misses += 1
+
+        # the version is read before the value: should both change in
+        # between, the new value is cached with the old version and fetched
+        # again on the next read, never the other way around
+        try:
+            version = self._dstore.get(self._version_key(key))
+        except KeyError:
+            version = None
+
+        try:
+            data = self._dstore.get(key)
+        except KeyError:
+            self._evict(key)
+            raise
+
+        if version is not None:
+            self._cache(key, data, version)
+        else:
+            # written without a version, cannot be validated later
+            self._evict(key)
+        return data
+
+    def get_file(self, key, file):
+        """Write the value of ``key`` to ``file``."""
+        file.write(self.get(key))
+
+    def open(self, key):
+        """Return a file-like object reading the value of ``key``."""
+        return BytesIO(self.get(key))
+
+    def put(self, key, data, ttl_secs=None):
+        """Write ``data`` to the shared store and cache it.
+
+        :param ttl_secs: Time-to-live, passed on if the shared store supports
+                         it.
+        """
+        version = hexlify(os.urandom(8))
+        args = () if ttl_secs is None else (ttl_secs,)
+
+        # the value is written before the version, see get()
+        self._evict(key)
+        self._dstore.put(key, data, *args)
+        self._dstore.put(self._version_key(key), version, *args)
+        self._cache(key, data, version)
+        return key
+
+    def put_file(self, key, file, ttl_secs=None):
+        """Like :meth:`put`, reading the value from a file-like object."""
+        return self.put(key, file.read(), ttl_secs)
+
+    def touch(self, key, ttl_secs):
+        """Set the time-to-live of ``key`` and its version stamp in the shared
+        store, rewriting them unchanged if the shared store has no ``touch``
+        method and is not a redis store."""
+        redis = redis_store(self._dstore)
+
+        for stored in (key, self._version_key(key)):
+            if hasattr(self._dstore, 'touch'):
+                self._dstore.touch(stored, ttl_secs)
+            elif redis is not None:
+                redis_touch(redis, stored, ttl_secs)
+            else:
+                try:
+                    data = self._dstore.get(stored)
+                except KeyError:
+                    # written without a version
+                    continue
+                self._dstore.put(stored, data, ttl_secs)
+
+    def delete(self, key):
+        """Delete ``key`` from both tiers."""
+        self._evict(key)
+        self._dstore.delete(key)
+        self._dstore.delete(self._version_key(key))
+
+    def delete_many(self, keys):
+        """Delete several keys from both tiers."""
+        for key in keys:
+            self._evict(key)
+
+        keys = list(keys)
+        keys += [self._version_key(key) for key in keys]
+
+        if hasattr(self._dstore, 'delete_many'):
+            self._dstore.delete_many(keys)
+        else:
+            for key in keys:
+                self._dstore.delete(key)
+
+    def __contains__(self, key):
+        return key in self._dstore
+
+    def iter_keys(self, prefix=u''):
+        """Iterate over the keys of the shared store, leaving out version
+        stamps."""
+        return (key for key in self._dstore.iter_keys(prefix)
+                if not key.startswith(self.version_prefix))
+
+    def __iter__(self):
+        return self.iter_keys()
+
+    def keys(self, prefix=u''):
+        """Return a list of keys in the shared store."""
+        return list(self.iter_keys(prefix))
+
+    def clear_cache(self):
+        """Drop all values from memory."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return a dictionary with the number of cached values, hits, misses
+        and stale reads."""
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+        }
@@ -0,0 +1,166 @@
+"""
+Sampled traces of the session operations of individual requests.
+
+Setting ``SESSION_TRACER`` to a :class:`Tracer` records, for a share of all
+requests, a tree of spans such as::
+
+  open_session
+    signature
+    get
+    deserialize
+  save_session
+    serialize
+    put
+    set_cookie
+
+Every span has a ``name``, its ``start`` relative to the start of the trace
+and its ``duration`` (both in seconds), the number of bytes handled
+(``size``, the largest of its children for ``open_session`` and
+``save_session``), the class name of the ``store`` for store operations, and
+its ``children``. Events such as ``cache_hit`` are listed in ``events``.
+
+A trace is a dictionary with the request ``method`` and ``path``, its
+``start`` as a UNIX timestamp, total ``duration``, the top-level ``spans``
+and ``events`` outside of any span. Lazily loaded sessions are retrieved
+outside of ``open_session``, their spans appear at the top level.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+import random
+import time
+from timeit import default_timer
+
+from flask import current_app, has_request_context, request
+
+
+#: Phases that access the store.
+STORE_PHASES = frozenset(['get', 'put', 'delete'])
+
+_ENVIRON_KEY = 'flask_kvsession.trace'
+
+
+class Tracer(object):
+    """Records span trees of sampled requests.
+
+    Finished traces are kept in :attr:`traces`, holding the latest
+    ``buffer_size`` traces, and passed to ``callback`` if given.
+
+    A tracer implements the collector interface described in
+    :mod:`flask_kvsession.metrics` and is used alongside any configured
+    ``SESSION_METRICS`` collector.
+
+    :param sample_rate: Share of requests to trace, between 0 and 1.
+    :param buffer_size: Number of traces to keep.
+    :param callback: A callable receiving each finished trace.
+    :param random: A function returning a random number between 0 and 1.
+    :param clock: A function returning a monotonic time in seconds.
+    """
+
+    def __init__(self, sample_rate=0.01, buffer_size=100, callback=None,
+                 random=random.random, clock=default_timer):
+        self.sample_rate = sample_rate
+        self.callback = callback
+        self.random = random
+        self.clock = clock
+
+        #: The most recent traces.
+        self.traces = deque(maxlen=buffer_size)
+
+    def _current(self):
+        if not has_request_context():
+            return None
+        return request.environ.get(_ENVIRON_KEY)
+
+    def _add(self, trace, span):
+        if trace['_stack']:
+            trace['_stack'][-1]['children'].append(span)
+        else:
+            trace['spans'].append(span)
+
+    def _span(self, trace, name, start, duration=None, size=None):
+        span = {
+            'name': name,
+            'start': start - trace['_start'],
+            'duration': duration,
+            'size': size,
+            'store': None,
+            'children': [],
+            'events': [],
+        }
+
+        if name in STORE_PHASES:
+            span['store'] = type(current_app.kvsession_store).__name__
+        return span
+
+    @contextmanager
+    def span(self, name, environ):
+        """Record a span around the enclosed block, if the request is
+        sampled. The sampling decision is made by the first span of a
+        request."""
+        if _ENVIRON_KEY not in environ:
+            trace = None
+            if self.sample_rate and self.random() < self.sample_rate:
+                trace = {
+                    'method': environ.get('REQUEST_METHOD'),
+                    'path': environ.get('PATH_INFO'),
+                    'start': time.time(),
+                    'duration': None,
+                    'spans': [],
+                    'events': [],
+                    '_start': self.clock(),
+                    '_stack': [],
+                }
+            environ[_ENVIRON_KEY] = trace
+
+        trace = environ[_ENVIRON_KEY]
+        if trace is None:
+            yield
+            return
+
+        span = self._span(trace, name, self.clock())
+        self._add(trace, span)
+        trace['_stack'].append(span)
+
+        try:
+            yield
+        finally:
+            trace['_stack'].pop()
+            span['duration'] = self.clock() - trace['_start'] - span['start']
+
+            sizes = [c['size'] for c in span['children']
+                     if c['size'] is not None]
+            if sizes:
+                span['size'] = max(sizes)
+
+    def finish(self, environ):
+        """Complete the trace of a request, store it and pass it to the
+        callback."""
+        trace = environ.pop(_ENVIRON_KEY, None)
+        if trace is None:
+            return
+
+        trace['duration'] = self.clock() - trace.pop('_start')
+        del trace['_stack']
+
+        self.traces.append(trace)
+        if self.callback is not None:
+            self.callback(trace)
+
+    def observe(self, phase, seconds, size=None):
+        trace = self._current()
+        if trace is None:
+            return
+
+        self._add(trace, self._span(trace, phase, self.clock() - seconds,
+                                    seconds, size))
+
+    def increment(self, event):
+        trace = self._current()
+        if trace is None:
+            return
+
+        if trace['_stack']:
+            trace['_stack'][-1]['events'].append(event)
+        else:
+            trace['events'].append(event)
@@ -0,0 +1,222 @@
+"""
+Write-behind persistence: store writes are performed by background threads
+instead of delaying the response.
+"""
+
+from collections import namedtuple
+import logging
+import os
+from threading import Lock, Thread
+from timeit import default_timer
+
+try:
+    from Queue import Full, Queue
+except ImportError:
+    from queue import Full, Queue
+
+
+log = logging.getLogger(__name__)
+
+_Operation = namedtuple('_Operation', 'key data ttl_secs enqueued')
+
+
+class WriteBehindQueue(object):
+    """Hands puts and deletes to a pool of worker threads.
+
+    Operations on the same key are always performed by the same worker, in the
+    order they were submitted. Until an operation has been carried out, reads
+    through :meth:`get` return the pending data, so a process always sees its
+    own writes.
+
+    Failed writes are logged and counted, but cannot be reported to the
+    request that caused them.
+
+    :param store: The store to write to.
+    :param workers: Number of worker threads.
+    :param queue_size: Maximum number of queued operations.
+    :param overflow: What to do if the queue is full: ``'block'`` waits for
+                     room, ``'sync'`` performs the operation in the calling
+                     thread and ``'fail'`` raises :exc:`queue.Full`.
+    """
+
+    BLOCK = 'block'
+    SYNC = 'sync'
+    FAIL = 'fail'
+
+    def __init__(self, store, workers=2, queue_size=1000, overflow=BLOCK):
+        if overflow not in (self.BLOCK, self.SYNC, self.FAIL):
+            raise ValueError('Invalid overflow behavior: %r' % overflow)
+
+        self.store = store
+        self.workers = workers
+        self.queue_size = queue_size
+        self.overflow = overflow
+
+        self._lock = Lock()
+        self._pending = {}
+
+        #: Number of operations performed by workers.
+        self.completed = 0
+        #: Number of operations that failed.
+        self.errors = 0
+        #: Number of operations performed synchronously due to overflow.
+        self.sync_writes = 0
+        #: Total, maximum and most recent delay between submitting and
+        #: completing an operation, in seconds.
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+
+        self._start()
+
+    def _start(self):
+        pid = os.getpid()
+        if getattr(self, '_pid', pid) != pid:
+            # forked: pending operations are performed by the parent's
+            # workers, which may also have held the lock
+            self._lock = Lock()
+            self._pending = {}
+        self._pid = pid
+
+        size = max(1, self.queue_size // self.workers)
+        self._queues = [Queue(size) for _ in range(self.workers)]
+        self._threads = []
+
+        for q in self._queues:
+            t = Thread(target=self._work, args=(q,))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def _work(self, queue):
+        while True:
+            op = queue.get()
+
+            try:
+                if op is None:
+                    return
+                self._execute(op)
+
+                lag = default_timer() - op.enqueued
+                with self._lock:
+                    if self._pending.get(op.key) is op:
+                        del self._pending[op.key]
+                    self.completed += 1
+                    self.total_lag += lag
+                    self.last_lag = lag
+                    self.max_lag = max(self.max_lag, lag)
+            except Exception:
+                log.exception('Background write of session %r failed',
+                              getattr(op, 'key', None))
+                with self._lock:
+                    if self._pending.get(op.key) is op:
+                        del self._pending[op.key]
+                    self.errors += 1
+            finally:
+                queue.task_done()
+
+    def _execute(self, op):
+        if op.data is None:
+            self.store.delete(op.key)
+        elif op.ttl_secs is not None:
+            self.store.put(op.key, op.data, op.ttl_secs)
+        else:
+            self.store.put(op.key, op.data)
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # threads do not survive a fork, start new ones
+            self._start()
+
+    def _submit(self, op):
+        self._check_fork()
+        queue = self._queues[hash(op.key) % len(self._queues)]
+
+        with self._lock:
+            # an operation still waiting for the same key must not be
+            # overtaken by a synchronous one
+            must_queue = op.key in self._pending
+            self._pending[op.key] = op
+
+        try:
+            if self.overflow == self.BLOCK or must_queue:
+                queue.put(op)
+            else:
+                queue.put_nowait(op)
+        except Full:
+            with self._lock:
+                if self._pending.get(op.key) is op:
+                    del self._pending[op.key]
+
+            if self.overflow == self.FAIL:
+                raise
+
+            self._execute(op)
+            with self._lock:
+                self.sync_writes += 1
+
+    def put(self, key, data, ttl_secs=None):
+        """Queue writing ``data`` to ``key``."""
+        self._submit(_Operation(key, data, ttl_secs, default_timer()))
+
+    def delete(self, key):
+        """Queue deleting ``key``."""
+        self._submit(_Operation(key, None, None, default_timer()))
+
+    def get(self, key, store=None):
+        """Read ``key``, taking pending operations into account.
+
+        :param store: The store to read from if there is no pending
+                      operation, instead of the one written to, e.g. the
+                      primary of a replicated store.
+        :raises KeyError: If the key does not exist or is about to be
+                          deleted.
+        """
+        self._check_fork()
+        with self._lock:
+            op = self._pending.get(key)
+
+        if op is None:
+            return (self.store if store is None else store).get(key)
+        if op.data is None:
+            raise KeyError(key)
+        return op.data
+
+    @property
+    def depth(self):
+        """Number of operations waiting to be performed."""
+        return sum(q.qsize() for q in self._queues)
+
+    def flush(self):
+        """Block until all queued operations have been performed."""
+        self._check_fork()
+        for q in self._queues:
+            q.join()
+
+    def close(self):
+        """Perform all queued operations and stop the workers. Closing a
+        queue again does nothing."""
+        if self._pid != os.getpid() or not self._threads:
+            return
+
+        self.flush()
+        for q in self._queues:
+            q.put(None)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def stats(self):
+        """Return a dictionary with queue depth, counters and lag."""
+        with self._lock:
+            return {
+                'depth': self.depth,
+                'pending': len(self._pending),
+                'completed': self.completed,
+                'errors': self.errors,
+                'sync_writes': self.sync_writes,
+                'avg_lag': (self.total_lag / self.completed
+                            if self.completed else 0.0),
+                'max_lag': self.max_lag,
+                'last_lag': self.last_lag,
+            }
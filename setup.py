@@ -29,6 +29,11 @@ setup(
         'Flask>=0.8', 'simplekv>=0.9.2', 'werkzeug', 'itsdangerous>=0.20',
         'six',
     ],
+    extras_require={
+        'msgpack': ['msgpack'],
+        'lz4': ['lz4'],
+        'zstd': ['zstandard'],
+    },
     classifiers=[
         'Programming Language :: Python :: 2',
         'Programming Language :: Python :: 3',
@@ -1,5 +1,6 @@
 import json
 from datetime import datetime
+import sys
 
 from flask import Flask, session
 from flask_kvsession import KVSessionExtension, KVSession
@@ -8,6 +9,10 @@ import six
 
 import pytest
 
+if sys.version_info < (3, 7):
+    # uses async syntax
+    collect_ignore = ['test_aio.py']
+
 
 @pytest.fixture
 def redis():
@@ -0,0 +1,277 @@
+import asyncio
+from datetime import timedelta
+import time
+
+from flask import Flask, session
+from flask_kvsession.aio import (AsyncDictStore, AsyncKVSessionExtension,
+                                 cleanup_store, ExecutorStore)
+from flask_kvsession.hashstore import DictHashStore
+from simplekv.memory import DictStore
+from werkzeug.test import EnvironBuilder
+import pytest
+
+
+@pytest.fixture
+def async_store():
+    return AsyncDictStore()
+
+
+class AwaitingFlask(Flask):
+    """Dispatches requests in a coroutine like Quart, awaiting the session
+    interface."""
+
+    async def full_dispatch_request(self, ctx):
+        interface = self.session_interface
+        ctx.session = await interface.open_session(self, ctx.request)
+        response = self.make_response(self.dispatch_request())
+        await interface.save_session(self, ctx.session, response)
+        return response
+
+    def get(self, path, cookie=None):
+        headers = {'Cookie': 'session=%s' % cookie} if cookie else {}
+        ctx = self.request_context(
+            EnvironBuilder(path, headers=headers).get_environ())
+
+        # pushing a context without a session would open it synchronously
+        ctx.session = {}
+        with ctx:
+            return asyncio.run(self.full_dispatch_request(ctx))
+
+
+@pytest.fixture
+def async_app(async_store):
+    app = AwaitingFlask(__name__)
+    app.config['SECRET_KEY'] = 'devkey'
+    app.kvsession = AsyncKVSessionExtension(async_store, app)
+    return app
+
+
+def cookie_of(response):
+    header = response.headers['Set-Cookie']
+    return header.split(';')[0].split('=', 1)[1]
+
+
+def roundtrip(app, cookie=None, change=None):
+    """Open a session, apply ``change`` and save it, return the session, its
+    values when opened and the new cookie (or ``None``)."""
+    headers = {'Cookie': 'session=%s' % cookie} if cookie else {}
+    interface = app.session_interface
+
+    # a request context would open the session synchronously
+    request = app.request_class(
+        EnvironBuilder('/', headers=headers).get_environ())
+
+    async def run():
+        session = await interface.open_session(app, request)
+        opened = dict(session)
+        if change is not None:
+            change(session)
+        response = app.response_class()
+        await interface.save_session(app, session, response)
+        return session, opened, response
+
+    session, opened, response = asyncio.run(run())
+    new_cookie = (cookie_of(response) if 'Set-Cookie' in response.headers
+                  else None)
+    return session, opened, new_cookie
+
+
+def set_value(key, value):
+    def change(session):
+        session[key] = value
+    return change
+
+
+def test_store_and_load(async_app, async_store):
+    _, opened, cookie = roundtrip(async_app, change=set_value('k1', 'v1'))
+    assert opened == {}
+    assert len(async_store.d) == 1
+
+    session, opened, new_cookie = roundtrip(async_app, cookie)
+    assert opened == {'k1': 'v1'}
+    assert not session.new
+    assert new_cookie is None
+
+
+def test_skip_unchanged(async_app, async_store):
+    _, _, cookie = roundtrip(async_app, change=set_value('k1', 'v1'))
+    _, _, new_cookie = roundtrip(async_app, cookie, set_value('k1', 'v1'))
+    assert new_cookie is None
+
+
+def test_regenerate(async_app, async_store):
+    _, _, cookie = roundtrip(async_app, change=set_value('k1', 'v1'))
+    old = list(async_store.d)
+
+    session, _, new_cookie = roundtrip(async_app, cookie,
+                                       lambda s: s.regenerate())
+    assert new_cookie != cookie
+    assert list(async_store.d) == [session.sid_s]
+    assert session.sid_s not in old
+    assert session.pending_deletes == []
+
+    _, opened, _ = roundtrip(async_app, new_cookie)
+    assert opened == {'k1': 'v1'}
+
+
+def test_destroy(async_app, async_store):
+    _, _, cookie = roundtrip(async_app, change=set_value('k1', 'v1'))
+    roundtrip(async_app, cookie, lambda s: s.destroy())
+    assert async_store.d == {}
+
+    session, opened, _ = roundtrip(async_app, cookie)
+    assert opened == {}
+    assert session.new
+
+
+def test_missing_session(async_app, async_store):
+    _, _, cookie = roundtrip(async_app, change=set_value('k1', 'v1'))
+    async_store.d.clear()
+
+    session, opened, _ = roundtrip(async_app, cookie)
+    assert opened == {}
+    assert session.new
+
+
+def test_missing_cache(async_app, async_store):
+    async_app.config['SESSION_MISSING_CACHE_MAX_ENTRIES'] = 16
+    async_app.kvsession.init_app(async_app)
+
+    _, _, cookie = roundtrip(async_app, change=set_value('k1', 'v1'))
+    async_store.d.clear()
+
+    roundtrip(async_app, cookie)
+    roundtrip(async_app, cookie)
+    assert async_app.kvsession_missing_cache.stats() == {
+        'hits': 1, 'misses': 1, 'entries': 1}
+
+
+def test_executor_store():
+    store = DictStore()
+    app = AwaitingFlask(__name__)
+    app.config['SECRET_KEY'] = 'devkey'
+    AsyncKVSessionExtension(ExecutorStore(store, max_workers=2), app)
+
+    _, _, cookie = roundtrip(app, change=set_value('k1', 'v1'))
+    assert len(store.keys()) == 1
+
+    _, opened, _ = roundtrip(app, cookie)
+    assert opened == {'k1': 'v1'}
+    app.kvsession_store.close()
+
+
+def test_executor_store_keys():
+    store = DictStore()
+    for i in range(25):
+        store.put('key%02d' % i, b'')
+    async_store = ExecutorStore(store, batch_size=10)
+
+    async def collect():
+        return [key async for key in async_store.iter_keys('key1')]
+
+    assert sorted(asyncio.run(collect())) == ['key%02d' % i
+                                              for i in range(10, 20)]
+    async_store.close()
+
+
+@pytest.mark.parametrize('make_store', [
+    AsyncDictStore,
+    lambda: ExecutorStore(DictStore()),
+])
+def test_cleanup(make_store):
+    store = make_store()
+    regex = AsyncKVSessionExtension.key_regex
+    now = int(time.time())
+
+    async def fill():
+        for i in range(50):
+            await store.put('%x_%x' % (i + 1, now - 100), b'old')
+            await store.put('%x_%x' % (i + 100, now), b'new')
+        await store.put('not_a_session', b'other')
+
+    async def keys():
+        return sorted([key async for key in store.iter_keys()])
+
+    asyncio.run(fill())
+    result = asyncio.run(cleanup_store(store, 50, regex, now=now,
+                                       batch_size=7, concurrency=2))
+    assert (result.scanned, result.deleted) == (101, 50)
+
+    remaining = asyncio.run(keys())
+    assert len(remaining) == 51
+    assert 'not_a_session' in remaining
+
+
+def test_cleanup_sessions(async_app, async_store):
+    async_app.permanent_session_lifetime = timedelta(seconds=1)
+    roundtrip(async_app, change=set_value('k1', 'v1'))
+
+    result = asyncio.run(async_app.kvsession.cleanup_sessions(async_app))
+    assert result.deleted == 0
+
+    async_app.permanent_session_lifetime = timedelta(seconds=-10)
+    result = asyncio.run(async_app.kvsession.cleanup_sessions())
+    assert result.deleted == 1
+    assert async_store.d == {}
+
+
+def test_unsupported(async_store):
+    app = AwaitingFlask(__name__)
+    app.config['SESSION_LAZY_LOAD'] = True
+    with pytest.raises(ValueError):
+        AsyncKVSessionExtension(async_store, app)
+
+    with pytest.raises(ValueError):
+        AsyncKVSessionExtension(DictHashStore(), AwaitingFlask(__name__))
+
+
+def test_synchronous_app_rejected(async_store):
+    with pytest.raises(ValueError):
+        AsyncKVSessionExtension(async_store, Flask(__name__))
+
+
+def add_routes(app, session):
+    @app.route('/store/<key>/<value>/')
+    async def store(key, value):
+        session[key] = value
+        return 'ok'
+
+    @app.route('/dump/')
+    async def dump():
+        return dict(session)
+
+
+def test_requests(async_app, async_store):
+    @async_app.route('/store/<key>/<value>/')
+    def store(key, value):
+        session[key] = value
+        return 'ok'
+
+    @async_app.route('/dump/')
+    def dump():
+        return dict(session)
+
+    cookie = cookie_of(async_app.get('/store/k1/v1/'))
+    assert len(async_store.d) == 1
+
+    rv = async_app.get('/dump/', cookie)
+    assert rv.get_json() == {'k1': 'v1'}
+    assert 'Set-Cookie' not in rv.headers
+
+
+def test_quart(async_store):
+    quart = pytest.importorskip('quart')
+
+    app = quart.Quart(__name__)
+    app.config['SECRET_KEY'] = 'devkey'
+    AsyncKVSessionExtension(async_store, app)
+    add_routes(app, quart.session)
+
+    async def run():
+        client = app.test_client()
+        await client.get('/store/k1/v1/')
+        rv = await client.get('/dump/')
+        return await rv.get_json()
+
+    assert asyncio.run(run()) == {'k1': 'v1'}
+    assert len(async_store.d) == 1
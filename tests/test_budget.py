@@ -0,0 +1,132 @@
+import json
+import logging
+
+from flask_kvsession.budget import SessionTooLarge, SizeBudget
+from flask_kvsession.hashstore import DictHashStore
+from flask_kvsession.metrics import MetricsCollector
+from simplekv.memory import DictStore
+import pytest
+
+
+@pytest.fixture
+def store():
+    return DictStore()
+
+
+def configure(app, **config):
+    app.config.update(config)
+    app.kvsession.init_app(app)
+
+
+def test_histogram(app, client):
+    client.get('/store-in-session/k1/value1/')
+    client.get('/store-in-session/k2/%s/' % ('x' * 2000))
+    client.get('/store-in-session/k2/%s/' % ('x' * 2000))
+
+    histogram = app.kvsession_size_budget.histogram
+    assert histogram.count == 2
+    assert histogram.cumulative()[:4] == [(64, 1), (256, 1), (1024, 1),
+                                          (4096, 2)]
+
+
+def test_soft_limit(app, client, caplog):
+    metrics = MetricsCollector()
+    configure(app, SESSION_SIZE_SOFT_LIMIT=1000, SESSION_METRICS=metrics)
+
+    client.get('/store-in-session/small/value/')
+    assert app.kvsession_size_budget.soft_exceeded == 0
+
+    with caplog.at_level(logging.WARNING, 'flask_kvsession.budget'):
+        client.get('/store-in-session/big/%s/' % ('x' * 2000))
+
+    assert app.kvsession_size_budget.soft_exceeded == 1
+    assert metrics.events['size_soft_limit'] == 1
+    message = caplog.records[-1].getMessage()
+    assert 'big (' in message
+    assert message.index('big') < message.index('small')
+
+    # the session is written regardless
+    assert 'big' in json.loads(client.get('/dump-session/').data.decode())
+
+
+def test_hard_limit_raises(app, client):
+    configure(app, SESSION_SIZE_HARD_LIMIT=1000)
+
+    client.get('/store-in-session/small/value/')
+    with pytest.raises(SessionTooLarge) as e:
+        client.get('/store-in-session/big/%s/' % ('x' * 2000))
+
+    assert e.value.limit == 1000
+    assert e.value.largest[0][0] == 'big'
+    assert app.kvsession_size_budget.hard_exceeded == 1
+
+
+def test_hard_limit_truncates(app, client):
+    configure(app, SESSION_SIZE_HARD_LIMIT=1000,
+              SESSION_SIZE_LIMIT_POLICY='truncate')
+
+    client.get('/store-in-session/small/value/')
+    client.get('/store-in-session/big/%s/' % ('x' * 2000))
+
+    assert json.loads(client.get('/dump-session/').data.decode()) == {
+        'small': 'value'}
+    stored, = app.kvsession_store.d.values()
+    assert len(stored) <= 1000
+    assert app.kvsession_size_budget.histogram.sum < 2 * 1000
+
+
+def test_hash_store_truncates(app, client):
+    store = DictHashStore()
+    app.config['SESSION_SIZE_HARD_LIMIT'] = 1000
+    app.config['SESSION_SIZE_LIMIT_POLICY'] = 'truncate'
+    app.kvsession.init_app(app, store)
+
+    client.get('/store-in-session/big/%s/' % ('x' * 900))
+    client.get('/store-in-session/small/value/')
+    client.get('/store-in-session/other/%s/' % ('y' * 500))
+
+    fields, = store.d.values()
+    assert sorted(fields) == ['other', 'small']
+    assert json.loads(client.get('/dump-session/').data.decode()) == {
+        'small': 'value', 'other': 'y' * 500}
+
+
+def test_private_keys_kept():
+    budget = SizeBudget(hard_limit=100, policy='truncate')
+    session = {'_user': 'x' * 200, 'a': 'b'}
+
+    with pytest.raises(SessionTooLarge):
+        budget.check(session, 210, lambda: {'_user': 205, 'a': 5})
+    assert '_user' in session
+
+
+def test_non_string_keys():
+    budget = SizeBudget(hard_limit=100, policy='truncate')
+    session = {1: 'x' * 200, '_user': 'a', (2, 3): 'b'}
+
+    assert budget.check(session, 215, lambda: {
+        1: 205, '_user': 5, (2, 3): 5}) == [1]
+    assert sorted(session, key=str) == [(2, 3), '_user']
+
+
+def test_truncate_reports_once(app, client, caplog):
+    metrics = MetricsCollector()
+    configure(app, SESSION_SIZE_SOFT_LIMIT=500, SESSION_SIZE_HARD_LIMIT=1000,
+              SESSION_SIZE_LIMIT_POLICY='truncate', SESSION_METRICS=metrics)
+
+    client.get('/store-in-session/medium/%s/' % ('x' * 600))
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, 'flask_kvsession.budget'):
+        client.get('/store-in-session/big/%s/' % ('y' * 2000))
+
+    budget = app.kvsession_size_budget
+    assert (budget.soft_exceeded, budget.hard_exceeded) == (2, 1)
+    assert metrics.events['size_soft_limit'] == 2
+    assert metrics.events['size_hard_limit'] == 1
+    assert len([r for r in caplog.records
+                if 'soft limit' in r.getMessage()]) == 1
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        SizeBudget(policy='ignore')
@@ -0,0 +1,256 @@
+import json
+
+from flask_kvsession.cache import MissingCache, SessionCache
+import pytest
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def cached_app(app):
+    app.config['SESSION_CACHE_MAX_ENTRIES'] = 16
+    app.kvsession.init_app(app)
+    return app
+
+
+@pytest.fixture
+def cached_client(cached_app):
+    return cached_app.test_client()
+
+
+def test_cache_hit_and_miss():
+    cache = SessionCache(4)
+
+    assert cache.get('a') is None
+    cache.put('a', {'k': 'v'}, 10)
+
+    assert cache.get('a') == {'k': 'v'}
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'entries': 1,
+                             'bytes': 10}
+
+
+def test_update_fields():
+    cache = SessionCache(4, max_bytes=100)
+    cache.put('a', {'k1': b'1', 'k2': b'2'}, 2, 'old')
+    cache.update_fields('a', {'k1': b'changed'}, ['k2'], 7, 'new')
+
+    assert cache.lookup('a') == ({'k1': b'changed'}, 'new')
+    assert cache.size == 7
+
+    # sessions not cached are not added
+    cache.update_fields('b', {'k1': b'1'}, [], 1)
+    assert 'b' not in cache
+
+
+def test_cache_holds_payloads(store, cached_app, cached_client):
+    cached_client.get('/store-in-session/k1/value1/')
+    sid_s = list(store.keys())[0]
+
+    data, _ = cached_app.kvsession_cache.lookup(sid_s)
+    assert isinstance(data, bytes)
+    assert cached_app.session_interface.serialization_method.loads(data) == {
+        'k1': 'value1'}
+
+
+def test_hash_store_cache_written_through(cached_app, cached_client):
+    from flask_kvsession.hashstore import DictHashStore
+
+    store = DictHashStore()
+    cached_app.kvsession_store = store
+    cached_client.get('/store-in-session/k1/value1/')
+    cached_client.get('/store-in-session/k2/value2/')
+    cached_client.get('/delete-from-session/k1/')
+
+    sid_s = list(store.keys())[0]
+    data, _ = cached_app.kvsession_cache.lookup(sid_s)
+    assert data == store.get_fields(sid_s)
+
+    rv = cached_client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k2': 'value2'}
+
+
+def test_in_place_change_not_cached(store, cached_app, cached_client):
+    from flask import session
+
+    @cached_app.route('/cart/<int:item>/')
+    def add_to_cart(item):
+        session.setdefault('cart', []).append(item)
+        return 'ok'
+
+    @cached_app.route('/touch-cart/<int:item>/')
+    def touch_cart(item):
+        # changed in place, but not marked as modified
+        session['cart'].append(item)
+        return 'ok'
+
+    cached_client.get('/cart/1/')
+    cached_client.get('/touch-cart/2/')
+
+    rv = cached_client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'cart': [1]}
+    assert cached_app.kvsession_cache.hits == 2
+
+
+def test_cache_lru_eviction_by_entries():
+    cache = SessionCache(2)
+    cache.put('a', {}, 1)
+    cache.put('b', {}, 1)
+
+    # touch a, b is now least recently used
+    cache.get('a')
+    cache.put('c', {}, 1)
+
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+
+
+def test_cache_eviction_by_bytes():
+    cache = SessionCache(10, max_bytes=100)
+    cache.put('a', {}, 60)
+    cache.put('b', {}, 30)
+    cache.put('c', {}, 30)
+
+    assert 'a' not in cache
+    assert cache.size == 60
+
+    # entries larger than the whole cache are never stored
+    cache.put('d', {}, 101)
+    assert 'd' not in cache
+
+
+def test_cache_ttl():
+    clock = FakeClock()
+    cache = SessionCache(10, ttl=5, clock=clock)
+    cache.put('a', {}, 1)
+
+    clock.now += 4
+    assert cache.get('a') == {}
+
+    clock.now += 2
+    assert cache.get('a') is None
+    assert cache.size == 0
+
+
+def test_cached_session_skips_store(store, cached_app, cached_client):
+    cached_client.get('/store-in-session/k1/value1/')
+    cache = cached_app.kvsession_cache
+
+    # the store is not consulted on a hit, remove data behind its back
+    sid_s = list(store.keys())[0]
+    assert sid_s in cache
+    store.put(sid_s, cached_app.session_interface.serialization_method.dumps(
+        {'k1': 'stale'}))
+
+    rv = cached_client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'value1'}
+    assert cache.hits == 1
+
+
+def test_cache_invalidated_on_destroy(store, cached_app, cached_client):
+    cached_client.get('/store-in-session/k1/value1/')
+    cached_client.get('/destroy-session/')
+
+    assert len(cached_app.kvsession_cache) == 0
+    assert not list(store.keys())
+
+
+def test_cache_invalidated_on_regenerate(store, cached_app, cached_client):
+    cached_client.get('/store-in-session/k1/value1/')
+    old_sid = list(store.keys())[0]
+
+    cached_client.get('/regenerate-session/')
+    new_sid = list(store.keys())[0]
+
+    assert old_sid not in cached_app.kvsession_cache
+    assert new_sid in cached_app.kvsession_cache
+
+    rv = cached_client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'value1'}
+
+
+def test_cache_disabled_by_default(app):
+    assert app.kvsession_cache is None
+
+
+@pytest.fixture
+def missing_app(app):
+    app.config['SESSION_MISSING_CACHE_MAX_ENTRIES'] = 16
+    app.kvsession.init_app(app)
+    return app
+
+
+def test_missing_cache():
+    clock = FakeClock()
+    cache = MissingCache(2, ttl=5, clock=clock)
+
+    assert not cache.is_missing('a')
+    cache.add('a')
+    assert cache.is_missing('a')
+
+    cache.add('b')
+    cache.add('c')
+    assert 'a' not in cache
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'entries': 2}
+
+    cache.invalidate('b')
+    assert not cache.is_missing('b')
+
+    clock.now += 6
+    assert not cache.is_missing('c')
+    assert len(cache) == 0
+
+
+def test_missing_session_skips_store(store, missing_app, client):
+    client.get('/store-in-session/k1/value1/')
+    sid_s = list(store.keys())[0]
+    store.delete(sid_s)
+
+    gets = []
+    get = store.get
+
+    def counting_get(key):
+        gets.append(key)
+        return get(key)
+
+    store.get = counting_get
+
+    for _ in range(3):
+        rv = client.get('/dump-session/')
+        assert json.loads(rv.data.decode('ascii')) == {}
+
+    assert gets == [sid_s]
+    assert missing_app.kvsession_missing_cache.hits == 2
+
+
+def test_missing_after_destroy(store, missing_app, client):
+    client.get('/store-in-session/k1/value1/')
+    sid_s = list(store.keys())[0]
+    client.get('/destroy-session/')
+
+    assert sid_s in missing_app.kvsession_missing_cache
+
+
+def test_missing_invalidated_on_write(missing_app):
+    interface = missing_app.session_interface
+    cache = missing_app.kvsession_missing_cache
+
+    with missing_app.test_request_context():
+        session = interface.session_class({'k1': 'value1'})
+        session.sid_s = '1234567890abcdef_5f5e1000'
+        cache.add(session.sid_s)
+
+        interface.store_session_data(missing_app, session)
+        assert session.sid_s not in cache
+        assert interface.load_session_data(
+            missing_app, session.sid_s)[0] == {'k1': 'value1'}
+
+
+def test_missing_cache_disabled_by_default(app):
+    assert app.kvsession_missing_cache is None
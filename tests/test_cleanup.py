@@ -0,0 +1,131 @@
+from datetime import timedelta
+import re
+import time
+
+from flask_kvsession import KVSessionExtension, SessionID
+from flask_kvsession.cleanup import cleanup_store, RateLimiter
+from simplekv.memory import DictStore
+import pytest
+
+
+KEY_REGEX = KVSessionExtension.key_regex
+NOW = 1400000000
+
+
+class BulkDictStore(DictStore):
+    def __init__(self):
+        super(BulkDictStore, self).__init__()
+        self.bulk_deletes = []
+
+    def delete_many(self, keys):
+        self.bulk_deletes.append(list(keys))
+        for key in keys:
+            self.delete(key)
+
+
+def fill(store, n_expired, n_valid):
+    for i in range(n_expired):
+        store.put('%x_%x' % (i, NOW - 7200), b'x')
+    for i in range(n_valid):
+        store.put('%x_%x' % (n_expired + i, NOW - 60), b'x')
+    store.put('not_a_session', b'x')
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_cleanup_removes_expired(workers):
+    store = DictStore()
+    fill(store, 250, 100)
+
+    result = cleanup_store(store, 3600, KEY_REGEX, now=NOW, batch_size=16,
+                           workers=workers)
+
+    assert result.scanned == 351
+    assert result.deleted == 250
+    assert result.elapsed >= 0
+    assert len(list(store.keys())) == 101
+    assert 'not_a_session' in store
+
+
+def test_cleanup_uses_bulk_delete():
+    store = BulkDictStore()
+    fill(store, 25, 5)
+
+    cleanup_store(store, 3600, KEY_REGEX, now=NOW, batch_size=10)
+
+    assert sum(len(b) for b in store.bulk_deletes) == 25
+    assert all(len(b) <= 10 for b in store.bulk_deletes)
+
+
+def test_cleanup_errors_propagate():
+    class BrokenStore(DictStore):
+        def delete(self, key):
+            raise IOError('backend gone')
+
+    store = BrokenStore()
+    fill(store, 50, 0)
+
+    with pytest.raises(IOError):
+        cleanup_store(store, 3600, KEY_REGEX, now=NOW, batch_size=5,
+                      workers=3)
+
+
+def test_rate_limiter():
+    clock = [0.0]
+    slept = []
+
+    def sleep(t):
+        slept.append(t)
+        clock[0] += t
+
+    limiter = RateLimiter(100, clock=lambda: clock[0], sleep=sleep)
+    limiter.acquire(50)
+    limiter.acquire(50)
+    limiter.acquire(50)
+
+    assert slept == [0.5, 0.5]
+
+
+def test_extension_returns_summary(app, client, store):
+    from datetime import timedelta
+    app.permanent_session_lifetime = timedelta(seconds=1)
+
+    client.get('/store-in-session/k1/value1/')
+    result = app.kvsession.cleanup_sessions(app)
+    assert (result.scanned, result.deleted) == (1, 0)
+
+    time.sleep(2)
+    result = app.kvsession.cleanup_sessions(app, batch_size=1, workers=2)
+    assert (result.scanned, result.deleted) == (1, 1)
+
+
+def test_key_regex_unchanged():
+    assert KEY_REGEX.match('ab_12')
+    assert not KEY_REGEX.match('not_a_session')
+    assert isinstance(KEY_REGEX, type(re.compile('')))
+
+
+def test_foreign_compact_lookalikes_kept():
+    store = DictStore()
+    for key in ['zip_Lookup', 'zone_metadata', 'zone_settings',
+                'zzzzzzzzzzzzzzzzzzzz']:
+        store.put(key, b'x')
+    store.put(SessionID(1, NOW - 7200).serialize(compact=True), b'x')
+
+    result = cleanup_store(store, 3600, KEY_REGEX, now=NOW)
+    assert result.deleted == 1
+    assert sorted(store.keys()) == ['zip_Lookup', 'zone_metadata',
+                                    'zone_settings', 'zzzzzzzzzzzzzzzzzzzz']
+
+
+def test_key_bits(app, client):
+    app.config['SESSION_KEY_FORMAT'] = 'compact'
+    app.config['SESSION_KEY_BITS'] = 128
+    app.kvsession.init_app(app)
+
+    client.get('/store-in-session/k1/value1/')
+    sid_s, = app.kvsession_store.keys()
+    assert not KEY_REGEX.match(sid_s)
+    assert app.kvsession_key_regex.match(sid_s)
+
+    app.permanent_session_lifetime = timedelta(seconds=-10)
+    assert app.kvsession.cleanup_sessions(app).deleted == 1
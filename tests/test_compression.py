@@ -0,0 +1,103 @@
+import json
+import pickle
+
+from flask_kvsession.compression import (compressors, decompress_payload,
+                                         PayloadCompression, ZlibCompressor)
+from flask_kvsession.serializers import dump_payload, load_payload, serializers
+import pytest
+
+
+LARGE = {'cart': ['item-%d' % i for i in range(500)]}
+
+
+@pytest.fixture(params=sorted(compressors))
+def compression(request):
+    return PayloadCompression(compressors[request.param], threshold=100)
+
+
+@pytest.fixture
+def compressed_app(app):
+    app.config['SESSION_COMPRESSION'] = 'zlib'
+    app.config['SESSION_COMPRESSION_THRESHOLD'] = 100
+    app.kvsession.init_app(app)
+    return app
+
+
+@pytest.fixture
+def compressed_client(compressed_app):
+    return compressed_app.test_client()
+
+
+def test_roundtrip(compression):
+    payload = dump_payload(serializers['pickle'], LARGE)
+    compressed = compression.compress(payload)
+
+    assert len(compressed) < len(payload)
+    assert compressed[:1] != payload[:1]
+    assert decompress_payload(compressed) == payload
+    assert compression.decompress(compressed) == payload
+    assert load_payload(decompress_payload(compressed)) == LARGE
+
+
+def test_below_threshold_not_compressed(compression):
+    payload = dump_payload(serializers['pickle'], {'k': 'v'})
+    assert compression.compress(payload) == payload
+    assert compression.stats()['compressed'] == 0
+
+
+def test_incompressible_stored_raw():
+    compression = PayloadCompression(ZlibCompressor(), threshold=0)
+    payload = dump_payload(serializers['pickle'], {'k': 'v'})
+
+    assert compression.compress(payload) == payload
+    assert compression.compress_time > 0
+
+
+def test_counters(compression):
+    payload = dump_payload(serializers['json'], LARGE)
+    compressed = compression.compress(payload)
+    compression.decompress(compressed)
+
+    stats = compression.stats()
+    assert stats['compressed'] == 1
+    assert stats['decompressed'] == 1
+    assert stats['bytes_saved'] == len(payload) - len(compressed)
+
+
+def test_legacy_payload_unchanged():
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        legacy = pickle.dumps(LARGE, protocol)
+        assert decompress_payload(legacy) is legacy
+
+
+def test_app_compresses_large_sessions(store, compressed_app,
+                                       compressed_client):
+    compressed_client.get('/store-in-session/k1/%s/' % ('x' * 500))
+    stored = store.get(list(store.keys())[0])
+
+    assert len(stored) < 500
+    assert compressed_app.kvsession_compression.bytes_saved > 0
+
+    rv = compressed_client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'x' * 500}
+
+
+def test_uncompressed_sessions_stay_readable(app, client):
+    client.get('/store-in-session/k1/%s/' % ('x' * 500))
+
+    app.config['SESSION_COMPRESSION'] = 'zlib'
+    app.kvsession.init_app(app)
+
+    rv = client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'x' * 500}
+
+
+def test_compressed_sessions_readable_after_disabling(store, compressed_app,
+                                                      compressed_client):
+    compressed_client.get('/store-in-session/k1/%s/' % ('x' * 500))
+
+    compressed_app.config['SESSION_COMPRESSION'] = None
+    compressed_app.kvsession.init_app(compressed_app)
+
+    rv = compressed_client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'x' * 500}
@@ -0,0 +1,149 @@
+from datetime import timedelta
+import json
+
+from flask import session
+from flask_kvsession.cookie import (cookie_timestamp, decode_cookie_value,
+                                    encode_cookie_value, is_cookie_value)
+from itsdangerous import Signer
+from simplekv.memory import DictStore
+import pytest
+
+
+@pytest.fixture
+def store():
+    return DictStore()
+
+
+@pytest.fixture
+def hybrid_app(app):
+    app.config['SESSION_COOKIE_THRESHOLD'] = 40
+    app.kvsession.init_app(app)
+
+    @app.route('/login/<name>/')
+    def login(name):
+        session.regenerate()
+        session['user'] = name
+        return 'ok'
+
+    @app.route('/store-object/')
+    def store_object():
+        session['numbers'] = set([1, 2])
+        return 'ok'
+
+    return app
+
+
+def dump(client):
+    return json.loads(client.get('/dump-session/').data.decode('ascii'))
+
+
+def cookie_value(client):
+    cookie = client.get_session_cookie()
+    return Signer('devkey').unsign(cookie.value).decode('ascii')
+
+
+def test_encode_decode():
+    value = encode_cookie_value(b'{"k":"v"}', 0x5f5e1000)
+
+    assert is_cookie_value(value)
+    assert not is_cookie_value('1234567890abcdef_5f5e1000')
+    assert cookie_timestamp(value) == 0x5f5e1000
+    assert decode_cookie_value(value) == (b'{"k":"v"}', 0x5f5e1000)
+
+    with pytest.raises(ValueError):
+        decode_cookie_value('1234567890abcdef_5f5e1000')
+
+
+def test_small_session_in_cookie(store, hybrid_app, client):
+    client.get('/store-in-session/k1/value1/')
+
+    assert store.keys() == []
+    assert is_cookie_value(cookie_value(client))
+    assert dump(client) == {'k1': 'value1'}
+
+
+def test_skip_unchanged(store, hybrid_app, client):
+    client.get('/store-in-session/k1/value1/')
+
+    rv = client.get('/store-in-session/k1/value1/')
+    assert 'Set-Cookie' not in rv.headers
+
+
+def test_spill_to_store(store, hybrid_app, client):
+    client.get('/store-in-session/k1/value1/')
+
+    client.get('/store-in-session/k2/%s/' % ('x' * 40))
+    assert len(store.keys()) == 1
+    assert cookie_value(client) == store.keys()[0]
+    assert dump(client) == {'k1': 'value1', 'k2': 'x' * 40}
+
+    # shrinking moves the session back into the cookie
+    client.get('/delete-from-session/k2/')
+    assert store.keys() == []
+    assert dump(client) == {'k1': 'value1'}
+
+
+def test_not_json_serializable(store, hybrid_app, client):
+    client.get('/store-object/')
+    assert len(store.keys()) == 1
+
+
+def test_destroy(store, hybrid_app, client):
+    client.get('/store-in-session/k1/value1/')
+
+    rv = client.get('/destroy-session/')
+    assert 'session=;' in rv.headers['Set-Cookie']
+    assert dump(client) == {}
+
+
+def test_destroy_stored(store, hybrid_app, client):
+    client.get('/store-in-session/k1/%s/' % ('x' * 40))
+    client.get('/destroy-session/')
+
+    assert store.keys() == []
+    assert dump(client) == {}
+
+
+def test_regenerate(store, hybrid_app, client):
+    client.get('/store-in-session/k1/value1/')
+    old = cookie_value(client)
+
+    client.get('/login/alice/')
+    new = cookie_value(client)
+    assert is_cookie_value(new)
+    assert new != old
+    assert dump(client) == {'k1': 'value1', 'user': 'alice'}
+
+
+def test_regenerate_stored(store, hybrid_app, client):
+    client.get('/store-in-session/k1/%s/' % ('x' * 40))
+    old = store.keys()[0]
+
+    client.get('/regenerate-session/')
+    assert len(store.keys()) == 1
+    assert store.keys()[0] != old
+    assert dump(client) == {'k1': 'x' * 40}
+
+
+def test_expiration(store, hybrid_app, client):
+    hybrid_app.permanent_session_lifetime = timedelta(seconds=-1)
+    client.get('/store-in-session/k1/value1/')
+
+    assert dump(client) == {}
+
+
+def test_sliding_expiration(store, hybrid_app, client):
+    hybrid_app.config['SESSION_SLIDING_EXPIRATION'] = True
+    hybrid_app.config['SESSION_REFRESH_INTERVAL'] = 0
+    client.get('/store-in-session/k1/value1/')
+
+    rv = client.get('/dump-session/')
+    assert 'Set-Cookie' in rv.headers
+    assert ':' in cookie_value(client)
+    assert dump(client) == {'k1': 'value1'}
+    assert store.keys() == []
+
+
+def test_disabled_by_default(store, app, client):
+    client.get('/store-in-session/k1/value1/')
+    assert len(store.keys()) == 1
@@ -0,0 +1,181 @@
+from datetime import timedelta
+
+from flask_kvsession.expiryindex import ExpiryIndex
+from flask_kvsession.hashstore import DictHashStore
+from simplekv.memory import DictStore
+import pytest
+
+
+NOW = 1400000000
+
+
+class NoScanDictStore(DictStore):
+    def __init__(self):
+        super(NoScanDictStore, self).__init__()
+        self.puts = []
+        self.listings = 0
+
+    def put(self, key, data, *args):
+        self.puts.append((key, data))
+        return super(NoScanDictStore, self).put(key, data, *args)
+
+    def iter_keys(self, prefix=u''):
+        # markers are listed by the prefix of their bucket
+        if not prefix.startswith('kvsession_index_'):
+            raise AssertionError('index cleanup must not enumerate sessions')
+        self.listings += 1
+        return super(NoScanDictStore, self).iter_keys(prefix)
+
+
+class NoScanDictHashStore(DictHashStore):
+    def iter_keys(self, prefix=u''):
+        raise AssertionError('index cleanup must not enumerate keys')
+
+
+@pytest.fixture(params=['blob', 'hash'])
+def index_store(request):
+    if request.param == 'blob':
+        return NoScanDictStore()
+    return NoScanDictHashStore()
+
+
+def add_session(store, index, id, created):
+    sid_s = '%x_%x' % (id, created)
+    store.put(sid_s, b'data')
+    index.add(store, sid_s)
+    return sid_s
+
+
+def test_expire_drops_old_buckets(index_store):
+    index = ExpiryIndex(60)
+
+    old = [add_session(index_store, index, i, NOW - 7200 + i)
+           for i in range(10)]
+    young = [add_session(index_store, index, 100 + i, NOW - 60)
+             for i in range(5)]
+
+    result = index.expire(index_store, 3600, now=NOW)
+
+    assert result.deleted == 10
+    assert result.scanned == 10
+    for sid_s in old:
+        assert sid_s not in index_store
+    for sid_s in young:
+        assert sid_s in index_store
+
+    # running again does not visit the dropped buckets
+    assert index.expire(index_store, 3600, now=NOW).scanned == 0
+
+
+def test_expire_lists_markers_once():
+    store = NoScanDictStore()
+    index = ExpiryIndex(60)
+    # spread over many buckets
+    for i in range(90):
+        add_session(store, index, i + 1, NOW - 86400 + i * 600)
+    for i in range(10):
+        add_session(store, index, i + 100, NOW)
+
+    result = index.expire(store, 3600, now=NOW)
+    assert result.deleted == 90
+    assert store.listings == 1
+
+
+def test_destroyed_not_counted(index_store):
+    index = ExpiryIndex(60)
+    a = add_session(index_store, index, 1, NOW - 7200)
+    add_session(index_store, index, 2, NOW - 7200)
+
+    # as when destroyed, the marker of a blob store stays
+    index_store.delete(a)
+
+    result = index.expire(index_store, 3600, now=NOW)
+    assert (result.scanned, result.deleted) == (2, 1)
+
+
+def test_remove(index_store):
+    index = ExpiryIndex(60)
+    a = add_session(index_store, index, 1, NOW - 7200)
+    b = add_session(index_store, index, 2, NOW - 7200)
+
+    index.remove(index_store, a)
+    index_store.delete(a)
+
+    index.expire(index_store, 3600, now=NOW)
+    assert b not in index_store
+    assert index._read_bucket(index_store, index.bucket_of(b)) == []
+
+
+def test_add_writes_marker_only():
+    store = NoScanDictStore()
+    index = ExpiryIndex(3600)
+    for i in range(100):
+        index.add(store, '%x_%x' % (i + 1, NOW))
+
+    # a single small write per session, the bucket is never read back
+    markers = [key for key, _ in store.puts if key != index.head_key]
+    assert len(markers) == 100
+    assert all(data == b'' for key, data in store.puts
+               if key != index.head_key)
+
+
+def test_head_tracks_oldest_bucket(index_store):
+    index = ExpiryIndex(60)
+    add_session(index_store, index, 1, NOW)
+    add_session(index_store, ExpiryIndex(60), 2, NOW - 600)
+
+    assert index._read_head(index_store) == (NOW - 600) // 60
+
+
+@pytest.fixture
+def indexed_app(app):
+    app.config['SESSION_EXPIRY_INDEX'] = True
+    app.config['SESSION_EXPIRY_INDEX_BUCKET'] = 60
+    app.kvsession.init_app(app)
+    return app
+
+
+def session_keys(store):
+    return [k for k in store.keys() if not k.startswith('kvsession_index_')]
+
+
+def bucket_contents(app, store, sid_s):
+    index = app.kvsession_expiry_index
+    return index._read_bucket(store, index.bucket_of(sid_s))
+
+
+def test_app_maintains_index(store, indexed_app, client):
+    client.get('/store-in-session/k1/value1/')
+    sid_s = session_keys(store)[0]
+    assert bucket_contents(indexed_app, store, sid_s) == [sid_s]
+
+    # changing an existing session does not add it again
+    client.get('/store-in-session/k2/value2/')
+    assert bucket_contents(indexed_app, store, sid_s) == [sid_s]
+
+    client.get('/regenerate-session/')
+    new_sid_s = session_keys(store)[0]
+    assert new_sid_s in bucket_contents(indexed_app, store, new_sid_s)
+
+    # the marker of a destroyed session stays until its bucket expires
+    client.get('/destroy-session/')
+    assert session_keys(store) == []
+
+    indexed_app.permanent_session_lifetime = timedelta(seconds=-120)
+    indexed_app.kvsession.cleanup_sessions(indexed_app)
+    assert bucket_contents(indexed_app, store, new_sid_s) == []
+
+
+def test_cleanup_uses_index(store, indexed_app, client):
+    client.get('/store-in-session/k1/value1/')
+    sid_s = session_keys(store)[0]
+
+    result = indexed_app.kvsession.cleanup_sessions(indexed_app)
+    assert result.deleted == 0
+    assert sid_s in store
+
+    # makes the whole bucket of the session appear expired
+    indexed_app.permanent_session_lifetime = timedelta(seconds=-120)
+    result = indexed_app.kvsession.cleanup_sessions(indexed_app)
+    assert result.deleted == 1
+    assert sid_s not in store
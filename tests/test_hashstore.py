@@ -0,0 +1,161 @@
+import json
+
+from flask_kvsession.hashstore import DictHashStore
+from flask_kvsession.serializers import load_payload
+import pytest
+
+
+class RecordingHashStore(DictHashStore):
+    def __init__(self):
+        super(RecordingHashStore, self).__init__()
+        self.calls = []
+
+    def put_fields(self, key, fields, ttl_secs=None):
+        self.calls.append(('put', dict(fields), ()))
+        return super(RecordingHashStore, self).put_fields(key, fields,
+                                                          ttl_secs)
+
+    def update_fields(self, key, fields, deleted=(), ttl_secs=None):
+        self.calls.append(('update', dict(fields), tuple(deleted)))
+        return super(RecordingHashStore, self).update_fields(
+            key, fields, deleted, ttl_secs)
+
+
+@pytest.fixture
+def store():
+    return RecordingHashStore()
+
+
+def dump(client):
+    return json.loads(client.get('/dump-session/').data.decode('ascii'))
+
+
+def test_session_stored_as_fields(store, client):
+    client.get('/store-in-session/k1/value1/')
+    client.get('/store-in-session/k2/value2/')
+
+    fields = store.get_fields(list(store.keys())[0])
+    assert sorted(fields) == ['k1', 'k2']
+    assert load_payload(fields['k2']) == 'value2'
+
+    assert dump(client) == {'k1': 'value1', 'k2': 'value2'}
+
+
+def test_only_changed_fields_written(store, client):
+    client.get('/store-in-session/k1/value1/')
+    client.get('/store-in-session/k2/value2/')
+    client.get('/store-in-session/k1/changed/')
+
+    assert [c[0] for c in store.calls] == ['put', 'update', 'update']
+    assert list(store.calls[2][1]) == ['k1']
+
+    assert dump(client) == {'k1': 'changed', 'k2': 'value2'}
+
+
+def test_deleted_fields_removed(store, client):
+    client.get('/store-in-session/k1/value1/')
+    client.get('/store-in-session/k2/value2/')
+    client.get('/delete-from-session/k1/')
+
+    assert store.calls[-1] == ('update', {}, ('k1',))
+    assert dump(client) == {'k2': 'value2'}
+
+
+def test_unchanged_fields_not_written(store, client):
+    client.get('/store-in-session/k1/value1/')
+    rv = client.get('/store-in-session/k1/value1/')
+
+    assert len(store.calls) == 1
+    assert 'Set-Cookie' not in rv.headers
+
+
+def test_regenerate_writes_all_fields(store, client):
+    client.get('/store-in-session/k1/value1/')
+    client.get('/store-in-session/k2/value2/')
+    client.get('/regenerate-session/')
+
+    assert store.calls[-1][0] == 'put'
+    assert sorted(store.calls[-1][1]) == ['k1', 'k2']
+    assert len(list(store.keys())) == 1
+
+
+def test_destroy(store, client):
+    client.get('/store-in-session/k1/value1/')
+    client.get('/destroy-session/')
+
+    assert not list(store.keys())
+    assert dump(client) == {}
+
+
+@pytest.mark.parametrize('skip_unchanged', [True, False])
+def test_changed_in_place(store, app, client, skip_unchanged):
+    from flask import session
+
+    app.config['SESSION_SKIP_UNCHANGED'] = skip_unchanged
+
+    @app.route('/cart/<int:item>/')
+    def add_to_cart(item):
+        session.setdefault('cart', [])
+        session['cart'].append(item)
+        session.modified = True
+        return 'ok'
+
+    client.get('/cart/1/')
+    client.get('/cart/2/')
+
+    assert store.calls[-1][0] == 'update'
+    assert list(store.calls[-1][1]) == ['cart']
+    assert dump(client) == {'cart': [1, 2]}
+
+
+def test_dirty_keys_tracked():
+    from flask_kvsession import KVSession
+
+    s = KVSession({'a': 1, 'b': 2, 'c': 3})
+    assert not s.dirty_keys
+
+    s['d'] = 4
+    del s['a']
+    s.pop('b')
+    s.setdefault('c', 0)
+    s.update(e=5)
+    assert s.dirty_keys == set(['a', 'b', 'd', 'e'])
+
+    s.clear()
+    assert s.dirty_keys == set(['a', 'b', 'c', 'd', 'e'])
+
+
+def test_only_dirty_keys_serialized(store, app, client, monkeypatch):
+    import flask_kvsession
+
+    client.get('/store-in-session/k1/value1/')
+    client.get('/store-in-session/k2/value2/')
+
+    dumped = []
+    dump_payload = flask_kvsession.dump_payload
+
+    def recording_dump(serializer, value):
+        dumped.append(value)
+        return dump_payload(serializer, value)
+
+    monkeypatch.setattr(flask_kvsession, 'dump_payload', recording_dump)
+    client.get('/store-in-session/k1/changed/')
+
+    assert dumped == ['changed']
+    assert list(store.calls[-1][1]) == ['k1']
+
+
+def test_explicitly_modified():
+    from flask_kvsession import KVSession
+
+    s = KVSession({'a': 1})
+    s['b'] = 2
+    assert s.modified
+    assert not s.explicitly_modified
+
+    s.modified = True
+    assert s.explicitly_modified
+
+    s.modified = False
+    assert not s.modified
+    assert not s.explicitly_modified
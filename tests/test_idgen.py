@@ -0,0 +1,106 @@
+import os
+from threading import Thread
+
+from flask_kvsession.idgen import BufferedSystemRandom
+from simplekv.memory import DictStore
+import pytest
+
+
+@pytest.fixture
+def store():
+    return DictStore()
+
+
+def test_bits():
+    source = BufferedSystemRandom(buffer_size=64)
+    for k in (1, 7, 8, 9, 64, 128, 1000):
+        values = [source.getrandbits(k) for _ in range(50)]
+        assert all(0 <= v < 2 ** k for v in values)
+
+    # not all leading bits are zero
+    assert max(source.getrandbits(64) for _ in range(50)) >= 2 ** 60
+
+    with pytest.raises(ValueError):
+        source.getrandbits(0)
+
+
+def test_refill(monkeypatch):
+    reads = []
+
+    def urandom(n):
+        reads.append(n)
+        return b'\x01' * n
+
+    monkeypatch.setattr(os, 'urandom', urandom)
+    source = BufferedSystemRandom(buffer_size=20)
+
+    values = [source.getrandbits(64) for _ in range(5)]
+    assert values == [0x0101010101010101] * 5
+    assert reads == [16, 16, 16]
+
+    source.getrandbits(256)
+    assert reads == [16, 16, 16, 32]
+
+
+def test_unique():
+    source = BufferedSystemRandom(buffer_size=100)
+    values = [source.getrandbits(64) for _ in range(10000)]
+    assert len(set(values)) == len(values)
+
+
+def test_threads():
+    source = BufferedSystemRandom(buffer_size=100)
+    results = [[] for _ in range(8)]
+
+    def generate(result):
+        for _ in range(2000):
+            result.append(source.getrandbits(64))
+
+    threads = [Thread(target=generate, args=(r,)) for r in results]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    values = [v for r in results for v in r]
+    assert len(set(values)) == len(values) == 16000
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork()')
+def test_fork():
+    source = BufferedSystemRandom()
+    source.getrandbits(64)
+
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            data = ''.join('%016x' % source.getrandbits(64)
+                           for _ in range(100))
+            os.write(w, data.encode('ascii'))
+        finally:
+            os._exit(0)
+
+    os.close(w)
+    os.waitpid(pid, 0)
+    data = b''
+    while True:
+        chunk = os.read(r, 4096)
+        if not chunk:
+            break
+        data += chunk
+    os.close(r)
+
+    child = set(int(data[i:i + 16], 16) for i in range(0, len(data), 16))
+    parent = set(source.getrandbits(64) for _ in range(100))
+
+    assert len(child) == len(parent) == 100
+    assert not child & parent
+
+
+def test_default_source(app, client):
+    assert isinstance(app.config['SESSION_RANDOM_SOURCE'],
+                      BufferedSystemRandom)
+
+    client.get('/store-in-session/k1/value1/')
+    assert len(app.kvsession_store.keys()) == 1
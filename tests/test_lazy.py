@@ -0,0 +1,103 @@
+import json
+
+from flask import session
+from flask_kvsession import LazyKVSession
+from simplekv.memory import DictStore
+import pytest
+
+
+class CountingStore(DictStore):
+    def __init__(self):
+        super(CountingStore, self).__init__()
+        self.gets = 0
+
+    def get(self, key):
+        self.gets += 1
+        return super(CountingStore, self).get(key)
+
+
+@pytest.fixture
+def store():
+    return CountingStore()
+
+
+@pytest.fixture
+def lazy_app(app):
+    app.config['SESSION_LAZY_LOAD'] = True
+
+    @app.route('/health/')
+    def health():
+        return 'ok'
+
+    @app.route('/is-loaded/')
+    def is_loaded():
+        return str(session.loaded)
+
+    return app
+
+
+@pytest.fixture
+def lazy_client(lazy_app):
+    return lazy_app.test_client()
+
+
+def test_untouched_session_is_not_loaded(store, lazy_client):
+    lazy_client.get('/store-in-session/k1/value1/')
+    store.gets = 0
+
+    rv = lazy_client.get('/is-loaded/')
+    assert rv.data == b'False'
+
+    rv = lazy_client.get('/health/')
+    assert store.gets == 0
+    assert 'Set-Cookie' not in rv.headers
+
+
+def test_access_loads_session(store, lazy_client):
+    lazy_client.get('/store-in-session/k1/value1/')
+    store.gets = 0
+
+    rv = lazy_client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'value1'}
+    assert store.gets == 1
+
+
+def test_modifying_keeps_other_values(lazy_client):
+    lazy_client.get('/store-in-session/k1/value1/')
+    lazy_client.get('/store-in-session/k2/value2/')
+
+    rv = lazy_client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'value1',
+                                                   'k2': 'value2'}
+
+
+def test_regenerate_keeps_values(store, lazy_client):
+    lazy_client.get('/store-in-session/k1/value1/')
+    old_key = list(store.keys())[0]
+
+    lazy_client.get('/regenerate-session/')
+    assert list(store.keys()) != [old_key]
+
+    rv = lazy_client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'value1'}
+
+
+def test_destroy_does_not_load(store, lazy_client):
+    lazy_client.get('/store-in-session/k1/value1/')
+    store.gets = 0
+
+    lazy_client.get('/destroy-session/')
+    assert store.gets == 0
+    assert not list(store.keys())
+
+
+def test_missing_lazy_session_becomes_new():
+    s = LazyKVSession(lambda: {}['missing'])
+    s.sid_s = 'abc_123'
+
+    assert not s.loaded
+    assert dict(s) == {}
+    assert s.loaded
+    assert s.new
+    assert s.sid_s is None
+    assert not s.modified
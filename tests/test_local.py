@@ -0,0 +1,125 @@
+import json
+import os
+from threading import Thread
+
+from flask import Flask, session
+from flask_kvsession import KVSessionExtension
+from flask_kvsession.local import LocalStore
+from simplekv.memory import DictStore
+import pytest
+
+
+class ClosableStore(DictStore):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def created():
+    return []
+
+
+@pytest.fixture
+def factory(created):
+    def factory():
+        store = ClosableStore()
+        created.append(store)
+        return store
+    return factory
+
+
+def in_thread(func):
+    result = []
+    t = Thread(target=lambda: result.append(func()))
+    t.start()
+    t.join()
+    return result[0]
+
+
+def test_created_once_per_process(factory, created):
+    store = LocalStore(factory)
+    assert created == []
+
+    store.put('k', b'v')
+    assert in_thread(lambda: store.get('k')) == b'v'
+    assert len(created) == 1
+    assert store.store is created[0]
+
+
+def test_per_thread(factory, created):
+    store = LocalStore(factory, per_thread=True)
+
+    main = store.store
+    other = in_thread(lambda: store.store)
+    assert main is not other
+
+    # the store of the ended thread is reused
+    assert in_thread(lambda: store.store) is other
+    assert len(created) == 2
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork()')
+def test_new_store_after_fork(factory, created):
+    store = LocalStore(factory)
+    parent = store.store
+
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            ok = store.store is not parent and len(store.stores) == 1
+            os.write(w, b'1' if ok else b'0')
+        finally:
+            os._exit(0)
+
+    os.close(w)
+    os.waitpid(pid, 0)
+    assert os.read(r, 1) == b'1'
+    os.close(r)
+
+    assert store.store is parent
+    assert not parent.closed
+
+
+def test_close(factory, created):
+    store = LocalStore(factory, per_thread=True)
+    store.store
+    in_thread(lambda: store.store)
+
+    store.close()
+    assert [s.closed for s in created] == [True, True]
+
+    # used again after closing
+    assert store.store is created[2]
+
+
+def test_extension_with_factory(factory, created):
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'devkey'
+    app.config['SESSION_STORE_PER_THREAD'] = True
+    ext = KVSessionExtension(app=app, store_factory=factory)
+
+    @app.route('/store/')
+    def store():
+        session['k'] = 'v'
+        return 'ok'
+
+    @app.route('/dump/')
+    def dump():
+        return json.dumps(dict(session))
+
+    client = app.test_client()
+    client.get('/store/')
+    assert json.loads(client.get('/dump/').data.decode('ascii')) == {'k': 'v'}
+    assert isinstance(app.kvsession_store, LocalStore)
+    assert len(created[0].keys()) == 1
+
+    app.permanent_session_lifetime = -1
+    assert ext.cleanup_sessions(app).deleted == 1
+
+
+def test_factory_required():
+    with pytest.raises(ValueError):
+        KVSessionExtension().init_app(Flask(__name__))
@@ -0,0 +1,99 @@
+from flask_kvsession.hashstore import DictHashStore
+from flask_kvsession.metrics import Histogram, MetricsCollector
+from simplekv.memory import DictStore
+import pytest
+
+
+@pytest.fixture
+def store():
+    return DictStore()
+
+
+@pytest.fixture
+def metrics(app):
+    metrics = MetricsCollector()
+    app.config['SESSION_METRICS'] = metrics
+    app.kvsession.init_app(app)
+    return metrics
+
+
+def counts(metrics):
+    return dict((phase, h.count) for phase, h in metrics.latencies.items())
+
+
+def test_phases_observed(client, metrics):
+    client.get('/store-in-session/k1/value1/')
+    assert counts(metrics) == {'serialize': 1, 'put': 1, 'set_cookie': 1}
+
+    client.get('/dump-session/')
+    assert counts(metrics) == {'serialize': 1, 'put': 1, 'set_cookie': 1,
+                               'signature': 1, 'get': 1, 'deserialize': 1}
+    assert metrics.sizes['get'].sum == metrics.sizes['put'].sum > 0
+
+    client.get('/destroy-session/')
+    assert counts(metrics)['delete'] == 1
+
+
+def test_events(app, client, metrics):
+    client.get('/store-in-session/k1/value1/')
+    client.get('/store-in-session/k1/value1/')
+    assert metrics.events == {'write_skipped': 1}
+
+    app.kvsession_store.d.clear()
+    client.get('/dump-session/')
+    assert metrics.events['not_found'] == 1
+
+    client.set_cookie('localhost', 'session', 'invalid')
+    client.get('/dump-session/')
+    assert metrics.events['bad_signature'] == 1
+
+
+def test_cache_hit(app, client, metrics):
+    app.config['SESSION_CACHE_MAX_ENTRIES'] = 10
+    app.kvsession.init_app(app)
+
+    client.get('/store-in-session/k1/value1/')
+    client.get('/dump-session/')
+    assert metrics.events == {'cache_hit': 1}
+    assert 'get' not in metrics.latencies
+
+
+def test_hash_store(app, client, metrics):
+    app.kvsession.init_app(app, DictHashStore())
+
+    client.get('/store-in-session/k1/value1/')
+    client.get('/store-in-session/k2/value2/')
+    client.get('/dump-session/')
+    assert counts(metrics) == {'serialize': 2, 'put': 2, 'set_cookie': 2,
+                               'signature': 2, 'get': 2, 'deserialize': 2}
+
+
+def test_disabled_by_default(app, client):
+    assert app.kvsession_metrics is None
+    client.get('/store-in-session/k1/value1/')
+
+
+def test_histogram():
+    h = Histogram((1, 10))
+    for value in (0.5, 1, 5, 50):
+        h.observe(value)
+
+    assert h.cumulative() == [(1, 2), (10, 3), (float('inf'), 4)]
+    assert h.sum == 56.5
+
+
+def test_prometheus():
+    metrics = MetricsCollector(latency_buckets=(0.1, 1))
+    metrics.observe('get', 0.5, 100)
+    metrics.increment('cache_hit')
+
+    text = metrics.prometheus()
+    assert '# TYPE kvsession_phase_seconds histogram' in text
+    assert 'kvsession_phase_seconds_bucket{phase="get",le="0.1"} 0' in text
+    assert 'kvsession_phase_seconds_bucket{phase="get",le="1"} 1' in text
+    assert 'kvsession_phase_seconds_bucket{phase="get",le="+Inf"} 1' in text
+    assert 'kvsession_phase_seconds_count{phase="get"} 1' in text
+    assert 'kvsession_phase_bytes_sum{phase="get"} 100' in text
+    assert 'kvsession_events_total{event="cache_hit"} 1' in text
+
+    assert metrics.stats()['phases']['get']['mean'] == 0.5
@@ -0,0 +1,261 @@
+import json
+
+from flask import session
+from flask_kvsession.hashstore import DictHashStore
+from flask_kvsession.pipeline import execute, Operation
+from simplekv.memory import DictStore
+import pytest
+
+
+class RecordingStore(DictStore):
+    def __init__(self):
+        super(RecordingStore, self).__init__()
+        self.calls = []
+
+    def put(self, key, data, *args):
+        self.calls.append('put')
+        return super(RecordingStore, self).put(key, data, *args)
+
+    def delete(self, key):
+        self.calls.append('delete')
+        return super(RecordingStore, self).delete(key)
+
+
+class BatchStore(RecordingStore):
+    def execute_batch(self, operations):
+        self.calls.append([method for method, _ in operations])
+        for method, args in operations:
+            getattr(DictStore, method)(self, *args)
+
+
+@pytest.fixture(params=[RecordingStore, BatchStore])
+def store(request):
+    return request.param()
+
+
+@pytest.fixture
+def pipelined(app):
+    app.config['SESSION_PIPELINE'] = True
+    app.kvsession.init_app(app)
+
+    @app.route('/login/<name>/')
+    def login(name):
+        session.regenerate()
+        session['user'] = name
+        return 'ok'
+
+    @app.route('/restart/')
+    def restart():
+        session.destroy()
+        session['fresh'] = True
+        return 'ok'
+
+    return app
+
+
+def batched(store, calls):
+    # the calls made with or without batch support
+    if isinstance(store, BatchStore):
+        return [calls]
+    return calls
+
+
+def dump(client):
+    return json.loads(client.get('/dump-session/').data.decode())
+
+
+def test_regenerate_and_write(client, store, pipelined):
+    client.get('/store-in-session/k1/value1/')
+    del store.calls[:]
+
+    client.get('/login/alice/')
+    assert store.calls == batched(store, ['delete', 'put'])
+    assert len(store.keys()) == 1
+    assert dump(client) == {'k1': 'value1', 'user': 'alice'}
+
+
+def test_destroy_and_write(client, store, pipelined):
+    client.get('/store-in-session/k1/value1/')
+    del store.calls[:]
+
+    client.get('/restart/')
+    assert store.calls == batched(store, ['delete', 'put'])
+    assert len(store.keys()) == 1
+    assert dump(client) == {'fresh': True}
+
+
+def test_destroy_only(client, store, pipelined):
+    client.get('/store-in-session/k1/value1/')
+    del store.calls[:]
+
+    client.get('/destroy-session/')
+    assert store.calls == ['delete']
+    assert store.keys() == []
+
+
+def test_regenerate_only(client, store, pipelined):
+    client.get('/store-in-session/k1/value1/')
+    del store.calls[:]
+
+    client.get('/regenerate-session/')
+    assert store.calls == batched(store, ['delete', 'put'])
+    assert dump(client) == {'k1': 'value1'}
+
+
+def test_disabled_by_default(client, store):
+    client.get('/store-in-session/k1/value1/')
+    del store.calls[:]
+
+    client.get('/regenerate-session/')
+    assert store.calls == ['delete', 'put']
+
+
+def test_cache_invalidated(app, client, store, pipelined):
+    app.config['SESSION_CACHE_MAX_ENTRIES'] = 10
+    app.kvsession.init_app(app)
+
+    client.get('/store-in-session/k1/value1/')
+    old = store.keys()[0]
+    client.get('/login/alice/')
+
+    assert app.kvsession_cache.lookup(old) is None
+
+
+def test_hash_store(app, client, pipelined):
+    store = DictHashStore()
+    app.kvsession.init_app(app, store)
+
+    client.get('/store-in-session/k1/value1/')
+    client.get('/login/alice/')
+
+    assert len(store.keys()) == 1
+    assert dump(client) == {'k1': 'value1', 'user': 'alice'}
+
+
+def test_execute_fallback():
+    store = RecordingStore()
+    execute(store, [Operation('put', ('a', b'1')), Operation('delete', ('a',)),
+                    Operation('put', ('b', b'2'))])
+
+    assert store.calls == ['put', 'delete', 'put']
+    assert store.keys() == ['b']
+
+
+def test_redis_batch(redis):
+    from flask_kvsession.hashstore import RedisHashStore
+
+    store = RedisHashStore(redis)
+    store.put('old', b'data')
+    store.execute_batch([
+        Operation('delete', ('old',)),
+        Operation('put', ('new', b'value', 60)),
+        Operation('put_fields', ('hash', {'k': b'v'}, 60)),
+        Operation('update_fields', ('hash', {'k2': b'v2'}, ['k'])),
+    ])
+
+    assert sorted(store.keys()) == ['hash', 'new']
+    assert store.get('new') == b'value'
+    assert store.get_fields('hash') == {'k2': b'v2'}
+
+
+class RecordingRedis(object):
+    # the commands a RedisStore sends, executed on a dictionary
+    def __init__(self):
+        self.d = {}
+        self.round_trips = []
+
+    def get(self, key):
+        return self.d.get(key)
+
+    def set(self, key, value):
+        self.round_trips.append(['set'])
+        self.d[key] = value
+
+    def setex(self, key, ttl, value):
+        self.round_trips.append(['setex'])
+        self.d[key] = value
+
+    def delete(self, key):
+        self.round_trips.append(['delete'])
+        self.d.pop(key, None)
+
+    def pipeline(self):
+        return RecordingPipeline(self)
+
+
+class RecordingPipeline(object):
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def set(self, key, value):
+        self.commands.append(('set', key, value))
+
+    def psetex(self, key, ttl, value):
+        self.commands.append(('psetex', key, value))
+
+    def delete(self, key):
+        self.commands.append(('delete', key, None))
+
+    def execute(self):
+        self.redis.round_trips.append([c[0] for c in self.commands])
+        for command, key, value in self.commands:
+            if command == 'delete':
+                self.redis.d.pop(key, None)
+            else:
+                self.redis.d[key] = value
+
+
+@pytest.mark.parametrize('store', [RecordingStore], indirect=True)
+def test_plain_redis_store(app, client):
+    from simplekv.memory.redisstore import RedisStore
+
+    store = RedisStore(RecordingRedis())
+    app.config['SESSION_PIPELINE'] = True
+    app.kvsession.init_app(app, store)
+
+    client.get('/store-in-session/k1/value1/')
+    del store.redis.round_trips[:]
+
+    client.get('/regenerate-session/')
+    assert store.redis.round_trips == [['delete', 'psetex']]
+    assert len(store.redis.d) == 1
+    assert dump(client) == {'k1': 'value1'}
+
+
+@pytest.mark.parametrize('store', [RecordingStore], indirect=True)
+def test_proxied_redis_store(app, client):
+    from simplekv.memory.redisstore import RedisStore
+    from flask_kvsession.local import LocalStore
+
+    redis = RecordingRedis()
+    store = LocalStore(lambda: RedisStore(redis))
+    app.config['SESSION_PIPELINE'] = True
+    app.kvsession.init_app(app, store)
+
+    client.get('/store-in-session/k1/value1/')
+    del redis.round_trips[:]
+
+    client.get('/regenerate-session/')
+    assert redis.round_trips == [['delete', 'psetex']]
+    assert dump(client) == {'k1': 'value1'}
+
+
+def test_redis_store_unwrapped():
+    from simplekv.decorator import PrefixDecorator, StoreDecorator
+    from simplekv.memory.redisstore import RedisStore
+    from flask_kvsession.local import LocalStore
+    from flask_kvsession.redisstore import is_redis_store, redis_store
+    from flask_kvsession.replicated import ReplicatedStore
+    from flask_kvsession.tiered import TieredStore
+
+    redis = RedisStore(RecordingRedis())
+    assert redis_store(redis) is redis
+    assert redis_store(LocalStore(lambda: redis)) is redis
+    assert redis_store(StoreDecorator(redis)) is redis
+    assert redis_store(ReplicatedStore(redis, [DictStore()])) is redis
+
+    # writing past these would skip the tier or use the wrong keys
+    assert not is_redis_store(TieredStore(redis))
+    assert not is_redis_store(PrefixDecorator('p_', redis))
+    assert not is_redis_store(LocalStore(DictStore))
@@ -0,0 +1,221 @@
+import json
+import time
+
+from flask_kvsession import KVSessionExtension
+
+from flask_kvsession.replicated import ReplicatedStore
+from simplekv.memory import DictStore
+import pytest
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Primary(DictStore):
+    """Records writes for replicas to apply later."""
+
+    def __init__(self, clock):
+        super(Primary, self).__init__()
+        self.clock = clock
+        self.log = []
+
+    def put(self, key, data, *args):
+        self.log.append((self.clock(), key, data))
+        return super(Primary, self).put(key, data)
+
+    def delete(self, key):
+        self.log.append((self.clock(), key, None))
+        return super(Primary, self).delete(key)
+
+
+class Replica(DictStore):
+    """Applies writes made to ``primary`` ``lag`` seconds later."""
+
+    def __init__(self, primary, lag):
+        super(Replica, self).__init__()
+        self.primary = primary
+        self.lag = lag
+        self.applied = 0
+        self.reads = 0
+
+    def get(self, key):
+        log = self.primary.log
+        while (self.applied < len(log) and
+               log[self.applied][0] + self.lag <= self.primary.clock()):
+            _, k, data = log[self.applied]
+            if data is None:
+                self.d.pop(k, None)
+            else:
+                self.d[k] = data
+            self.applied += 1
+
+        self.reads += 1
+        return super(Replica, self).get(key)
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def primary(clock):
+    return Primary(clock)
+
+
+@pytest.fixture
+def replicas(primary):
+    return [Replica(primary, 2), Replica(primary, 2)]
+
+
+@pytest.fixture
+def store(primary, replicas, clock):
+    return ReplicatedStore(primary, replicas, marker_ttl=5, clock=clock)
+
+
+def test_reader(store, primary, replicas, clock):
+    store.put('k', b'one')
+    written = clock.now
+
+    assert store.reader(written) is primary
+    assert store.reader(None) is store
+
+    clock.now += 10
+    assert store.reader(written) is store
+    assert store.get('k') == b'one'
+    assert store.get('k') == b'one'
+    assert [r.reads for r in replicas] == [1, 1]
+    assert store.primary_reads == 1
+
+
+def test_lagging_replica(store, primary, clock):
+    store.put('k', b'one')
+    clock.now += 10
+    assert store.get('k') == b'one'
+
+    # without a write time, the replica is read despite lagging behind
+    store.put('k', b'two')
+    clock.now += 1
+    assert store.get('k') == b'one'
+
+    clock.now += 2
+    assert store.get('k') == b'two'
+
+
+def test_missing_on_replica_falls_back(store, primary):
+    primary.put('k', b'one')
+    assert store.get('k') == b'one'
+    assert store.primary_reads == 1
+
+    with pytest.raises(KeyError):
+        store.get('missing')
+
+
+def test_delete_hides_key(store, clock):
+    store.put('k', b'one')
+    clock.now += 10
+    store.get('k')
+    store.delete('k')
+
+    with pytest.raises(KeyError):
+        store.reader(clock.now).get('k')
+
+
+def test_unavailable_replica_skipped(primary, clock):
+    class BrokenReplica(DictStore):
+        def get(self, key):
+            raise IOError('connection refused')
+
+    store = ReplicatedStore(primary, [BrokenReplica()], clock=clock)
+    primary.put('k', b'one')
+    assert store.get('k') == b'one'
+
+
+def test_least_latency(primary, clock):
+    fast = Replica(primary, 0)
+    slow = Replica(primary, 0)
+    store = ReplicatedStore(primary, [slow, fast], selection='least-latency',
+                            probe_interval=4, clock=clock)
+    store.latencies = [1.0, 0.001]
+
+    primary.put('k', b'one')
+    for _ in range(8):
+        store.get('k')
+
+    # only the probing reads go to the slow replica
+    assert slow.reads == 2
+    assert fast.reads == 6
+
+
+def test_invalid_selection(primary, replicas):
+    with pytest.raises(ValueError):
+        ReplicatedStore(primary, replicas, selection='random')
+
+
+def test_sessions(app, client, store, clock):
+    clock.now = time.time()
+    client.get('/store-in-session/k1/value1/')
+    rv = client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'value1'}
+
+    clock.now += 10
+    rv = client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'value1'}
+    assert store.stats()['replica_reads'] == [1, 0]
+
+    app.permanent_session_lifetime = -1
+    assert app.kvsession.cleanup_sessions(app).deleted == 1
+
+
+def test_own_writes_seen_by_other_workers(app, client, primary, replicas,
+                                          clock):
+    # the clock only drives replication, write times are real
+    workers = [ReplicatedStore(primary, replicas, marker_ttl=5)
+               for _ in range(2)]
+
+    KVSessionExtension(workers[0], app)
+    client.get('/store-in-session/k1/value1/')
+    clock.now += 10
+
+    # another worker changes the session, replicas lag behind
+    KVSessionExtension(workers[1], app)
+    client.get('/store-in-session/k1/value2/')
+    clock.now += 1
+
+    # the next request reaches the first worker
+    KVSessionExtension(workers[0], app)
+    rv = client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'value2'}
+
+    # destroyed sessions are not read back from a lagging replica
+    client.get('/destroy-session/')
+    rv = client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {}
+
+
+def test_own_writes_seen_with_write_behind(app, client, primary, replicas,
+                                           clock):
+    app.config['SESSION_WRITE_BEHIND'] = True
+    workers = [ReplicatedStore(primary, replicas, marker_ttl=5)
+               for _ in range(2)]
+
+    KVSessionExtension(workers[0], app)
+    client.get('/store-in-session/k1/value1/')
+    app.kvsession_write_behind.close()
+    clock.now += 10
+
+    KVSessionExtension(workers[1], app)
+    client.get('/store-in-session/k1/value2/')
+    app.kvsession_write_behind.close()
+    clock.now += 1
+
+    # nothing is pending in the queue of the first worker
+    KVSessionExtension(workers[0], app)
+    rv = client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'value2'}
+    app.kvsession_write_behind.close()
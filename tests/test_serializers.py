@@ -0,0 +1,148 @@
+from datetime import datetime
+import json
+import pickle
+
+from flask_kvsession.serializers import (dump_payload, get_serializer,
+                                         load_payload, serializers,
+                                         TaggedJSONSerializer)
+import pytest
+
+
+SAMPLE = {
+    'user_id': 1234,
+    'name': u'J\xfcrgen',
+    'ratio': 0.5,
+    'flags': [True, False, None],
+    'login': datetime(2011, 8, 10, 15, 46, 0, 123),
+    'token': b'\x00\xffbinary',
+    'pair': (1, (2, 'x')),
+    'nested': {'a': {'b': [1, 2]}},
+    'lookalike': {' t': 'not a tuple'},
+}
+
+
+@pytest.fixture(params=sorted(serializers))
+def serializer(request):
+    return serializers[request.param]
+
+
+def test_roundtrip(serializer):
+    assert serializer.loads(serializer.dumps(SAMPLE)) == SAMPLE
+
+
+def test_payload_header(serializer):
+    payload = dump_payload(serializer, SAMPLE)
+
+    assert payload[:1] == serializer.tag
+    assert load_payload(payload) == SAMPLE
+
+
+def test_legacy_payload_uses_fallback():
+    legacy = pickle.dumps({'k': 'v'})
+    assert load_payload(legacy) == {'k': 'v'}
+
+    legacy_json = json.dumps({'k': 'v'}).encode('ascii')
+    assert load_payload(legacy_json, json) == {'k': 'v'}
+
+    legacy_proto0 = pickle.dumps({'k': 'v'}, 0)
+    assert load_payload(legacy_proto0) == {'k': 'v'}
+
+
+def test_json_rejects_aware_datetime():
+    from datetime import timedelta, tzinfo
+
+    class UTC(tzinfo):
+        def utcoffset(self, dt):
+            return timedelta(0)
+
+    with pytest.raises(TypeError):
+        TaggedJSONSerializer().dumps({'t': datetime(2011, 1, 1,
+                                                    tzinfo=UTC())})
+
+
+def test_json_dumps_limited():
+    serializer = TaggedJSONSerializer()
+    data = serializer.dumps(SAMPLE)
+
+    for value in (SAMPLE, {}, {' t': [1]}):
+        assert serializer.dumps_limited(value, 1000) == \
+            serializer.dumps(value)
+    assert serializer.dumps_limited(SAMPLE, len(data)) == data
+    assert serializer.dumps_limited(SAMPLE, len(data) - 1) is None
+
+    # keys after the limit is reached are not serialized
+    unserializable = {'big': 'x' * 100, 'other': object()}
+    assert serializer.dumps_limited(unserializable, 50) is None
+    with pytest.raises(TypeError):
+        serializer.dumps_limited(unserializable, 1000)
+
+    with pytest.raises(TypeError):
+        serializer.dumps_limited({1: 'v'}, 1000)
+
+
+def test_msgpack_available():
+    pytest.importorskip('msgpack')
+    assert 'msgpack' in serializers
+
+
+def test_unknown_serializer():
+    with pytest.raises(ValueError):
+        get_serializer('nonexistant')
+
+
+def test_configured_serializer_is_used(store, app, client):
+    app.config['SESSION_SERIALIZER'] = 'json'
+    app.kvsession.init_app(app)
+
+    client.get('/store-datetime/')
+    payload = store.get(list(store.keys())[0])
+    assert payload[:1] == serializers['json'].tag
+
+    rv = client.get('/dump-datetime/')
+    assert rv.data == b'2011-08-10 15:46:00'
+
+
+def test_mixed_formats_readable(store, app, client):
+    client.get('/store-in-session/k1/value1/')
+
+    # switch serializers, the old session is still readable and rewritten
+    # in the new format on the next change
+    app.config['SESSION_SERIALIZER'] = 'json'
+    app.kvsession.init_app(app)
+
+    rv = client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'value1'}
+
+    client.get('/store-in-session/k2/value2/')
+    payload = store.get(list(store.keys())[0])
+    assert payload[:1] == serializers['json'].tag
+
+
+def test_legacy_session_readable(store, app, client):
+    client.get('/store-in-session/k1/value1/')
+    key = list(store.keys())[0]
+    store.put(key, pickle.dumps({'k1': 'legacy'}))
+
+    rv = client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'legacy'}
+
+
+def test_default_writes_legacy_payloads(store, app, client):
+    client.get('/store-in-session/k1/value1/')
+
+    # readable by versions before 0.7
+    payload = store.get(list(store.keys())[0])
+    assert pickle.loads(payload) == {'k1': 'value1'}
+
+
+def test_compression_writes_headers(store, app, client):
+    app.config['SESSION_COMPRESSION'] = 'zlib'
+    app.kvsession.init_app(app)
+    assert app.kvsession_serializer is serializers['pickle']
+
+
+def test_json_rejects_non_string_keys():
+    with pytest.raises(TypeError):
+        TaggedJSONSerializer().dumps({1: 'a'})
+    with pytest.raises(TypeError):
+        TaggedJSONSerializer().dumps({'k': {(1, 2): 'a'}})
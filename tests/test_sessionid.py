@@ -1,7 +1,16 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import time
 
-from flask_kvsession import SessionID
+from flask_kvsession import KVSessionExtension, SessionID
+from flask_kvsession.sessionid import (key_id_part, key_timestamp,
+                                      session_key_regex)
+from simplekv.memory import DictStore
+import pytest
+
+
+@pytest.fixture
+def store():
+    return DictStore()
 
 
 def test_serialize():
@@ -13,7 +22,8 @@ def test_serialize():
 
 
 def test_automatic_created_date():
-    start = datetime.utcnow()
+    # creation times have a resolution of one second
+    start = datetime.utcnow().replace(microsecond=0)
     sid = SessionID(0)
     end = datetime.utcnow()
 
@@ -33,3 +43,81 @@ def test_serialize_unserialize():
 
     assert sid.id == restored_sid.id
     assert sid.created == restored_sid.created
+
+
+@pytest.mark.parametrize('id', [0, 1, 255, 256, 59034, 2 ** 64 - 1])
+def test_compact(id):
+    sid = SessionID(id, 0x5f5e1000)
+    data = sid.serialize(compact=True)
+
+    assert data.startswith('z')
+    assert KVSessionExtension.key_regex.match(data)
+    assert key_timestamp(data) == 0x5f5e1000
+
+    restored_sid = SessionID.unserialize(data)
+    assert (restored_sid.id, restored_sid.timestamp) == (id, 0x5f5e1000)
+
+
+@pytest.mark.parametrize('key_bits', [8, 16, 24, 100, 128])
+def test_compact_key_bits(key_bits):
+    regex = session_key_regex(key_bits)
+    for id in [0, 1, 2 ** key_bits - 1]:
+        data = SessionID(id, 0x5f5e1000).serialize(True, key_bits)
+        assert regex.match(data)
+        assert SessionID.unserialize(data).id == id
+
+    # ids are padded to a fixed length
+    assert not regex.match(SessionID(1, 0x5f5e1000).serialize(
+        True, key_bits + 24))
+
+
+def test_compact_shorter():
+    sid = SessionID(0x1234567890abcdef, 0x5f5e1000)
+    assert sid.serialize(compact=True) == 'zEjRWeJCrze8X14QAA'
+    assert len(sid.serialize(compact=True)) < len(sid.serialize())
+
+
+def test_key_parts():
+    assert key_timestamp('ab_5f5e1000') == 0x5f5e1000
+    assert key_id_part('ab_5f5e1000') == 'ab'
+    assert key_id_part('zEjRWeJCrze8X14QAA') == 'zEjRWeJCrze8'
+
+
+def test_has_expired():
+    sid = SessionID(1, 1000)
+    lifetime = timedelta(seconds=60)
+
+    assert not sid.has_expired(lifetime, 1060)
+    assert sid.has_expired(lifetime, 1060.5)
+    assert sid.has_expired(60, 1061)
+    assert sid.has_expired(lifetime, datetime.utcfromtimestamp(1060.5))
+    assert not sid.has_expired(lifetime, datetime.utcfromtimestamp(1060))
+
+
+def test_slots():
+    sid = SessionID(1)
+    with pytest.raises(AttributeError):
+        sid.other = 1
+
+    sid.created = datetime(2011, 7, 9, 13, 14, 15)
+    assert sid.timestamp == 1310217255
+
+
+def test_compact_sessions(app, client):
+    app.config['SESSION_KEY_FORMAT'] = 'compact'
+    app.config['SESSION_EXPIRY_INDEX'] = True
+    app.kvsession.init_app(app)
+
+    client.get('/store-in-session/k1/value1/')
+    assert client.get('/dump-session/').data != b'{}'
+
+    sid_s = [k for k in app.kvsession_store.keys()
+             if k.startswith('z')]
+    assert len(sid_s) == 1
+
+    index = app.kvsession_expiry_index
+    assert index.bucket_of(sid_s[0]) == int(time.time()) // 3600
+
+    app.permanent_session_lifetime = timedelta(seconds=-10)
+    result = app.kvsession.cleanup_sessions(app, use_index=False)
+    assert result.deleted == 1
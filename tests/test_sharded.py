@@ -0,0 +1,180 @@
+import json
+import re
+
+from flask_kvsession.cleanup import cleanup_store
+from flask_kvsession.hashstore import DictHashStore
+from flask_kvsession.sharded import ShardedStore
+from simplekv.memory import DictStore
+import pytest
+
+
+def session_keys(n, created=0x50000000):
+    return ['%016x_%x' % (i * 7919 + 1, created) for i in range(n)]
+
+
+@pytest.fixture
+def shards():
+    return {'a': DictStore(), 'b': DictStore(), 'c': DictStore()}
+
+
+@pytest.fixture
+def store(shards):
+    return ShardedStore(shards)
+
+
+def test_keys_distributed(store, shards):
+    for key in session_keys(300):
+        store.put(key, b'x')
+
+    for shard in shards.values():
+        assert 50 < len(shard.keys()) < 150
+    assert len(store.keys()) == 300
+
+    for key in session_keys(300):
+        assert store.get(key) == b'x'
+
+
+def test_only_id_is_hashed(store):
+    assert (store.shard_for('00ff00ff_1') ==
+            store.shard_for('00ff00ff_2'))
+
+
+def test_other_keys_distributed(store):
+    names = set(store.shard_for('kvsession_index_%x' % i)
+                for i in range(30))
+    names.update(store.shard_for('kvsession_version_' + key)
+                 for key in session_keys(30))
+    assert names == set(['a', 'b', 'c'])
+
+
+def test_weights():
+    shards = {'small': DictStore(), 'large': DictStore()}
+    store = ShardedStore(shards, weights={'large': 3})
+
+    for key in session_keys(400):
+        store.put(key, b'x')
+
+    assert len(shards['large'].keys()) > 2 * len(shards['small'].keys())
+
+
+def test_add_shard_moves_few_keys(store, shards):
+    keys = session_keys(400)
+    for key in keys:
+        store.put(key, b'x')
+    before = dict((key, store.shard_for(key)) for key in keys)
+
+    new = DictStore()
+    moved = store.add_shard('d', new)
+
+    assert moved == len(new.keys())
+    assert 50 < moved < 150
+    for key in keys:
+        assert store.get(key) == b'x'
+        if key not in new:
+            assert store.shard_for(key) == before[key]
+
+
+class HookedStore(DictStore):
+    """Calls ``hook`` on the first write, while a shard is being added."""
+
+    def __init__(self, hook):
+        super(HookedStore, self).__init__()
+        self.hook = hook
+
+    def put(self, key, data, *args):
+        hook, self.hook = self.hook, None
+        if hook is not None:
+            hook(key)
+        return super(HookedStore, self).put(key, data, *args)
+
+
+def test_add_shard_concurrent_access(store):
+    keys = session_keys(400)
+    for key in keys:
+        store.put(key, b'x')
+    seen = {}
+
+    def during_move(first):
+        moving = [k for k in keys if store.shard_for(k) == 'd']
+        seen['reads'] = [store.get(k) for k in moving]
+
+        rest = [k for k in moving if k != first]
+        store.put(rest[0], b'new')
+        store.delete(rest[1])
+        seen['changed'] = rest[:2]
+
+    store.add_shard('d', HookedStore(during_move))
+
+    # keys not moved yet were read from their old shard
+    assert set(seen['reads']) == set([b'x'])
+
+    written, deleted = seen['changed']
+    assert store.get(written) == b'new'
+    assert deleted not in store
+    with pytest.raises(KeyError):
+        store.get(deleted)
+
+
+def test_add_shard_ttl(store):
+    from simplekv import TimeToLiveMixin
+
+    class TTLStore(TimeToLiveMixin, DictStore):
+        def __init__(self):
+            super(TTLStore, self).__init__()
+            self.ttls = []
+
+        def _put(self, key, data, ttl_secs):
+            self.ttls.append(ttl_secs)
+            self.d[key] = data
+            return key
+
+    for key in session_keys(100):
+        store.put(key, b'x')
+
+    with pytest.raises(ValueError):
+        store.add_shard('d', TTLStore())
+    assert 'd' not in store.shards
+
+    new = TTLStore()
+    assert store.add_shard('d', new, ttl_secs=600) == len(new.ttls)
+    assert set(new.ttls) == set([600])
+
+
+def test_counters(store):
+    key = session_keys(1)[0]
+    store.put(key, b'x')
+    store.get(key)
+    store.get(key)
+    store.delete(key)
+
+    name = store.shard_for(key)
+    assert store.stats()[name] == {'put': 1, 'get': 2, 'delete': 1}
+
+
+def test_capabilities():
+    store = ShardedStore({'a': DictHashStore(), 'b': DictStore()})
+    assert not store.hash_support
+    assert not store.ttl_support
+
+    store = ShardedStore({'a': DictHashStore(), 'b': DictHashStore()})
+    assert store.hash_support
+
+
+def test_cleanup_all_shards(store, shards):
+    for key in session_keys(100, created=100) + session_keys(50, created=900):
+        store.put(key, b'x')
+
+    result = cleanup_store(store, 500, re.compile('^[0-9a-f]+_[0-9a-f]+$'),
+                           now=1000)
+    assert result.scanned == 150
+    assert result.deleted == 100
+    assert len(store.keys()) == 50
+
+
+def test_sessions(app, client, store):
+    client.get('/store-in-session/k1/value1/')
+    rv = client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'value1'}
+
+    app.permanent_session_lifetime = -1
+    assert app.kvsession.cleanup_sessions(app).deleted == 1
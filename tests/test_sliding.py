@@ -0,0 +1,152 @@
+from datetime import timedelta
+import json
+import time
+
+from simplekv import TimeToLiveMixin
+from simplekv.memory import DictStore
+from simplekv.memory.redisstore import RedisStore
+import pytest
+
+
+class TTLDictStore(TimeToLiveMixin, DictStore):
+    # pretends to support time-to-live, recording every put
+    def __init__(self):
+        super(TTLDictStore, self).__init__()
+        self.puts = []
+
+    def _put(self, key, data, ttl_secs):
+        self.puts.append((key, ttl_secs))
+        self.d[key] = data
+        return key
+
+    def _put_file(self, key, file, ttl_secs):
+        return self._put(key, file.read(), ttl_secs)
+
+
+class TouchableStore(TTLDictStore):
+    def __init__(self):
+        super(TouchableStore, self).__init__()
+        self.touches = []
+
+    def touch(self, key, ttl_secs):
+        self.touches.append((key, ttl_secs))
+
+
+class RecordingRedis(object):
+    # the commands RedisStore sends, without expiration
+    def __init__(self):
+        self.d = {}
+        self.commands = []
+
+    def get(self, key):
+        return self.d.get(key)
+
+    def set(self, key, value):
+        self.commands.append('set')
+        self.d[key] = value
+
+    def setex(self, key, ttl, value):
+        self.commands.append('setex')
+        self.d[key] = value
+
+    def pexpire(self, key, ttl):
+        self.commands.append('pexpire')
+
+    def delete(self, key):
+        self.d.pop(key, None)
+
+
+@pytest.fixture(params=['touchable', 'ttl', 'dict', 'pexpire'])
+def store(request):
+    if request.param == 'touchable':
+        return TouchableStore()
+    if request.param == 'ttl':
+        return TTLDictStore()
+    if request.param == 'pexpire':
+        return RedisStore(RecordingRedis())
+    return DictStore()
+
+
+@pytest.fixture
+def sliding_app(app):
+    app.config['SESSION_SLIDING_EXPIRATION'] = True
+    app.config['SESSION_REFRESH_INTERVAL'] = 0
+    return app
+
+
+def dump(client):
+    return json.loads(client.get('/dump-session/').data.decode('ascii'))
+
+
+def test_read_refreshes_expiration(store, sliding_app, client):
+    client.get('/store-in-session/k1/value1/')
+    puts = len(getattr(store, 'puts', []))
+
+    rv = client.get('/dump-session/')
+    assert 'Set-Cookie' in rv.headers
+
+    if isinstance(store, TouchableStore):
+        assert len(store.touches) == 1
+        assert len(store.puts) == puts
+    elif isinstance(store, TTLDictStore):
+        # cannot touch, session is rewritten instead
+        assert len(store.puts) == puts + 1
+    elif isinstance(store, RedisStore):
+        assert store.redis.commands == ['setex', 'pexpire']
+
+
+def test_refresh_is_throttled(store, sliding_app, client):
+    sliding_app.config['SESSION_REFRESH_INTERVAL'] = timedelta(minutes=5)
+
+    client.get('/store-in-session/k1/value1/')
+    rv = client.get('/dump-session/')
+
+    assert 'Set-Cookie' not in rv.headers
+    assert not getattr(store, 'touches', [])
+
+
+def test_refresh_time_in_cookie(sliding_app, client):
+    client.get('/store-in-session/k1/value1/')
+    value = client.get_session_cookie().value
+
+    # sid, refresh time and signature
+    assert ':' in value.split('.')[0]
+
+
+@pytest.mark.parametrize('store', ['dict'], indirect=True)
+def test_sliding_session_outlives_lifetime(store, sliding_app, client,
+                                           monkeypatch):
+    sliding_app.permanent_session_lifetime = timedelta(seconds=100)
+
+    offset = [0]
+    real_time = time.time
+    monkeypatch.setattr(time, 'time', lambda: real_time() + offset[0])
+
+    client.get('/store-in-session/k1/value1/')
+    offset[0] += 60
+    assert dump(client) == {'k1': 'value1'}
+    offset[0] += 60
+    assert dump(client) == {'k1': 'value1'}
+
+    offset[0] += 120
+    assert dump(client) == {}
+
+
+def test_cookie_without_refresh_time_accepted(app, client):
+    client.get('/store-in-session/k1/value1/')
+
+    app.config['SESSION_SLIDING_EXPIRATION'] = True
+    assert dump(client) == {'k1': 'value1'}
+
+
+def test_proxied_redis_store_touched(app, client):
+    from flask_kvsession.local import LocalStore
+
+    redis = RecordingRedis()
+    app.config['SESSION_SLIDING_EXPIRATION'] = True
+    app.config['SESSION_REFRESH_INTERVAL'] = 0
+    app.kvsession.init_app(app, LocalStore(lambda: RedisStore(redis)))
+
+    client.get('/store-in-session/k1/value1/')
+    client.get('/dump-session/')
+    assert redis.commands == ['setex', 'pexpire']
@@ -0,0 +1,172 @@
+import json
+
+from flask_kvsession.tiered import TieredStore
+from simplekv import TimeToLiveMixin
+from simplekv.memory import DictStore
+from simplekv.memory.redisstore import RedisStore
+import pytest
+
+
+class CountingStore(DictStore):
+    def __init__(self):
+        super(CountingStore, self).__init__()
+        self.gets = []
+
+    def get(self, key):
+        self.gets.append(key)
+        return super(CountingStore, self).get(key)
+
+
+@pytest.fixture
+def shared():
+    return CountingStore()
+
+
+@pytest.fixture
+def store(shared):
+    return TieredStore(shared, max_entries=10)
+
+
+def test_reads_served_from_memory(store, shared):
+    store.put('k', b'value')
+    del shared.gets[:]
+
+    assert store.get('k') == b'value'
+    assert shared.gets == ['kvsession_version_k']
+    assert store.hits == 1
+
+
+def test_max_age_skips_validation(shared):
+    now = [1000]
+    store = TieredStore(shared, max_age=5, clock=lambda: now[0])
+    store.put('k', b'value')
+    del shared.gets[:]
+
+    assert store.get('k') == b'value'
+    assert shared.gets == []
+
+    now[0] += 10
+    assert store.get('k') == b'value'
+    assert shared.gets == ['kvsession_version_k']
+
+
+def test_write_by_other_worker_detected(shared):
+    a = TieredStore(shared)
+    b = TieredStore(shared)
+
+    a.put('k', b'one')
+    assert b.get('k') == b'one'
+
+    a.put('k', b'two')
+    assert b.get('k') == b'two'
+    assert b.stale == 1
+
+    b.delete('k')
+    with pytest.raises(KeyError):
+        a.get('k')
+
+
+def test_external_write_without_version(store, shared):
+    store.put('k', b'one')
+    shared.put('k', b'two')
+    shared.delete('kvsession_version_k')
+
+    assert store.get('k') == b'two'
+    assert store.get('k') == b'two'
+    assert store.stats()['entries'] == 0
+
+
+def test_size_bounded(store):
+    for i in range(20):
+        store.put('k%d' % i, b'x')
+
+    assert store.stats()['entries'] == 10
+
+
+def test_version_keys_hidden(store, shared):
+    store.put('k1', b'x')
+    store.put('k2', b'y')
+
+    assert sorted(store.keys()) == ['k1', 'k2']
+    assert len(shared.keys()) == 4
+
+    store.delete_many(['k1', 'k2'])
+    assert shared.keys() == []
+
+
+def test_sessions_shared_between_apps(app, client, store, shared):
+    client.get('/store-in-session/k1/value1/')
+
+    # a second worker with its own memory tier
+    app.kvsession.init_app(app, TieredStore(shared))
+    rv = client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'value1'}
+
+    client.get('/store-in-session/k1/value2/')
+    app.kvsession.init_app(app, store)
+    rv = client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'value2'}
+
+
+def test_cleanup(app, client, store, shared):
+    client.get('/store-in-session/k1/value1/')
+    assert app.kvsession.cleanup_sessions(app).deleted == 0
+
+    app.permanent_session_lifetime = -1
+    assert app.kvsession.cleanup_sessions(app).deleted == 1
+    assert shared.keys() == []
+
+
+class TTLDictStore(TimeToLiveMixin, DictStore):
+    # pretends to support time-to-live, recording every refresh
+    def __init__(self):
+        super(TTLDictStore, self).__init__()
+        self.refreshed = []
+
+    def _put(self, key, data, ttl_secs):
+        self.refreshed.append(key)
+        self.d[key] = data
+        return key
+
+
+class TouchableStore(TTLDictStore):
+    def touch(self, key, ttl_secs):
+        self.refreshed.append(key)
+
+
+class RecordingRedis(object):
+    def __init__(self):
+        self.d = {}
+        self.refreshed = []
+
+    def get(self, key):
+        return self.d.get(key)
+
+    def setex(self, key, ttl, value):
+        self.refreshed.append(key)
+        self.d[key] = value
+
+    def pexpire(self, key, ttl):
+        self.refreshed.append(key)
+
+
+@pytest.mark.parametrize('kind', ['touch', 'pexpire', 'rewrite'])
+def test_touch_refreshes_version(kind):
+    if kind == 'touch':
+        shared = TouchableStore()
+    elif kind == 'pexpire':
+        shared = RedisStore(RecordingRedis())
+    else:
+        shared = TTLDictStore()
+    refreshed = getattr(shared, 'redis', shared).refreshed
+
+    store = TieredStore(shared)
+    store.put('k', b'value', 60)
+    version = shared.get('kvsession_version_k')
+    del refreshed[:]
+
+    store.touch('k', 60)
+    assert refreshed == ['k', 'kvsession_version_k']
+    assert shared.get('kvsession_version_k') == version
+    assert store.get('k') == b'value'
+    assert store.hits == 1
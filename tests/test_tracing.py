@@ -0,0 +1,109 @@
+from flask_kvsession.metrics import MetricsCollector, MultiCollector
+from flask_kvsession.tracing import Tracer
+from simplekv.memory import DictStore
+import pytest
+
+
+@pytest.fixture
+def store():
+    return DictStore()
+
+
+@pytest.fixture
+def received():
+    return []
+
+
+@pytest.fixture
+def tracer(app, received):
+    tracer = Tracer(sample_rate=1, buffer_size=3, callback=received.append)
+    app.config['SESSION_TRACER'] = tracer
+    app.kvsession.init_app(app)
+    return tracer
+
+
+def tree(spans):
+    return [(s['name'], tree(s['children'])) for s in spans]
+
+
+def test_span_tree(client, tracer, received):
+    client.get('/store-in-session/k1/value1/')
+    client.get('/dump-session/')
+
+    assert len(received) == 2
+    write, read = received
+
+    assert write['path'] == '/store-in-session/k1/value1/'
+    assert tree(write['spans']) == [
+        ('open_session', []),
+        ('save_session', [('serialize', []), ('put', []),
+                          ('set_cookie', [])]),
+    ]
+    assert tree(read['spans']) == [
+        ('open_session', [('signature', []), ('get', []),
+                          ('deserialize', [])]),
+        ('save_session', []),
+    ]
+
+
+def test_span_details(client, tracer, received):
+    client.get('/store-in-session/k1/value1/')
+    save = received[0]['spans'][1]
+    serialize, put, set_cookie = save['children']
+
+    assert put['store'] == 'DictStore'
+    assert serialize['store'] is None
+    assert put['size'] == serialize['size'] > 0
+    assert save['size'] == max(serialize['size'], set_cookie['size'])
+    assert 0 <= save['start'] <= put['start']
+    assert put['duration'] <= save['duration'] <= received[0]['duration']
+
+
+def test_events(app, client, tracer, received):
+    client.get('/store-in-session/k1/value1/')
+    client.get('/store-in-session/k1/value1/')
+
+    assert received[1]['spans'][1]['events'] == ['write_skipped']
+
+
+def test_ring_buffer(client, tracer):
+    for i in range(5):
+        client.get('/store-in-session/k/%d/' % i)
+
+    assert [t['path'] for t in tracer.traces] == [
+        '/store-in-session/k/%d/' % i for i in (2, 3, 4)]
+
+
+def test_sampling(app, client, received):
+    rolls = iter([0.5, 0.05, 0.5])
+    app.config['SESSION_TRACER'] = Tracer(sample_rate=0.1,
+                                          callback=received.append,
+                                          random=lambda: next(rolls))
+    app.kvsession.init_app(app)
+
+    for i in range(3):
+        client.get('/store-in-session/k/%d/' % i)
+
+    assert [t['path'] for t in received] == ['/store-in-session/k/1/']
+
+
+def test_lazy_load_at_top_level(app, client, tracer, received):
+    app.config['SESSION_LAZY_LOAD'] = True
+    app.kvsession.init_app(app)
+
+    client.get('/store-in-session/k1/value1/')
+    client.get('/dump-session/')
+
+    assert [s['name'] for s in received[1]['spans']] == [
+        'open_session', 'get', 'deserialize', 'save_session']
+
+
+def test_used_with_collector(app, client, tracer, received):
+    metrics = MetricsCollector()
+    app.config['SESSION_METRICS'] = metrics
+    app.kvsession.init_app(app)
+    assert isinstance(app.kvsession_metrics, MultiCollector)
+
+    client.get('/store-in-session/k1/value1/')
+    assert metrics.latencies['put'].count == 1
+    assert len(received) == 1
@@ -0,0 +1,74 @@
+import json
+
+from simplekv.memory import DictStore
+import pytest
+
+
+class CountingStore(DictStore):
+    def __init__(self):
+        super(CountingStore, self).__init__()
+        self.puts = 0
+
+    def put(self, key, data, *args, **kwargs):
+        self.puts += 1
+        return super(CountingStore, self).put(key, data, *args, **kwargs)
+
+
+@pytest.fixture
+def store():
+    return CountingStore()
+
+
+def test_reassigning_same_value_skips_write(store, client):
+    client.get('/store-in-session/k1/value1/')
+    assert store.puts == 1
+
+    rv = client.get('/store-in-session/k1/value1/')
+    assert store.puts == 1
+    assert 'Set-Cookie' not in rv.headers
+
+    rv = client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'value1'}
+
+
+def test_changed_value_is_written(store, client):
+    client.get('/store-in-session/k1/value1/')
+    client.get('/store-in-session/k1/value2/')
+    assert store.puts == 2
+
+    rv = client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'value2'}
+
+
+def test_making_permanent_is_written(store, client):
+    client.get('/store-in-session/k1/value1/')
+    client.get('/make-session-permanent/')
+    assert store.puts == 2
+    assert client.get_session_cookie().expires is not None
+
+
+def test_regenerate_is_written(store, client):
+    client.get('/store-in-session/k1/value1/')
+    old_keys = list(store.keys())
+
+    client.get('/regenerate-session/')
+    assert store.puts == 2
+    assert list(store.keys()) != old_keys
+
+
+def test_skipping_with_cache(store, app, client):
+    app.config['SESSION_CACHE_MAX_ENTRIES'] = 10
+    app.kvsession.init_app(app)
+
+    client.get('/store-in-session/k1/value1/')
+    client.get('/store-in-session/k1/value1/')
+    assert store.puts == 1
+    assert app.kvsession_cache.hits == 1
+
+
+def test_skipping_can_be_disabled(store, app, client):
+    app.config['SESSION_SKIP_UNCHANGED'] = False
+
+    client.get('/store-in-session/k1/value1/')
+    client.get('/store-in-session/k1/value1/')
+    assert store.puts == 2
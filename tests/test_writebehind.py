@@ -0,0 +1,220 @@
+import json
+import os
+from threading import Event
+
+from flask_kvsession.hashstore import DictHashStore
+from flask_kvsession.writebehind import WriteBehindQueue
+from simplekv.memory import DictStore
+import pytest
+
+try:
+    from Queue import Full
+except ImportError:
+    from queue import Full
+
+
+class GatedStore(DictStore):
+    """Blocks writes of keys not in ``ungated`` until ``gate`` is set."""
+
+    def __init__(self):
+        super(GatedStore, self).__init__()
+        self.gate = Event()
+        self.gate.set()
+        self.ungated = set()
+        self.log = []
+
+    def put(self, key, data, *args, **kwargs):
+        if key not in self.ungated:
+            self.gate.wait()
+        self.log.append(('put', key, data))
+        return super(GatedStore, self).put(key, data, *args, **kwargs)
+
+    def delete(self, key):
+        self.gate.wait()
+        self.log.append(('delete', key))
+        return super(GatedStore, self).delete(key)
+
+
+@pytest.fixture
+def store():
+    return GatedStore()
+
+
+@pytest.fixture
+def app(app):
+    app.config['SESSION_WRITE_BEHIND'] = True
+    app.kvsession.init_app(app)
+    yield app
+    if app.kvsession_write_behind is not None:
+        app.kvsession_write_behind.close()
+
+
+def test_writes_reach_store(app, client, store):
+    client.get('/store-in-session/k1/value1/')
+    app.kvsession_write_behind.flush()
+
+    assert len(store.keys()) == 1
+    assert app.kvsession_write_behind.stats()['completed'] == 1
+
+
+def test_read_your_writes(app, client, store):
+    store.gate.clear()
+
+    client.get('/store-in-session/k1/value1/')
+    client.get('/store-in-session/k2/value2/')
+    assert store.keys() == []
+
+    rv = client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {'k1': 'value1',
+                                                   'k2': 'value2'}
+
+    store.gate.set()
+    app.kvsession_write_behind.flush()
+    assert len(store.keys()) == 1
+
+
+def test_pending_delete_hides_session(app, client, store):
+    client.get('/store-in-session/k1/value1/')
+    app.kvsession_write_behind.flush()
+
+    store.gate.clear()
+    client.get('/destroy-session/')
+
+    rv = client.get('/dump-session/')
+    assert json.loads(rv.data.decode('ascii')) == {}
+
+    store.gate.set()
+    app.kvsession_write_behind.flush()
+    assert store.keys() == []
+
+
+def test_operations_on_key_keep_order():
+    store = GatedStore()
+    store.gate.clear()
+    wb = WriteBehindQueue(store, workers=4)
+
+    for i in range(20):
+        wb.put('k', str(i).encode('ascii'))
+    wb.delete('k')
+    wb.put('k', b'last')
+
+    store.gate.set()
+    wb.close()
+
+    assert [entry[-1] for entry in store.log] == (
+        [str(i).encode('ascii') for i in range(20)] + ['k', b'last'])
+    assert store.get('k') == b'last'
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork()')
+def test_pending_cleared_after_fork():
+    store = GatedStore()
+    store.gate.clear()
+    wb = WriteBehindQueue(store, workers=1)
+    wb.put('a', b'1')
+
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            # the parent's pending write is not visible in the child
+            try:
+                wb.get('a')
+                ok = False
+            except KeyError:
+                ok = True
+
+            store.ungated.add('b')
+            wb.put('b', b'2')
+            wb.flush()
+            ok = ok and store.get('b') == b'2' and wb.stats()['pending'] == 0
+            os.write(w, b'1' if ok else b'0')
+        finally:
+            os._exit(0)
+
+    os.close(w)
+    os.waitpid(pid, 0)
+    assert os.read(r, 1) == b'1'
+    os.close(r)
+
+    assert wb.get('a') == b'1'
+    store.gate.set()
+    wb.close()
+    assert store.get('a') == b'1'
+
+
+def test_close_twice():
+    store = GatedStore()
+    wb = WriteBehindQueue(store, workers=2)
+    wb.put('a', b'1')
+
+    for _ in range(3):
+        wb.close()
+    assert store.get('a') == b'1'
+
+
+def test_overflow_sync():
+    store = GatedStore()
+    store.gate.clear()
+    wb = WriteBehindQueue(store, workers=1, queue_size=1, overflow='sync')
+
+    # the first write is picked up by the worker and blocks it, the second
+    # fills the queue
+    wb.put('a', b'1')
+    while wb.depth:
+        pass
+    wb.put('b', b'2')
+
+    store.ungated.add('c')
+    wb.put('c', b'3')
+    assert store.get('c') == b'3'
+    assert wb.sync_writes == 1
+
+    store.gate.set()
+    wb.close()
+    assert store.get('a') == b'1'
+    assert store.get('b') == b'2'
+
+
+def test_overflow_fail():
+    store = GatedStore()
+    store.gate.clear()
+    wb = WriteBehindQueue(store, workers=1, queue_size=1, overflow='fail')
+
+    wb.put('a', b'1')
+    while wb.depth:
+        pass
+    wb.put('b', b'2')
+
+    with pytest.raises(Full):
+        wb.put('c', b'3')
+
+    store.gate.set()
+    wb.close()
+    assert 'c' not in store
+
+
+def test_errors_are_counted():
+    class FailingStore(DictStore):
+        def put(self, key, data, *args, **kwargs):
+            raise IOError('unavailable')
+
+    wb = WriteBehindQueue(FailingStore())
+    wb.put('a', b'1')
+    wb.flush()
+
+    stats = wb.stats()
+    assert stats['errors'] == 1
+    assert stats['pending'] == 0
+    assert stats['depth'] == 0
+    wb.close()
+
+
+def test_invalid_overflow():
+    with pytest.raises(ValueError):
+        WriteBehindQueue(DictStore(), overflow='drop')
+
+
+def test_hash_stores_are_written_synchronously(app):
+    app.kvsession.init_app(app, DictHashStore())
+    assert app.kvsession_write_behind is None